@@ -1,14 +1,31 @@
 import re
 import json
+import logging
+import random
 import sqlite3
-from collections import defaultdict
-from dataclasses import dataclass, field
-from typing import Any, Dict, List, Optional, Tuple
-
+import threading
+import time
+import uuid
+from collections import deque
+from contextlib import contextmanager, nullcontext
+from dataclasses import asdict, dataclass, field
+from typing import Any, Deque, Dict, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
 import torch
 from transformers import AutoModelForCausalLM, AutoTokenizer
 
-from .embedder import KeywordEmbedder, DOMAIN_KEYWORDS, ProductDescriptionEmbedder
+from .db_pool import ReadOnlyConnectionPool
+from .embedder import DENSE_SCORE_TOLERANCE, KeywordEmbedder, KeywordMatch, DOMAIN_KEYWORDS, ProductDescriptionEmbedder
+from .facet_index import FacetIndex, Relaxation
+from .keyword_matrix import ProductKeywordMatrix, to_canonical_kw
+from .metrics import METRICS
+from .profiler import TurnProfile
+from .query_composer import ComposedQueryEncoder
+from .reranker import CrossEncoderReranker
+from .result_cache import RankedResultCache
+from .traffic import TRACE_VERSION, TraceWriter, TurnTrace, activate, active_trace, compact_state
+from .variant_clusters import VariantClusters
 
 DB_PATH = "data/canada_goose.db"
 
@@ -20,9 +37,58 @@ USE_4BIT = False
 LLM_MAX_NEW_TOKENS_JSON = 220
 LLM_MAX_NEW_TOKENS_Q = 80
 
+# Build query vectors from cached slot-component embeddings + the message only (see query_composer.py)
+COMPOSED_QUERY_EMBEDDINGS = False
+
+# Second-stage cross-encoder rerank of the top fused results (see reranker.py)
+CROSS_ENCODER_RERANK = False
+RERANK_MODEL = "cross-encoder/ms-marco-MiniLM-L-6-v2"
+RERANK_TOP_N = 20
+RERANK_BUDGET_MS = 150.0
+
+# Score one vector per cluster of near-duplicate variants and show variants under their best match (see variant_clusters.py)
+COLLAPSE_VARIANTS = False
+VARIANT_SIM_THRESHOLD = 0.9
+
+# Scored candidate sets shared across the sessions of one ChatResources (see result_cache.py); 0 disables
+RESULT_CACHE_ENTRIES = 256
+
+# Per-session memory bounds (the LLM prompts only look at the most recent entries)
+MAX_ASKED_QUESTIONS = 10
+HISTORY_MAX_MESSAGES = 12
+
+# Console logging (DEBUG shows per-slot merges, keyword mappings and ranking internals every turn)
+LOG_LEVEL = "INFO"
+# Stage latency histograms (see metrics.py), written here every METRICS_DUMP_INTERVAL_S by main(); None disables
+METRICS_DUMP_PATH: Optional[str] = "data/metrics.json"
+METRICS_DUMP_INTERVAL_S = 30.0
+# Opt-in per-turn CPU profiles (folded stacks + JSON tags, see profiler.py): sessions with profile=True
+# profile every turn, all others a random PROFILE_SAMPLE_RATE fraction of their turns
+PROFILE_SAMPLE_RATE = 0.0
+PROFILE_MODE = "sample"  # "sample" (sampler thread, cheap) or "trace" (every call, exact but slow)
+PROFILE_DIR = "data/profiles"
+# Append every turn (input, states, raw LLM outputs, results, stage times) to this JSONL trace for
+# src/test/replay_traces.py (see traffic.py); None disables recording
+TRACE_PATH: Optional[str] = None
+
+log = logging.getLogger(__name__)
+
 _tokenizer = None
 _model = None
 
+_trace_writer: Optional[TraceWriter] = None
+_trace_writer_lock = threading.Lock()
+
+
+def trace_writer() -> Optional[TraceWriter]:
+    global _trace_writer
+    if TRACE_PATH is None:
+        return None
+    with _trace_writer_lock:
+        if _trace_writer is None or _trace_writer.path != TRACE_PATH:
+            _trace_writer = TraceWriter(TRACE_PATH)
+        return _trace_writer
+
 
 def load_local_llm() -> None:
     global _tokenizer, _model
@@ -43,7 +109,46 @@ def load_local_llm() -> None:
     _model.eval()
 
 
-def llm_generate(system: str, user_payload: str, *, max_new_tokens: int, temperature: float) -> str:
+class _GenerationTimer:
+    """
+    Minimal generate() streamer: generate() puts the prompt ids first, then every new token,
+    so the second put marks the end of prefill.
+    """
+    def __init__(self) -> None:
+        self.started = time.perf_counter()
+        self.first_token: Optional[float] = None
+        self._puts = 0
+
+    def put(self, value: Any) -> None:
+        self._puts += 1
+        if self._puts == 2:
+            self.first_token = time.perf_counter()
+
+    def end(self) -> None:
+        pass
+
+
+def llm_generate(system: str, user_payload: str, *, max_new_tokens: int, temperature: float, stage: str = "llm") -> str:
+    """
+    stage names the metrics of this call: <stage>.prefill / <stage>.decode (ms) and <stage>.decode_tok_s.
+    In a traced turn the raw output is recorded; a replayed turn gets the recorded output instead (see traffic.py).
+    """
+    trace = active_trace()
+    if trace is not None and trace.replay is not None:
+        return trace.recorded_llm(stage)
+    t0 = time.perf_counter()
+    try:
+        raw = _run_llm(system, user_payload, max_new_tokens=max_new_tokens, temperature=temperature, stage=stage)
+    except Exception as e:
+        if trace is not None:
+            trace.add_llm(stage, error=repr(e), ms=(time.perf_counter() - t0) * 1000.0)
+        raise
+    if trace is not None:
+        trace.add_llm(stage, raw, ms=(time.perf_counter() - t0) * 1000.0)
+    return raw
+
+
+def _run_llm(system: str, user_payload: str, *, max_new_tokens: int, temperature: float, stage: str) -> str:
     load_local_llm()
 
     messages = [
@@ -54,6 +159,7 @@ def llm_generate(system: str, user_payload: str, *, max_new_tokens: int, tempera
 
     inputs = _tokenizer(prompt, return_tensors="pt").to(_model.device)
 
+    timer = _GenerationTimer()
     with torch.no_grad():
         out = _model.generate(
             **inputs,
@@ -61,7 +167,17 @@ def llm_generate(system: str, user_payload: str, *, max_new_tokens: int, tempera
             do_sample=(temperature > 0),
             temperature=temperature,
             pad_token_id=_tokenizer.eos_token_id,
+            streamer=timer,
         )
+    finished = time.perf_counter()
+
+    if timer.first_token is not None:
+        new_tokens = int(out.shape[1] - inputs["input_ids"].shape[1])
+        decode_s = finished - timer.first_token
+        METRICS.observe(f"{stage}.prefill", (timer.first_token - timer.started) * 1000.0)
+        METRICS.observe(f"{stage}.decode", decode_s * 1000.0)
+        if new_tokens > 1 and decode_s > 0:
+            METRICS.observe(f"{stage}.decode_tok_s", (new_tokens - 1) / decode_s)
 
     text = _tokenizer.decode(out[0], skip_special_tokens=True)
     return text.split(user_payload, 1)[-1].strip()
@@ -114,31 +230,6 @@ def parse_filters(q: str) -> Tuple[Optional[float], Optional[float], Optional[st
     return pmin, pmax, gender
 
 
-# -------------------------
-# Keyword canonicalization helpers
-# -------------------------
-def to_canonical_kw(s: str) -> str:
-    return (s or "").strip().lower().replace(" ", "_")
-
-
-def to_db_variants(canonical_kw: str) -> List[str]:
-    k = canonical_kw.strip().lower()
-    return list(dict.fromkeys([k, k.replace("_", " ")]))
-
-
-def normalize_gender_value(s: str) -> str:
-    t = (s or "").strip().lower()
-    if not t:
-        return ""
-    if "unisex" in t:
-        return "unisex"
-    if any(x in t for x in ["women", "woman", "female", "women's", "womens"]):
-        return "women"
-    if any(x in t for x in ["men", "man", "male", "men's", "mens"]):
-        return "men"
-    return ""
-
-
 # -------------------------
 # Retrieval + Ranking
 # -------------------------
@@ -151,9 +242,10 @@ class ScoredProduct:
     currency: str
     url: str
     gender: str
+    variants: List[str] = field(default_factory=list)
 
 
-@dataclass
+@dataclass(slots=True)
 class ConversationState:
     price_min: Optional[float] = None
     price_max: Optional[float] = None
@@ -167,10 +259,23 @@ class ConversationState:
     asked_questions: List[str] = field(default_factory=list)
     attempts: Dict[str, int] = field(default_factory=dict)
 
+    def remember_question(self, q: str) -> None:
+        # ring buffer of the last MAX_ASKED_QUESTIONS questions
+        self.asked_questions.append(q)
+        del self.asked_questions[:-MAX_ASKED_QUESTIONS]
+
     def bump_attempt(self, slot: str) -> int:
         self.attempts[slot] = int(self.attempts.get(slot, 0)) + 1
         return self.attempts[slot]
 
+    def filter_slots(self) -> Tuple[Any, ...]:
+        # structured filters applied after scoring (no re-encoding needed when only these change)
+        return self.price_min, self.price_max, self.gender
+
+    def text_slots(self) -> Tuple[Any, ...]:
+        # slots that feed the text query (see build_final_query)
+        return self.use_case, self.tei, self.waterproof, self.windproof, tuple(self.keywords)
+
     def missing_slots(self) -> List[str]:
         missing: List[str] = []
         if self.price_min is None and self.price_max is None:
@@ -182,130 +287,752 @@ class ConversationState:
         return missing
 
 
-def retrieve_and_rank_hybrid(
-    conn: sqlite3.Connection,
-    embedder: KeywordEmbedder,
-    desc_index: ProductDescriptionEmbedder,
-    user_query: str,
-    price_min: Optional[float] = None,
-    price_max: Optional[float] = None,
-    gender: Optional[str] = None,
-    top_keywords: int = 12,
-    kw_threshold: float = 0.42,
-    top_per_product: int = 4,
-    candidate_limit: int = 300,
-    return_k: int = 5,
-    alpha: float = 0.35,
-    beta: float = 0.65,
-) -> Tuple[List[ScoredProduct], List[Tuple[str, float]]]:
-    q = (user_query or "").strip().lower()
-    if not q:
-        return [], []
+# FTS5 lexical channel (products_fts, see database/migrate_db.py)
+FTS_STOPWORDS = {
+    "a", "an", "and", "the", "for", "to", "of", "in", "on", "with", "that", "is", "it",
+    "i", "im", "want", "need", "looking", "something", "some", "me", "my", "or",
+    "under", "below", "over", "above", "less", "more", "than", "dollars", "dollar", "usd",
+}
 
-    # -------------------------
-    # keyword score
-    # -------------------------
-    matches = embedder.match(q, top_k=top_keywords, threshold=kw_threshold)
-    kw_scores: Dict[str, float] = {to_canonical_kw(m.token): float(m.score) for m in matches}
 
-    prod_kw_score: Dict[int, float] = defaultdict(float)
+def fts_query_tokens(q: str) -> List[str]:
+    tokens = [t for t in re.findall(r"[a-z0-9]+", (q or "").lower()) if len(t) > 1 and t not in FTS_STOPWORDS]
+    return list(dict.fromkeys(tokens))
 
-    if kw_scores:
-        query_kws_db: List[str] = []
-        for ck in kw_scores.keys():
-            query_kws_db.extend(to_db_variants(ck))
-        query_kws_db = list(dict.fromkeys(query_kws_db))
 
-        if query_kws_db:
-            placeholders = ",".join(["?"] * len(query_kws_db))
-            kw_rows = conn.execute(
-                f"SELECT product_id, keyword FROM product_keywords WHERE keyword IN ({placeholders})",
-                query_kws_db,
-            ).fetchall()
+def build_fts_query(q: str) -> str:
+    return " OR ".join(f'"{t}"' for t in fts_query_tokens(q))
 
-            prod_scores = defaultdict(list)
-            for pid, kw in kw_rows:
-                ck = to_canonical_kw(kw)
-                if ck in kw_scores:
-                    prod_scores[int(pid)].append(kw_scores[ck])
-
-            for pid, scores in prod_scores.items():
-                scores.sort(reverse=True)
-                prod_kw_score[pid] = sum(scores[:top_per_product])
-
-    # -------------------------
-    # description semantic score
-    # -------------------------
-    desc_hits = desc_index.search(q, top_k=candidate_limit)
-    prod_desc_score = {hit.product_id: hit.score for hit in desc_hits}
 
-    candidate_ids = list(set(prod_kw_score.keys()) | set(prod_desc_score.keys()))
-    if not candidate_ids:
-        return [], sorted(kw_scores.items(), key=lambda x: x[1], reverse=True)
+# bm25() column weights (products_fts column order): name hits weigh more than description hits
+FTS_WEIGHTS = {"name": 5.0, "description": 1.0, "sku": 3.0}
 
-    id_placeholders = ",".join(["?"] * len(candidate_ids))
-    where = [f"id IN ({id_placeholders})"]
-    params: List[Any] = candidate_ids[:]
 
-    if price_min is not None:
-        where.append("price >= ?")
-        params.append(price_min)
-    if price_max is not None:
-        where.append("price <= ?")
-        params.append(price_max)
+def lexical_scores(conn: sqlite3.Connection, q: str, limit: int) -> Dict[int, float]:
+    match = build_fts_query(q)
+    if not match:
+        return {}
 
+    # bm25() is lower-is-better; ties at the limit keep ascending id order
     rows = conn.execute(
-        f"""
-        SELECT id, name, price, currency, url, gender
-        FROM products
-        WHERE {" AND ".join(where)}
+        """
+        SELECT rowid, -bm25(products_fts, ?, ?, ?) AS s
+        FROM products_fts
+        WHERE products_fts MATCH ?
+        ORDER BY s DESC, rowid
+        LIMIT ?
         """,
-        params,
+        (*FTS_WEIGHTS.values(), match, limit),
     ).fetchall()
+    return {int(r[0]): float(r[1]) for r in rows if r[1] > 0}
 
-    # Stronger gender filtering in Python to avoid bad SQL matching on dirty values
-    if gender is not None:
-        filtered_rows = []
-        for r in rows:
-            row_gender = normalize_gender_value(r["gender"] or "")
-            if row_gender == gender or row_gender == "unisex":
-                filtered_rows.append(r)
-        rows = filtered_rows
 
-    max_kw = max(prod_kw_score.values()) if prod_kw_score else 1.0
-    if max_kw == 0:
-        max_kw = 1.0
+def catalog_version(conn: sqlite3.Connection) -> int:
+    # bumped once per catalog write transaction by the ingest scripts (see database/migrate_db.py)
+    row = conn.execute("SELECT value FROM catalog_meta WHERE key = 'version'").fetchone()
+    return int(row[0]) if row else 0
 
-    products: List[ScoredProduct] = []
-    for r in rows:
-        pid = int(r["id"])
-        kw_part = prod_kw_score.get(pid, 0.0) / max_kw
-        desc_part = prod_desc_score.get(pid, 0.0)
-        final_score = alpha * kw_part + beta * desc_part
 
+# kw_matrix=None callers (scripts ranking through the module functions) share one matrix per
+# database file, catalog version and keyword vocabulary instead of scanning product_keywords per query
+_kw_matrices: Dict[Tuple[str, int, Tuple[str, ...]], ProductKeywordMatrix] = {}
+_kw_matrices_lock = threading.Lock()
+KW_MATRIX_CACHE_MAX = 4
+
+
+def default_kw_matrix(conn: sqlite3.Connection, embedder: KeywordEmbedder) -> ProductKeywordMatrix:
+    db_file = conn.execute("PRAGMA database_list").fetchone()[2]
+    if not db_file:
+        # in-memory databases have no stable identity to key on
+        return ProductKeywordMatrix.from_db(conn, embedder.tokens)
+    key = (db_file, catalog_version(conn), tuple(embedder.tokens))
+    with _kw_matrices_lock:
+        m = _kw_matrices.get(key)
+    if m is None:
+        m = ProductKeywordMatrix.from_db(conn, embedder.tokens)
+        with _kw_matrices_lock:
+            if len(_kw_matrices) >= KW_MATRIX_CACHE_MAX:
+                _kw_matrices.pop(next(iter(_kw_matrices)))
+            _kw_matrices[key] = m
+    return m
+
+
+# Sparse per-channel scores: (product ids, scores) arrays
+SparseScores = Tuple[np.ndarray, np.ndarray]
+ChannelScores = Tuple[Dict[str, float], SparseScores, SparseScores, SparseScores]
+FilterTuple = Tuple[Optional[float], Optional[float], Optional[str]]
+
+
+def _empty_scores() -> SparseScores:
+    return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float64)
+
+
+def _keyword_channel(
+    kw_matrix: ProductKeywordMatrix,
+    matches: List[KeywordMatch],
+    top_per_product: int,
+) -> Tuple[Dict[str, float], SparseScores]:
+    kw_scores: Dict[str, float] = {to_canonical_kw(m.token): float(m.score) for m in matches}
+    if not kw_scores:
+        return kw_scores, _empty_scores()
+
+    kw_vec = kw_matrix.scores(kw_scores, top_per_product)
+    hit_rows = np.flatnonzero(kw_vec > 0)
+    return kw_scores, (kw_matrix.product_ids[hit_rows], kw_vec[hit_rows])
+
+
+def _lexical_channel(conn: sqlite3.Connection, q: str, limit: int) -> SparseScores:
+    lex = lexical_scores(conn, q, limit=limit)
+    if not lex:
+        return _empty_scores()
+    return np.fromiter(lex.keys(), dtype=np.int64, count=len(lex)), np.fromiter(lex.values(), dtype=np.float64, count=len(lex))
+
+
+def _dense_pool(kw: SparseScores, lex: SparseScores, candidate_limit: int) -> List[int]:
+    # large catalog: only the cheap lexical + keyword candidates are rescored densely
+    kw_ids, kw_vals = kw
+    top_kw_ids = kw_ids[np.argsort(-kw_vals, kind="stable")[:candidate_limit]]
+    return list(dict.fromkeys(lex[0].tolist() + top_kw_ids.tolist()))
+
+
+def _desc_channel(ids: np.ndarray, scores: np.ndarray) -> SparseScores:
+    return ids.astype(np.int64), scores.astype(np.float64)
+
+
+def _candidate_ids(channels: ChannelScores) -> np.ndarray:
+    _, kw, desc, lex = channels
+    return np.union1d(np.union1d(kw[0], desc[0]), lex[0])
+
+
+PRODUCT_COLUMNS = "id, name, price, currency, url, gender"
+SQL_IN_CHUNK = 900
+
+
+def _chunked_select(conn: sqlite3.Connection, columns: str, product_ids: List[int]) -> List[sqlite3.Row]:
+    rows: List[sqlite3.Row] = []
+    for i in range(0, len(product_ids), SQL_IN_CHUNK):
+        chunk = product_ids[i:i + SQL_IN_CHUNK]
+        placeholders = ",".join(["?"] * len(chunk))
+        rows.extend(conn.execute(
+            f"SELECT {columns} FROM products WHERE id IN ({placeholders})",
+            chunk,
+        ).fetchall())
+    return rows
+
+
+@dataclass
+class FilterColumns:
+    """
+    Filterable columns of a candidate set as aligned arrays (ids sorted ascending).
+    NULL prices are NaN so they never pass a price filter, like in SQL.
+    """
+    ids: np.ndarray
+    price: np.ndarray
+    gender_norm: np.ndarray
+
+    @classmethod
+    def fetch(cls, conn: sqlite3.Connection, product_ids: np.ndarray) -> "FilterColumns":
+        rows = _chunked_select(conn, "id, price, gender_norm", [int(x) for x in product_ids])
+        rows.sort(key=lambda r: int(r[0]))
+        return cls(
+            ids=np.array([int(r[0]) for r in rows], dtype=np.int64),
+            price=np.array([np.nan if r[1] is None else float(r[1]) for r in rows], dtype=np.float64),
+            gender_norm=np.array([r[2] or "" for r in rows], dtype=object),
+        )
+
+    def mask(self, price_min: Optional[float], price_max: Optional[float], gender: Optional[str]) -> np.ndarray:
+        # mirror of the SQL WHERE in retrieve_and_rank_hybrid
+        m = np.ones(len(self.ids), dtype=bool)
+        if price_min is not None:
+            m &= self.price >= price_min
+        if price_max is not None:
+            m &= self.price <= price_max
+        if gender is not None:
+            m &= (self.gender_norm == gender) | (self.gender_norm == "unisex")
+        return m
+
+    def select(self, product_ids: np.ndarray) -> np.ndarray:
+        # boolean mask over self.ids of the given (sorted) ids
+        return np.isin(self.ids, product_ids, assume_unique=True)
+
+
+def _align(cand_ids: np.ndarray, channel: SparseScores) -> np.ndarray:
+    # dense score vector over cand_ids (sorted) from a sparse channel; missing -> 0
+    ids, vals = channel
+    out = np.zeros(len(cand_ids), dtype=np.float64)
+    if len(ids) == 0 or len(cand_ids) == 0:
+        return out
+    pos = np.searchsorted(cand_ids, ids)
+    pos_c = np.minimum(pos, len(cand_ids) - 1)
+    hit = cand_ids[pos_c] == ids
+    out[pos_c[hit]] = vals[hit]
+    return out
+
+
+def _channel_max(channel: SparseScores) -> float:
+    vals = channel[1]
+    m = float(vals.max()) if len(vals) else 1.0
+    return m if m != 0 else 1.0
+
+
+def _fuse_topk(
+    cand_ids: np.ndarray,
+    channels: ChannelScores,
+    alpha: float,
+    beta: float,
+    gamma: float,
+    return_k: Optional[int],
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Fused scores of the (sorted) candidate ids, best first.
+    Ties keep ascending id order; return_k=None ranks every candidate.
+    """
+    _, kw, desc, lex = channels
+    if len(cand_ids) == 0:
+        return cand_ids, np.zeros(0, dtype=np.float64)
+
+    # keyword and lexical scores are max-normalized over the whole (unfiltered) channel
+    kw_part = _align(cand_ids, kw) / _channel_max(kw)
+    desc_part = _align(cand_ids, desc)
+    lex_part = _align(cand_ids, lex) / _channel_max(lex)
+    fused = alpha * kw_part + beta * desc_part + gamma * lex_part
+
+    n = len(cand_ids)
+    k = n if return_k is None else min(max(0, return_k), n)
+    if k == 0:
+        return cand_ids[:0], fused[:0]
+
+    sel = np.arange(n)
+    if k < n:
+        kth = np.partition(-fused, k - 1)[k - 1]
+        sel = np.flatnonzero(-fused <= kth)
+    order = sel[np.lexsort((cand_ids[sel], -fused[sel]))][:k]
+    return cand_ids[order], fused[order]
+
+
+def _filter_ids(
+    conn: sqlite3.Connection,
+    candidate_ids: np.ndarray,
+    price_min: Optional[float],
+    price_max: Optional[float],
+    gender: Optional[str],
+) -> np.ndarray:
+    # candidates passing the hard filters, ascending id (candidate_ids is ascending);
+    # ids go in SQL_IN_CHUNK per query to stay under SQLite's bound-variable limit.
+    # The unary + keeps the planner off idx_products_gender_price: with a short id
+    # list it would otherwise range-scan that index once per chunk.
+    where: List[str] = []
+    filter_params: List[Any] = []
+    if price_min is not None:
+        where.append("+price >= ?")
+        filter_params.append(price_min)
+    if price_max is not None:
+        where.append("+price <= ?")
+        filter_params.append(price_max)
+    # gender_norm is cleaned at ingest (see database/migrate_db.py), unisex always passes
+    if gender is not None:
+        where.append("+gender_norm IN (?, 'unisex')")
+        filter_params.append(gender)
+
+    filtered: List[int] = []
+    for i in range(0, len(candidate_ids), SQL_IN_CHUNK):
+        chunk = candidate_ids[i:i + SQL_IN_CHUNK].tolist()
+        clauses = [f"id IN ({','.join(['?'] * len(chunk))})"] + where
+        filtered.extend(int(r[0]) for r in conn.execute(
+            f"""
+            SELECT id
+            FROM products
+            WHERE {" AND ".join(clauses)}
+            ORDER BY id
+            """,
+            chunk + filter_params,
+        ).fetchall())
+    return np.array(filtered, dtype=np.int64)
+
+
+def _materialize(
+    conn: sqlite3.Connection,
+    ids: np.ndarray,
+    scores: np.ndarray,
+    variants: Optional[Dict[int, List[int]]] = None,
+) -> List[ScoredProduct]:
+    # build ScoredProduct objects for the winners only (variants: product id -> collapsed variant ids)
+    variants = variants or {}
+    wanted = [int(x) for x in ids]
+    wanted += [v for pid in wanted for v in variants.get(pid, [])]
+    rows = {int(r["id"]): r for r in _chunked_select(conn, PRODUCT_COLUMNS, wanted)}
+    products: List[ScoredProduct] = []
+    for pid, score in zip(ids.tolist(), scores.tolist()):
+        r = rows.get(pid)
+        if r is None:
+            continue
         products.append(
             ScoredProduct(
                 id=pid,
-                score=float(final_score),
+                score=float(score),
                 name=r["name"],
                 price=float(r["price"]) if r["price"] is not None else 0.0,
                 currency=r["currency"] or "",
                 url=r["url"] or "",
                 gender=r["gender"] or "",
+                variants=[rows[v]["name"] for v in variants.get(pid, []) if v in rows],
             )
         )
+    return products
+
 
-    products.sort(key=lambda p: p.score, reverse=True)
-    products = products[:return_k]
+def _collapse_variants(
+    clusters: Optional[VariantClusters],
+    ids: np.ndarray,
+    scores: np.ndarray,
+) -> Tuple[np.ndarray, np.ndarray, Dict[int, List[int]]]:
+    if clusters is None:
+        return ids, scores, {}
+    ids, scores, variants = clusters.collapse(ids, scores)
+    return ids, scores, {int(pid): v for pid, v in zip(ids.tolist(), variants) if v}
 
-    matched_debug = sorted(kw_scores.items(), key=lambda x: x[1], reverse=True)
+
+def _score_channels(
+    conn: sqlite3.Connection,
+    embedder: KeywordEmbedder,
+    desc_index: ProductDescriptionEmbedder,
+    kw_matrix: Optional[ProductKeywordMatrix],
+    q: str,
+    top_keywords: int,
+    kw_threshold: float,
+    top_per_product: int,
+    candidate_limit: int,
+    dense_full_scan_max: int,
+    query_vec: Optional[np.ndarray] = None,
+    clusters: Optional[VariantClusters] = None,
+) -> ChannelScores:
+    """
+    Raw (unfiltered, unfused) scores of one query:
+    (matched keywords, keyword scores, description scores, lexical scores).
+    query_vec (e.g. from ComposedQueryEncoder) replaces encoding q for the keyword and dense channels.
+    clusters: score one vector per variant cluster instead of one per product.
+    """
+    if kw_matrix is None:
+        kw_matrix = default_kw_matrix(conn, embedder)
+    if query_vec is not None and embedder.model_name != desc_index.model_name:
+        raise ValueError("query_vec needs the keyword and description embedders to share one model.")
+    if clusters is not None and not clusters.is_current(desc_index):
+        raise ValueError("Variant clusters are stale; rebuild them with VariantClusters.build().")
+
+    # -------------------------
+    # keyword score
+    # -------------------------
+    with METRICS.span("retrieval.keywords"):
+        if query_vec is not None:
+            matches = embedder.match_vector(query_vec, top_k=top_keywords, threshold=kw_threshold)
+        else:
+            matches = embedder.match(q, top_k=top_keywords, threshold=kw_threshold)
+        kw_scores, kw = _keyword_channel(kw_matrix, matches, top_per_product)
+
+    # -------------------------
+    # lexical (BM25) score
+    # -------------------------
+    with METRICS.span("retrieval.lexical_sql"):
+        lex = _lexical_channel(conn, q, limit=candidate_limit)
+
+    # -------------------------
+    # description semantic score
+    # -------------------------
+    desc_index.ensure_loaded()
+    if query_vec is not None:
+        q_emb = query_vec
+    else:
+        with METRICS.span("retrieval.query_encoding"):
+            q_emb = desc_index.encode_texts([q])[0]
+    dense = desc_index if clusters is None else clusters
+    with METRICS.span("retrieval.dense"):
+        if len(desc_index.product_ids) > dense_full_scan_max:
+            pool = _dense_pool(kw, lex, candidate_limit)
+            desc = _desc_channel(*dense.score_vector(q_emb, top_k=candidate_limit, product_ids=pool))
+        else:
+            desc = _desc_channel(*dense.score_vector(q_emb, top_k=candidate_limit))
+
+    return kw_scores, kw, desc, lex
+
+
+def _matched_debug(kw_scores: Dict[str, float]) -> List[Tuple[str, float]]:
+    return sorted(kw_scores.items(), key=lambda x: x[1], reverse=True)
+
+
+def retrieve_and_rank_hybrid(
+    conn: sqlite3.Connection,
+    embedder: KeywordEmbedder,
+    desc_index: ProductDescriptionEmbedder,
+    user_query: str,
+    price_min: Optional[float] = None,
+    price_max: Optional[float] = None,
+    gender: Optional[str] = None,
+    top_keywords: int = 12,
+    kw_threshold: float = 0.42,
+    top_per_product: int = 4,
+    candidate_limit: int = 300,
+    return_k: int = 5,
+    alpha: float = 0.35,
+    beta: float = 0.65,
+    gamma: float = 0.15,
+    dense_full_scan_max: int = 20000,
+    kw_matrix: Optional[ProductKeywordMatrix] = None,
+    query_vec: Optional[np.ndarray] = None,
+    reranker: Optional[CrossEncoderReranker] = None,
+    clusters: Optional[VariantClusters] = None,
+) -> Tuple[List[ScoredProduct], List[Tuple[str, float]]]:
+    """
+    reranker: optional cross-encoder stage over the top reranker.top_n fused results;
+    its latency budget is counted from the start of this call.
+    clusters: optional variant clusters; each cluster fills at most one result slot.
+    """
+    started = time.perf_counter()
+    q = (user_query or "").strip().lower()
+    if not q:
+        return [], []
+
+    channels = _score_channels(
+        conn, embedder, desc_index, kw_matrix, q,
+        top_keywords, kw_threshold, top_per_product, candidate_limit, dense_full_scan_max,
+        query_vec=query_vec, clusters=clusters,
+    )
+    matched_debug = _matched_debug(channels[0])
+
+    candidate_ids = _candidate_ids(channels)
+    if len(candidate_ids) == 0:
+        return [], matched_debug
+
+    with METRICS.span("retrieval.filter_sql"):
+        filtered_ids = _filter_ids(conn, candidate_ids, price_min, price_max, gender)
+
+    # with variant clusters the whole filtered ranking is collapsed before taking the top k
+    fuse_k: Optional[int] = return_k if reranker is None else max(return_k, reranker.top_n)
+    with METRICS.span("retrieval.fusion"):
+        top_ids, top_scores = _fuse_topk(filtered_ids, channels, alpha, beta, gamma, None if clusters is not None else fuse_k)
+        top_ids, top_scores, variants = _collapse_variants(clusters, top_ids, top_scores)
+
+    if reranker is not None:
+        with METRICS.span("retrieval.rerank"):
+            top_ids, top_scores, _ = reranker.rerank(
+                q, top_ids[:fuse_k], top_scores[:fuse_k], desc_index.texts_for,
+                deadline=started + reranker.budget_ms / 1000.0, catalog_version=catalog_version(conn),
+            )
+    top_ids, top_scores = top_ids[:return_k], top_scores[:return_k]
+    with METRICS.span("retrieval.materialize_sql"):
+        products = _materialize(conn, top_ids, top_scores, variants)
     return products, matched_debug
 
 
+def retrieve_and_rank_hybrid_batch(
+    conn: sqlite3.Connection,
+    embedder: KeywordEmbedder,
+    desc_index: ProductDescriptionEmbedder,
+    user_queries: List[str],
+    filters: Optional[List[FilterTuple]] = None,
+    top_keywords: int = 12,
+    kw_threshold: float = 0.42,
+    top_per_product: int = 4,
+    candidate_limit: int = 300,
+    return_k: int = 5,
+    alpha: float = 0.35,
+    beta: float = 0.65,
+    gamma: float = 0.15,
+    dense_full_scan_max: int = 20000,
+    kw_matrix: Optional[ProductKeywordMatrix] = None,
+    query_vecs: Optional[List[Optional[np.ndarray]]] = None,
+) -> List[Tuple[List[ScoredProduct], List[Tuple[str, float]]]]:
+    """
+    retrieve_and_rank_hybrid for many queries at once.
+    filters[i] is (price_min, price_max, gender) for user_queries[i].
+    query_vecs[i], if not None, replaces encoding user_queries[i] (query_vec of retrieve_and_rank_hybrid).
+    Queries are encoded in one batch per encoder, dense scores come from one
+    matrix-matrix product, and filter columns and winner metadata are each
+    fetched once for all queries.
+    Results are not bit-identical to the single path: keyword and description similarities come
+    from BLAS gemm here and gemv there, and differ by up to DENSE_SCORE_TOLERANCE (~1.5e-7 seen).
+    Exact ties break by product id on both paths; products (or keywords at kw_threshold) closer than
+    the tolerance can swap or cross a cut. Compare the two with rankings_match().
+    """
+    if filters is None:
+        filters = [(None, None, None)] * len(user_queries)
+    if len(filters) != len(user_queries):
+        raise ValueError(f"Got {len(user_queries)} queries but {len(filters)} filter tuples.")
+    if query_vecs is None:
+        query_vecs = [None] * len(user_queries)
+    if len(query_vecs) != len(user_queries):
+        raise ValueError(f"Got {len(user_queries)} queries but {len(query_vecs)} query vectors.")
+    if any(v is not None for v in query_vecs) and embedder.model_name != desc_index.model_name:
+        raise ValueError("query_vecs need the keyword and description embedders to share one model.")
+
+    qs = [(u or "").strip().lower() for u in user_queries]
+    out: List[Tuple[List[ScoredProduct], List[Tuple[str, float]]]] = [([], []) for _ in qs]
+
+    todo = [i for i, q in enumerate(qs) if q]
+
+    if not todo:
+        return out
+
+    if kw_matrix is None:
+        kw_matrix = default_kw_matrix(conn, embedder)
+
+    # queries without a vector are encoded together, one batch per encoder
+    text_rows = [row for row, i in enumerate(todo) if query_vecs[i] is None]
+    text_qs = [qs[todo[row]] for row in text_rows]
+    match_lists: List[List[KeywordMatch]] = [[] for _ in todo]
+    for row, matches in zip(text_rows, embedder.match_batch(text_qs, top_k=top_keywords, threshold=kw_threshold)):
+        match_lists[row] = matches
+
+    desc_index.ensure_loaded()
+    text_embs = desc_index.encode_texts(text_qs) if text_qs else None
+    text_pos = {row: j for j, row in enumerate(text_rows)}
+    q_emb_rows: List[np.ndarray] = []
+    for row, i in enumerate(todo):
+        if query_vecs[i] is None:
+            q_emb_rows.append(text_embs[text_pos[row]])
+        else:
+            match_lists[row] = embedder.match_vector(query_vecs[i], top_k=top_keywords, threshold=kw_threshold)
+            q_emb_rows.append(np.asarray(query_vecs[i], dtype=np.float32))
+    q_embs = np.stack(q_emb_rows)
+    full_scan = len(desc_index.product_ids) <= dense_full_scan_max
+    batch_desc = desc_index.score_batch(q_embs, top_k=candidate_limit) if full_scan else None
+
+    channels_of: List[ChannelScores] = []
+    for row, i in enumerate(todo):
+        kw_scores, kw = _keyword_channel(kw_matrix, match_lists[row], top_per_product)
+        lex = _lexical_channel(conn, qs[i], limit=candidate_limit)
+
+        if batch_desc is not None:
+            desc = _desc_channel(*batch_desc[row])
+        else:
+            pool = _dense_pool(kw, lex, candidate_limit)
+            desc = _desc_channel(*desc_index.score_vector(q_embs[row], top_k=candidate_limit, product_ids=pool))
+
+        channels_of.append((kw_scores, kw, desc, lex))
+
+    cand_of = [_candidate_ids(ch) for ch in channels_of]
+    cols = FilterColumns.fetch(conn, np.unique(np.concatenate(cand_of)))
+
+    winners = []
+    for row, i in enumerate(todo):
+        price_min, price_max, gender = filters[i]
+        keep = cols.select(cand_of[row]) & cols.mask(price_min, price_max, gender)
+        winners.append(_fuse_topk(cols.ids[keep], channels_of[row], alpha, beta, gamma, return_k))
+
+    all_winner_ids = np.unique(np.concatenate([ids for ids, _ in winners]))
+    meta = {p.id: p for p in _materialize(conn, all_winner_ids, np.zeros(len(all_winner_ids)))}
+
+    for row, i in enumerate(todo):
+        ids, scores = winners[row]
+        products = [
+            ScoredProduct(**{**vars(meta[pid]), "score": float(s)})
+            for pid, s in zip(ids.tolist(), scores.tolist()) if pid in meta
+        ]
+        matched_debug = _matched_debug(channels_of[row][0])
+
+        out[i] = (products, matched_debug)
+
+    return out
+
+
+def _tie_ordered(ranking: List[Tuple[int, float]], tol: float) -> List[int]:
+    # ids, with every run of scores within tol of the previous one put in id order
+    out: List[int] = []
+    run: List[int] = []
+    prev = None
+    for pid, score in ranking:
+        if prev is not None and prev - score > tol:
+            out.extend(sorted(run))
+            run = []
+        run.append(pid)
+        prev = score
+    out.extend(sorted(run))
+    return out
+
+
+def rankings_match(
+    a: Sequence[Tuple[int, float]],
+    b: Sequence[Tuple[int, float]],
+    tol: float = DENSE_SCORE_TOLERANCE,
+) -> bool:
+    """
+    Whether two rankings [(product id, score)] of one query agree up to dense-score rounding
+    (see DENSE_SCORE_TOLERANCE): scores within tol position by position, and the same ids once
+    products scoring within tol of each other are treated as ties and put in id order.
+    """
+    a, b = list(a), list(b)
+    if len(a) != len(b):
+        return False
+    if any(abs(sa - sb) > tol for (_, sa), (_, sb) in zip(a, b)):
+        return False
+    return _tie_ordered(a, tol) == _tie_ordered(b, tol)
+
+
+class RankingSession:
+    """
+    Per-session scored candidate set for incremental re-ranking across turns.
+    Channel scores are only recomputed when the text query (or the catalog) changes;
+    filter-only changes re-filter and re-fuse the cached candidates, and "show more"
+    pages through the cached ranking. An optional reranker reorders the head of each new ranking,
+    and optional variant clusters collapse near-duplicate products into one result.
+    With a pool, queries go through the calling thread's read-only connection.
+    With a cache (shared by the sessions of one ChatResources), a text query another session
+    already scored on the same catalog version reuses its candidate set instead of rescoring.
+    """
+    def __init__(
+        self,
+        conn: sqlite3.Connection,
+        embedder: KeywordEmbedder,
+        desc_index: ProductDescriptionEmbedder,
+        kw_matrix: Optional[ProductKeywordMatrix] = None,
+        page_size: int = 5,
+        top_keywords: int = 12,
+        kw_threshold: float = 0.42,
+        top_per_product: int = 4,
+        candidate_limit: int = 300,
+        alpha: float = 0.35,
+        beta: float = 0.65,
+        gamma: float = 0.15,
+        dense_full_scan_max: int = 20000,
+        reranker: Optional[CrossEncoderReranker] = None,
+        clusters: Optional[VariantClusters] = None,
+        pool: Optional[ReadOnlyConnectionPool] = None,
+        cache: Optional[RankedResultCache] = None,
+    ) -> None:
+        self._conn = conn
+        self.pool = pool
+        self.cache = cache
+        self.embedder = embedder
+        self.desc_index = desc_index
+        self.kw_matrix = kw_matrix
+        self.page_size = page_size
+        self.top_keywords = top_keywords
+        self.kw_threshold = kw_threshold
+        self.top_per_product = top_per_product
+        self.candidate_limit = candidate_limit
+        self.alpha = alpha
+        self.beta = beta
+        self.gamma = gamma
+        self.dense_full_scan_max = dense_full_scan_max
+        self.reranker = reranker
+        self.clusters = clusters
+
+        self.text_query: Optional[str] = None
+        self._version: Optional[Tuple[int, int, int]] = None
+        self._channels: Optional[ChannelScores] = None
+        self._cols: Optional[FilterColumns] = None
+        self._filters: Optional[FilterTuple] = None
+        self._ranked_ids = np.zeros(0, dtype=np.int64)
+        self._ranked_scores = np.zeros(0, dtype=np.float64)
+        self._variants: Dict[int, List[int]] = {}
+        self._cursor = 0
+
+        self.rescores = 0
+        self.refilters = 0
+        self.cache_hits = 0
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        return self.pool.get() if self.pool is not None else self._conn
+
+    def _rescore(self, q: str, query_vec: Optional[np.ndarray], version: Tuple[int, int, int]) -> None:
+        key = None
+        if self.cache is not None:
+            # the keyword matrix and clusters are fixed per ChatResources, their ids only guard sessions built by hand
+            cache_version = version + (id(self.kw_matrix), id(self.clusters))
+            self.cache.sync_version(cache_version)
+            key = self.cache.make_key(q, (), (
+                self.top_keywords, self.kw_threshold, self.top_per_product,
+                self.candidate_limit, self.dense_full_scan_max,
+                None if query_vec is None else hash(np.asarray(query_vec, dtype=np.float32).tobytes()),
+            ))
+            cached = self.cache.get(key)
+            if cached is not None:
+                self._channels, self._cols = cached
+                self.text_query = q
+                self.cache_hits += 1
+                return
+
+        self._channels = _score_channels(
+            self.conn, self.embedder, self.desc_index, self.kw_matrix, q,
+            self.top_keywords, self.kw_threshold, self.top_per_product,
+            self.candidate_limit, self.dense_full_scan_max,
+            query_vec=query_vec, clusters=self.clusters,
+        )
+        with METRICS.span("retrieval.filter_sql"):
+            self._cols = FilterColumns.fetch(self.conn, _candidate_ids(self._channels))
+        self.text_query = q
+        self.rescores += 1
+        if self.cache is not None:
+            self.cache.put(key, (self._channels, self._cols), version=cache_version)
+
+    def search(
+        self,
+        text_query: str,
+        price_min: Optional[float] = None,
+        price_max: Optional[float] = None,
+        gender: Optional[str] = None,
+        query_vec: Optional[np.ndarray] = None,
+    ) -> Tuple[List[ScoredProduct], List[Tuple[str, float]]]:
+        """
+        query_vec is only used when a rescore is needed (new text query or catalog version).
+        """
+        started = time.perf_counter()
+        q = (text_query or "").strip().lower()
+        if not q:
+            return [], []
+
+        version = (catalog_version(self.conn), self.embedder.version, self.desc_index.version)
+        if q != self.text_query or version != self._version or self._channels is None:
+            self._rescore(q, query_vec, version)
+            self._version = version
+            self._filters = None
+
+        assert self._channels is not None and self._cols is not None
+        filters = (price_min, price_max, gender)
+        if filters != self._filters:
+            with METRICS.span("retrieval.fusion"):
+                keep = self._cols.mask(price_min, price_max, gender)
+                self._ranked_ids, self._ranked_scores = _fuse_topk(
+                    self._cols.ids[keep], self._channels, self.alpha, self.beta, self.gamma, return_k=None,
+                )
+                self._ranked_ids, self._ranked_scores, self._variants = _collapse_variants(
+                    self.clusters, self._ranked_ids, self._ranked_scores,
+                )
+            if self.reranker is not None:
+                with METRICS.span("retrieval.rerank"):
+                    self._ranked_ids, self._ranked_scores, _ = self.reranker.rerank(
+                        q, self._ranked_ids, self._ranked_scores, self.desc_index.texts_for,
+                        deadline=started + self.reranker.budget_ms / 1000.0, catalog_version=version[0],
+                    )
+            self._filters = filters
+            self.refilters += 1
+
+        self._cursor = 0
+        return self.more(), _matched_debug(self._channels[0])
+
+    def more(self) -> List[ScoredProduct]:
+        end = self._cursor + self.page_size
+        with METRICS.span("retrieval.materialize_sql"):
+            page = _materialize(
+                self.conn, self._ranked_ids[self._cursor:end], self._ranked_scores[self._cursor:end], self._variants,
+            )
+        self._cursor = min(end, len(self._ranked_ids))
+        return page
+
+    @property
+    def has_more(self) -> bool:
+        return self._cursor < len(self._ranked_ids)
+
+    @property
+    def candidate_ids(self) -> np.ndarray:
+        # scored candidates of the current text query, before the price/gender filters
+        return self._cols.ids if self._cols is not None else np.zeros(0, dtype=np.int64)
+
+
 # -------------------------
 # LLM state + follow-up Qs
 # -------------------------
-def local_slot_fill(state: ConversationState, history: List[Dict[str, str]], user_msg: str) -> Dict[str, Any]:
+def local_slot_fill(state: ConversationState, history: Sequence[Dict[str, str]], user_msg: str) -> Dict[str, Any]:
     system = (
         "You are a slot-filling assistant for a jacket recommendation chatbot.\n"
         "Extract preference info ONLY if it is explicitly stated in the latest_user_message.\n"
@@ -353,7 +1080,7 @@ def local_slot_fill(state: ConversationState, history: List[Dict[str, str]], use
             "windproof": state.windproof,
             "keywords": state.keywords,
         },
-        "recent_dialogue": history[-6:],
+        "recent_dialogue": list(history)[-6:],
         "latest_user_message": user_msg,
         "output_schema": {
             "price_min": "number|null",
@@ -372,6 +1099,7 @@ def local_slot_fill(state: ConversationState, history: List[Dict[str, str]], use
         json.dumps(payload_obj),
         max_new_tokens=LLM_MAX_NEW_TOKENS_JSON,
         temperature=0.1,
+        stage="slot_fill",
     )
     return extract_json_obj(raw)
 
@@ -432,7 +1160,7 @@ def normalize_slot_value(key: str, value: Any) -> Any:
 
 def merge_state(state: ConversationState, upd: Dict[str, Any]) -> None:
     for k in ["price_min", "price_max", "gender", "tei", "use_case", "waterproof", "windproof"]:
-        print(f"Processing slot '{k}': current value={getattr(state, k)}, new value={upd.get(k)}")
+        log.debug("Processing slot '%s': current value=%s, new value=%s", k, getattr(state, k), upd.get(k))
         if k in upd:
             val = normalize_slot_value(k, upd[k])
             if val is not None:
@@ -448,7 +1176,7 @@ def merge_state(state: ConversationState, upd: Dict[str, Any]) -> None:
         state.keywords = merged
 
 
-def local_generate_unique_question(state: ConversationState, missing_slot: str, history: List[Dict[str, str]]) -> str:
+def local_generate_unique_question(state: ConversationState, missing_slot: str, history: Sequence[Dict[str, str]]) -> str:
     system = (
         "You are a conversational assistant helping a user choose a jacket.\n"
         "Ask ONE helpful follow-up question to gather missing information.\n"
@@ -473,7 +1201,7 @@ def local_generate_unique_question(state: ConversationState, missing_slot: str,
             "keywords": state.keywords[:10],
         },
         "previous_questions": state.asked_questions[-10:],
-        "recent_dialogue": history[-6:],
+        "recent_dialogue": list(history)[-6:],
     }
 
     raw = llm_generate(
@@ -481,6 +1209,7 @@ def local_generate_unique_question(state: ConversationState, missing_slot: str,
         json.dumps(prompt_obj),
         max_new_tokens=LLM_MAX_NEW_TOKENS_Q,
         temperature=0.7,
+        stage="question_gen",
     ).strip()
 
     q = clean_llm_text(raw.strip().strip('"').strip("'").strip())
@@ -491,10 +1220,10 @@ def local_generate_unique_question(state: ConversationState, missing_slot: str,
     return q
 
 
-def build_final_query(state: ConversationState, user_msg: str) -> str:
+def query_components(state: ConversationState, include_gender: bool = True) -> List[str]:
     parts: List[str] = []
 
-    if state.gender:
+    if state.gender and include_gender:
         parts.append(state.gender)
 
     if state.use_case:
@@ -511,21 +1240,53 @@ def build_final_query(state: ConversationState, user_msg: str) -> str:
     if state.keywords:
         parts.extend(state.keywords[:8])
 
+    return parts
+
+
+def build_final_query(state: ConversationState, user_msg: str, include_gender: bool = True) -> str:
+    parts = query_components(state, include_gender=include_gender)
+
     if user_msg:
         parts.append(user_msg.lower())
 
     return " ".join(parts)
 
 
+def production_query(
+    state: ConversationState,
+    user_msg: str,
+    composer: Optional[ComposedQueryEncoder] = None,
+) -> Tuple[str, Optional[np.ndarray]]:
+    """
+    (text query, query vector) that ChatSession ranks a turn with; tools that evaluate or tune
+    retrieval use this too, so they measure what production runs.
+    Gender is a filter only, like price: it is kept out of the text and the composed vector.
+    query_vec is None without a composer (the text query is encoded instead).
+    """
+    final_query = build_final_query(state, user_msg, include_gender=False)
+    if composer is None:
+        return final_query, None
+    with METRICS.span("retrieval.query_encoding"):
+        return final_query, composer.encode(query_components(state, include_gender=False), user_msg)
+
+
 # -------------------------
 # Chat runner
 # -------------------------
-def format_results(items: List[ScoredProduct]) -> str:
+MORE_COMMANDS = {"more", "show more", "show more results", "next"}
+
+
+def format_results(items: List[ScoredProduct], relaxations: Optional[List[Relaxation]] = None) -> str:
     if not items:
+        if relaxations:
+            tips = "\n".join(f"  - {r.message}" for r in relaxations)
+            return f"No results (after filters). Closest options:\n{tips}"
         return "No results (after filters). Try removing constraints or changing wording."
     lines = []
     for i, p in enumerate(items, 1):
         lines.append(f"{i}) {p.name} — ${p.price:g} {p.currency} — score {p.score:.3f}\n   {p.url}")
+        if p.variants:
+            lines.append(f"   also available: {'; '.join(p.variants)}")
     return "\n".join(lines)
 
 
@@ -559,41 +1320,283 @@ def map_llm_keywords_to_domain(
     return mapped
 
 
-def main() -> None:
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
-
-    emb = KeywordEmbedder(
-        model_name="sentence-transformers/all-MiniLM-L6-v2",
-        cache_dir="data/embeddings",
-        keywords=DOMAIN_KEYWORDS,
-    )
-
-    desc_index = ProductDescriptionEmbedder(data_dir="data")
-    desc_index.ensure_loaded(conn)
-
-    print("Draft Chatbot vLocal (Qwen slot-fill + hybrid ranking with descriptions). Type 'quit' to exit.\n")
+@dataclass
+class ChatResources:
+    """
+    Models and indexes shared by every chat session of a process (built once at startup).
+    """
+    conn: sqlite3.Connection
+    embedder: KeywordEmbedder
+    desc_index: ProductDescriptionEmbedder
+    kw_matrix: ProductKeywordMatrix
+    facets: FacetIndex
+    reranker: Optional[CrossEncoderReranker] = None
+    clusters: Optional[VariantClusters] = None
+    composer: Optional[ComposedQueryEncoder] = None
+    pool: Optional[ReadOnlyConnectionPool] = None
+    result_cache: Optional[RankedResultCache] = None
+
+    @classmethod
+    def load(
+        cls,
+        db_path: str = DB_PATH,
+        read_only_pool: bool = False,
+        data_dir: str = "data",
+        models: Optional["ChatResources"] = None,
+    ) -> "ChatResources":
+        """
+        read_only_pool: sessions query through per-thread read-only connections
+        (for running retrieval on several worker threads); conn is then only used at startup.
+        models: reuse the encoders of an already-loaded ChatResources and only load the
+        catalog side (DB, description vectors from data_dir, keyword matrix, facets); see index_bundle.py.
+        """
+        # with a pool, conn is only used while loading here, but may be closed from another thread (hot reload)
+        conn = sqlite3.connect(db_path, check_same_thread=not read_only_pool)
+        conn.row_factory = sqlite3.Row
+
+        if models is not None:
+            emb = models.embedder
+            desc_index = models.desc_index.with_data_dir(data_dir)
+        else:
+            emb = KeywordEmbedder(
+                model_name="sentence-transformers/all-MiniLM-L6-v2",
+                cache_dir="data/embeddings",
+                keywords=DOMAIN_KEYWORDS,
+            )
+            desc_index = ProductDescriptionEmbedder(data_dir=data_dir)
+        desc_index.ensure_loaded(conn)
+
+        kw_matrix = ProductKeywordMatrix.from_db(conn, emb.tokens)
+        facets = FacetIndex.from_db(conn)
+
+        reranker = None
+        if models is not None:
+            reranker = models.reranker
+        elif CROSS_ENCODER_RERANK:
+            reranker = CrossEncoderReranker(RERANK_MODEL, top_n=RERANK_TOP_N, budget_ms=RERANK_BUDGET_MS)
+            reranker.warm_up()
+
+        clusters = None
+        if COLLAPSE_VARIANTS:
+            clusters = VariantClusters.build(conn, desc_index, sim_threshold=VARIANT_SIM_THRESHOLD)
+            log.info("Variant clusters: %s", clusters.stats())
+
+        composer = ComposedQueryEncoder(emb.encode_queries) if COMPOSED_QUERY_EMBEDDINGS else None
+        if models is not None:
+            composer = models.composer
+        pool = ReadOnlyConnectionPool(db_path) if read_only_pool else None
+        # one cache per catalog: a hot-reloaded bundle starts with an empty one
+        result_cache = RankedResultCache(max_entries=RESULT_CACHE_ENTRIES) if RESULT_CACHE_ENTRIES > 0 else None
+        return cls(conn, emb, desc_index, kw_matrix, facets, reranker, clusters, composer, pool, result_cache)
+
+    def close(self) -> None:
+        if self.pool is not None:
+            self.pool.close_all()
+        self.conn.close()
 
-    state = ConversationState()
-    history: List[Dict[str, str]] = []
 
-    while True:
-        user = input("Tell me what you're looking for: ").strip()
-        if not user:
-            continue
-        if user.lower() in {"quit", "exit"}:
-            break
+@dataclass
+class TurnResult:
+    reply: str
+    question: Optional[str] = None
+    results: List[ScoredProduct] = field(default_factory=list)
+    relaxations: List[Relaxation] = field(default_factory=list)
+    matched: List[Tuple[str, float]] = field(default_factory=list)
+    has_more: bool = False
+    debug: Dict[str, Any] = field(default_factory=dict)
+    profile: Optional[str] = None  # path of the turn's profile, if it was profiled
+    trace: Optional[Dict[str, Any]] = None  # the turn's trace record, if it was traced
+
+
+class ChatSession:
+    """
+    One user's conversation: slot state, dialogue history and ranking session.
+    A turn is fill_slots() (LLM work, may return a follow-up question) then search() (retrieval);
+    turn() runs both in order, servers can run the two halves on different executors.
+    Callers driving the halves themselves bracket a turn with begin_turn()/end_turn() to get profiles.
+    """
+    def __init__(self, res: ChatResources, profile: bool = False) -> None:
+        self.res = res
+        self.profile = profile
+        self.session_id = uuid.uuid4().hex
+        self.turns = 0
+        self._profile: Optional[TurnProfile] = None
+        self._trace: Optional[TurnTrace] = None
+        self._turn_t0 = 0.0
+        self.state = ConversationState()
+        self.history: Deque[Dict[str, str]] = deque(maxlen=HISTORY_MAX_MESSAGES)
+        self.ranking = self._new_ranking(res)
+        self._text_before: Tuple[Any, ...] = self.state.text_slots()
+        self._filters_before: Tuple[Any, ...] = self.state.filter_slots()
+
+    @staticmethod
+    def _new_ranking(res: ChatResources) -> RankingSession:
+        return RankingSession(
+            res.conn,
+            res.embedder,
+            res.desc_index,
+            kw_matrix=res.kw_matrix,
+            page_size=5,
+            top_keywords=12,
+            kw_threshold=0.42,
+            top_per_product=4,
+            candidate_limit=300,
+            alpha=0.35,
+            beta=0.65,
+            gamma=0.15,
+            reranker=res.reranker,
+            clusters=res.clusters,
+            pool=res.pool,
+            cache=res.result_cache,
+        )
 
-        history.append({"role": "user", "content": user})
+    def rebind(self, res: ChatResources) -> None:
+        """
+        Move the session onto other resources (e.g. a hot-reloaded catalog).
+        Cached candidate scores are dropped; the text query is kept so filter-only turns still work.
+        """
+        if res is self.res:
+            return
+        text_query = self.ranking.text_query
+        self.res = res
+        self.ranking = self._new_ranking(res)
+        self.ranking.text_query = text_query
+
+    def begin_turn(
+        self,
+        user: str,
+        profile: bool = False,
+        tags: Optional[Dict[str, Any]] = None,
+        trace: bool = False,
+        replay_llm: Optional[List[Dict[str, Any]]] = None,
+    ) -> None:
+        """
+        Start a turn; it is profiled if profile, self.profile or the PROFILE_SAMPLE_RATE draw says so.
+        It is traced (TurnResult.trace, appended to TRACE_PATH if set) if trace, TRACE_PATH or
+        replay_llm (recorded LLM outputs to answer from instead of the model) is given.
+        """
+        self.turns += 1
+        self._turn_t0 = time.perf_counter()
+        self._profile = None
+        self._trace = None
+        if trace or TRACE_PATH is not None or replay_llm is not None:
+            self._trace = TurnTrace({
+                "v": TRACE_VERSION,
+                "sid": (tags or {}).get("session_id", self.session_id),
+                "turn": self.turns,
+                "ts": round(time.time(), 3),
+                "input": user,
+                "kind": "more" if self.is_more_command(user) else "search",
+                "state_before": compact_state(asdict(self.state)),
+            }, replay_llm)
+        if profile or self.profile or (PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE):
+            self._profile = TurnProfile(PROFILE_MODE, tags={
+                **(tags or {}),
+                "query": user,
+                "turn": self.turns,
+                "started": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                "state_before": asdict(self.state),
+                "stages": [],
+            })
+
+    def end_turn(self, out: Optional[TurnResult], error: Optional[BaseException] = None) -> Optional[str]:
+        """
+        Finish the turn started by begin_turn(): write its trace and profile (if any),
+        return the profile's file path. A turn that raised passes its exception as error (out is then None).
+        """
+        wall_ms = round((time.perf_counter() - self._turn_t0) * 1000.0, 3)
+        if error is not None:
+            METRICS.incr("turns.error")
+        if out is None:
+            out = TurnResult(reply="")
+        trace, self._trace = self._trace, None
+        if trace is not None:
+            rec = trace.record
+            rec["ms"]["total"] = wall_ms
+            if error is not None:
+                rec["kind"] = "error"
+                rec["error"] = repr(error)
+            elif out.question is not None:
+                rec["kind"] = "question"
+            rec.update({
+                "state_after": compact_state(asdict(self.state)),
+                "question": out.question,
+                "text_query": self.ranking.text_query,
+                "results": [[p.id, round(p.score, 6)] for p in out.results],
+                "has_more": out.has_more,
+            })
+            out.trace = rec
+            writer = trace_writer()
+            if writer is not None:
+                writer.write(rec)
+
+        prof, self._profile = self._profile, None
+        if prof is None:
+            return None
+        prof.tags.update({
+            "wall_ms": wall_ms,
+            "state_after": asdict(self.state),
+            "question": out.question,
+            "result_ids": [p.id for p in out.results],
+            "error": repr(error) if error is not None else None,
+        })
+        out.profile = prof.write(PROFILE_DIR)
+        log.info("Turn profile written to %s", out.profile)
+        return out.profile
+
+    @property
+    def profiling(self) -> bool:
+        return self._profile is not None
+
+    @contextmanager
+    def _stage(self, stage: str) -> Iterator[None]:
+        # runs on whichever thread executes the stage: profile it and make the turn's trace active there
+        prof, trace = self._profile, self._trace
+        if prof is not None:
+            prof.tags["stages"].append(stage)
+        t0 = time.perf_counter()
+        with (prof.capture() if prof is not None else nullcontext()), activate(trace):
+            try:
+                yield
+            finally:
+                if trace is not None:
+                    trace.add_ms(stage, (time.perf_counter() - t0) * 1000.0)
+
+    def is_more_command(self, user: str) -> bool:
+        return user.strip().lower() in MORE_COMMANDS and self.ranking.text_query is not None
+
+    def more(self) -> TurnResult:
+        METRICS.incr("turns.more")
+        if not self.ranking.has_more:
+            return TurnResult(reply="Bot: That's everything for this search.")
+        with METRICS.span("turn.more"), self._stage("more"):
+            results = self.ranking.more()
+        return TurnResult(reply=format_results(results), results=results, has_more=self.ranking.has_more)
+
+    def fill_slots(self, user: str) -> Optional[str]:
+        """
+        Update the state from the user's message; returns a follow-up question if a slot is still missing.
+        """
+        with METRICS.span("turn.fill_slots"), self._stage("fill_slots"):
+            return self._fill_slots(user)
+
+    def _fill_slots(self, user: str) -> Optional[str]:
+        state = self.state
+        self.history.append({"role": "user", "content": user})
+        self._text_before = state.text_slots()
+        self._filters_before = state.filter_slots()
 
         try:
-            upd = local_slot_fill(state, history, user)
+            with METRICS.span("slot_fill"):
+                upd = local_slot_fill(state, self.history, user)
             merge_state(state, upd)
-            mapped = map_llm_keywords_to_domain(emb, state.keywords, sim_threshold=0.6)
+            with METRICS.span("keyword_mapping"):
+                mapped = map_llm_keywords_to_domain(self.res.embedder, state.keywords, sim_threshold=0.6)
             state.keywords = [dk for (dk, sim, orig) in mapped]
 
-            print("LLM→Domain mapping:", [(orig, dk, round(sim, 3)) for (dk, sim, orig) in mapped])
+            log.debug("LLM→Domain mapping: %s", [(orig, dk, round(sim, 3)) for (dk, sim, orig) in mapped])
         except Exception:
+            METRICS.incr("slot_fill.fallback")
             pmin, pmax, parsed_gender = parse_filters(user)
             if pmin is not None:
                 state.price_min = pmin
@@ -613,37 +1616,52 @@ def main() -> None:
                 missing = state.missing_slots()
 
             if missing:
-                qtext = local_generate_unique_question(state, slot, history)
-                state.asked_questions.append(qtext)
-                print(f"Bot: {qtext}\n")
-                history.append({"role": "assistant", "content": qtext})
-                continue
-
-        print("Bot: Searching for jackets...\n")
+                METRICS.incr("turns.question")
+                with METRICS.span("question_gen"):
+                    qtext = local_generate_unique_question(state, slot, self.history)
+                state.remember_question(qtext)
+                self.history.append({"role": "assistant", "content": qtext})
+                return qtext
 
-        final_query = build_final_query(state, user)
+        return None
 
-        results, matched = retrieve_and_rank_hybrid(
-            conn=conn,
-            embedder=emb,
-            desc_index=desc_index,
-            user_query=final_query,
+    def search(self, user: str) -> TurnResult:
+        METRICS.incr("turns.search")
+        with METRICS.span("turn.search"), self._stage("search"):
+            return self._search(user)
+
+    def _search(self, user: str) -> TurnResult:
+        state = self.state
+        ranking = self.ranking
+
+        # only budget/gender changed -> keep the scored candidates and just re-filter them
+        if (
+            ranking.text_query is not None
+            and state.text_slots() == self._text_before
+            and state.filter_slots() != self._filters_before
+        ):
+            final_query, query_vec = ranking.text_query, None
+        else:
+            final_query, query_vec = production_query(state, user, self.res.composer)
+
+        results, matched = ranking.search(
+            final_query,
             price_min=state.price_min,
             price_max=state.price_max,
             gender=state.gender,
-            top_keywords=12,
-            kw_threshold=0.42,
-            top_per_product=4,
-            candidate_limit=300,
-            return_k=5,
-            alpha=0.35,
-            beta=0.65,
+            query_vec=query_vec,
         )
 
-        print("Matched keywords:", [(k, round(s, 6)) for k, s in matched[:10]])
-        print(
-            "State:",
-            {
+        relaxations: List[Relaxation] = []
+        if not results:
+            METRICS.incr("turns.no_results")
+            relaxations = self.res.facets.suggest_relaxations(
+                {"price_min": state.price_min, "price_max": state.price_max, "gender": state.gender},
+                candidates=self.res.facets.ids_bitmap(ranking.candidate_ids),
+            )
+
+        debug: Dict[str, Any] = {
+            "state": {
                 "price_min": state.price_min,
                 "price_max": state.price_max,
                 "gender": state.gender,
@@ -653,11 +1671,88 @@ def main() -> None:
                 "windproof": state.windproof,
                 "keywords": state.keywords[:10],
             },
+            "ranking_session": {"rescores": ranking.rescores, "refilters": ranking.refilters, "cache_hits": ranking.cache_hits},
+        }
+        if self.res.reranker is not None:
+            debug["reranker"] = self.res.reranker.stats()
+
+        return TurnResult(
+            reply=format_results(results, relaxations),
+            results=results,
+            relaxations=relaxations,
+            matched=matched,
+            has_more=ranking.has_more,
+            debug=debug,
         )
-        print(format_results(results))
+
+    def turn(self, user: str, **turn_opts: Any) -> TurnResult:
+        # turn_opts go to begin_turn(); a turn that raises is still traced/profiled, with its error
+        self.begin_turn(user, **turn_opts)
+        out: Optional[TurnResult] = None
+        error: Optional[BaseException] = None
+        try:
+            out = self._turn(user)
+            return out
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            self.end_turn(out, error)
+
+    def _turn(self, user: str) -> TurnResult:
+        if self.is_more_command(user):
+            return self.more()
+        qtext = self.fill_slots(user)
+        if qtext is not None:
+            return TurnResult(reply=f"Bot: {qtext}", question=qtext)
+        return self.search(user)
+
+
+def main() -> None:
+    logging.basicConfig(level=LOG_LEVEL, format="%(message)s")
+    res = ChatResources.load()
+    session = ChatSession(res)
+    if METRICS_DUMP_PATH:
+        METRICS.start_dump(METRICS_DUMP_PATH, METRICS_DUMP_INTERVAL_S)
+
+    print("Draft Chatbot vLocal (Qwen slot-fill + hybrid ranking with descriptions). Type 'quit' to exit.\n")
+
+    while True:
+        user = input("Tell me what you're looking for: ").strip()
+        if not user:
+            continue
+        if user.lower() in {"quit", "exit"}:
+            break
+
+        session.begin_turn(user)
+        try:
+            if session.is_more_command(user):
+                out = session.more()
+            else:
+                qtext = session.fill_slots(user)
+                if qtext is not None:
+                    out = TurnResult(reply=f"Bot: {qtext}", question=qtext)
+                else:
+                    print("Bot: Searching for jackets...\n")
+                    out = session.search(user)
+        except BaseException as e:
+            session.end_turn(None, e)
+            raise
+        session.end_turn(out)
+
+        if out.debug:
+            log.debug("Matched keywords: %s", [(k, round(s, 6)) for k, s in out.matched[:10]])
+            log.debug("State: %s", out.debug["state"])
+            log.debug("Ranking session: %s", out.debug["ranking_session"])
+            if "reranker" in out.debug:
+                log.debug("Reranker: %s", out.debug["reranker"])
+        print(out.reply)
+        if out.has_more:
+            print('(Type "more" to see more results.)')
         print()
 
-    conn.close()
+    METRICS.stop_dump()
+    res.close()
 
 
 if __name__ == "__main__":
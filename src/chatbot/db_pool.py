@@ -0,0 +1,64 @@
+# This file hands out read-only SQLite connections for the retrieval path, one per worker thread
+# Connections are opened through a file: URI with mode=ro and tuned for read-heavy use (mmap, page cache),
+# so many threads can query the catalog in parallel without sharing a connection
+from __future__ import annotations
+
+import os
+import sqlite3
+import threading
+from typing import List
+from urllib.parse import quote
+
+MMAP_SIZE = 256 * 1024 * 1024   # bytes of the DB file mapped into memory
+CACHE_SIZE_KIB = 64 * 1024      # page cache per connection
+
+
+def read_only_uri(db_path: str) -> str:
+    # percent-encoded, so paths containing '?', '#', '%' or spaces still name the right file
+    return f"file:{quote(os.path.abspath(db_path))}?mode=ro"
+
+
+class ReadOnlyConnectionPool:
+    """
+    Thread-local read-only connections to one database file.
+    get() returns the calling thread's connection, opening it on first use.
+    """
+    def __init__(self, db_path: str, mmap_size: int = MMAP_SIZE, cache_size_kib: int = CACHE_SIZE_KIB) -> None:
+        if not os.path.exists(db_path):
+            raise FileNotFoundError(f"Database not found: {db_path}")
+        self.uri = read_only_uri(db_path)
+        self.mmap_size = mmap_size
+        self.cache_size_kib = cache_size_kib
+
+        self._local = threading.local()
+        self._all: List[sqlite3.Connection] = []
+        self._lock = threading.Lock()
+
+    def _open(self) -> sqlite3.Connection:
+        # check_same_thread=False only so close_all() can close them from the shutdown thread; queries stay thread-local
+        conn = sqlite3.connect(self.uri, uri=True, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA query_only = ON")
+        conn.execute(f"PRAGMA mmap_size = {int(self.mmap_size)}")
+        conn.execute(f"PRAGMA cache_size = -{int(self.cache_size_kib)}")
+        conn.execute("PRAGMA temp_store = MEMORY")
+        return conn
+
+    def get(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._open()
+            self._local.conn = conn
+            with self._lock:
+                self._all.append(conn)
+        return conn
+
+    def __len__(self) -> int:
+        return len(self._all)
+
+    def close_all(self) -> None:
+        # call once the worker threads are done
+        with self._lock:
+            conns, self._all = self._all, []
+        for conn in conns:
+            conn.close()
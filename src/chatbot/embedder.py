@@ -5,8 +5,9 @@ from __future__ import annotations
 import os
 import json
 import sqlite3
+import threading
 from dataclasses import dataclass
-from typing import Dict, List, Optional, Tuple
+from typing import Dict, List, Optional, Sequence, Tuple, Union
 
 import numpy as np
 from sentence_transformers import SentenceTransformer
@@ -95,6 +96,10 @@ DOMAIN_KEYWORDS = [
 # -------------------------
 # Shared helpers
 # -------------------------
+# BLAS gemv / gemm round differently with the number of rows and queries scored together, so one product's
+# dense score can differ by a few float32 ulps between paths (full index vs shard, single vs batch query)
+DENSE_SCORE_TOLERANCE = 1e-6
+
 
 def normalize_l2(x: np.ndarray) -> np.ndarray:
     norm = np.linalg.norm(x, axis=1, keepdims=True) + 1e-12
@@ -142,13 +147,21 @@ class KeywordEmbedder:
 
         self._model: Optional[SentenceTransformer] = None
         self._kw_tokens: List[str] = []
-        self._kw_texts: List[str] = []
+        self._kw_texts: Sequence[str] = []
         self._kw_emb: Optional[np.ndarray] = None
+        # bumped whenever the keyword vectors change (lets result caches detect stale entries)
+        self.version = 0
+        # guards one-time model/cache initialization when called from several threads
+        self._init_lock = threading.RLock()
 
     def _load_model(self) -> SentenceTransformer:
-        if self._model is None:
-            self._model = SentenceTransformer(self.model_name)
-        return self._model
+        model = self._model
+        if model is None:
+            with self._init_lock:
+                if self._model is None:
+                    self._model = SentenceTransformer(self.model_name)
+                model = self._model
+        return model
 
     @staticmethod
     def _token_to_text(token: str) -> str:
@@ -165,27 +178,32 @@ class KeywordEmbedder:
         meta_path, emb_path = self._cache_paths()
         model = self._load_model()
 
-        self._kw_tokens = self.keywords
-        self._kw_texts = [self._token_to_text(k) for k in self._kw_tokens]
+        tokens = list(self.keywords)
+        texts = [self._token_to_text(k) for k in tokens]
 
         emb = model.encode(
-            self._kw_texts,
+            texts,
             convert_to_numpy=True,
             normalize_embeddings=True
-        ).astype(np.float32)
+        ).astype(np.float32, copy=False)
 
         meta = {
             "model_name": self.model_name,
-            "count": len(self._kw_tokens),
-            "tokens": self._kw_tokens,
-            "texts": self._kw_texts,
+            "count": len(tokens),
+            "tokens": tokens,
+            "texts": texts,
         }
 
-        with open(meta_path, "w", encoding="utf-8") as f:
-            json.dump(meta, f, ensure_ascii=False, indent=2)
-        np.save(emb_path, emb)
+        with self._init_lock:
+            with open(meta_path, "w", encoding="utf-8") as f:
+                json.dump(meta, f, ensure_ascii=False, indent=2)
+            np.save(emb_path, emb)
 
-        self._kw_emb = emb
+            # vectors are published last: readers check _kw_emb before touching the tokens
+            self._kw_tokens = tokens
+            self._kw_texts = texts
+            self._kw_emb = emb
+            self.version += 1
 
     def load_cache(self) -> None:
         meta_path, emb_path = self._cache_paths()
@@ -194,23 +212,59 @@ class KeywordEmbedder:
 
         with open(meta_path, "r", encoding="utf-8") as f:
             meta = json.load(f)
-
-        self._kw_tokens = list(meta["tokens"])
-        self._kw_texts = list(meta["texts"])
-        self._kw_emb = np.load(emb_path).astype(np.float32)
+        emb = np.load(emb_path).astype(np.float32, copy=False)
+
+        with self._init_lock:
+            self._kw_tokens = list(meta["tokens"])
+            self._kw_texts = list(meta["texts"])
+            self._kw_emb = emb
+            self.version += 1
+
+    def load_arrays(self, tokens: List[str], texts: Sequence[str], emb: np.ndarray) -> None:
+        # adopt already-built vectors and texts as-is (no copy), e.g. read-only views from shared_arrays.py
+        if emb.shape[0] != len(tokens):
+            raise ValueError(f"{emb.shape[0]} keyword vectors for {len(tokens)} tokens.")
+        with self._init_lock:
+            self._kw_tokens = list(tokens)
+            self._kw_texts = texts
+            self._kw_emb = emb
+            self.version += 1
 
     def ensure_loaded(self) -> None:
-        if self._kw_emb is None:
+        if self._kw_emb is not None:
+            return
+        with self._init_lock:
+            if self._kw_emb is not None:
+                return
             try:
                 self.load_cache()
             except FileNotFoundError:
                 self.build_cache()
 
+    @property
+    def tokens(self) -> List[str]:
+        self.ensure_loaded()
+        return list(self._kw_tokens)
+
     def encode_query(self, text: str) -> np.ndarray:
         model = self._load_model()
-        vec = model.encode([text], convert_to_numpy=True, normalize_embeddings=True).astype(np.float32)
+        vec = model.encode([text], convert_to_numpy=True, normalize_embeddings=True).astype(np.float32, copy=False)
         return vec[0]
 
+    def encode_queries(self, texts: List[str]) -> np.ndarray:
+        model = self._load_model()
+        return model.encode(texts, convert_to_numpy=True, normalize_embeddings=True).astype(np.float32, copy=False)
+
+    def _matches_from_scores(self, scores: np.ndarray, top_k: int, threshold: float) -> List[KeywordMatch]:
+        idx = np.argsort(-scores)[:max(1, top_k)]
+
+        out: List[KeywordMatch] = []
+        for i in idx:
+            s = float(scores[int(i)])
+            if s >= threshold:
+                out.append(KeywordMatch(self._kw_tokens[int(i)], s))
+        return out
+
     def match(self, query: str, top_k: int = 8, threshold: float = 0.45) -> List[KeywordMatch]:
         self.ensure_loaded()
         assert self._kw_emb is not None
@@ -221,13 +275,36 @@ class KeywordEmbedder:
 
         q_emb = self.encode_query(q)
         scores = self._kw_emb @ q_emb
-        idx = np.argsort(-scores)[:max(1, top_k)]
+        return self._matches_from_scores(scores, top_k, threshold)
 
-        out: List[KeywordMatch] = []
-        for i in idx:
-            s = float(scores[int(i)])
-            if s >= threshold:
-                out.append(KeywordMatch(self._kw_tokens[int(i)], s))
+    def match_vector(self, q_emb: np.ndarray, top_k: int = 8, threshold: float = 0.45) -> List[KeywordMatch]:
+        """
+        match() for an already-encoded (unit-length) query vector.
+        """
+        self.ensure_loaded()
+        assert self._kw_emb is not None
+
+        scores = self._kw_emb @ q_emb
+        return self._matches_from_scores(scores, top_k, threshold)
+
+    def match_batch(self, queries: List[str], top_k: int = 8, threshold: float = 0.45) -> List[List[KeywordMatch]]:
+        """
+        match() for many queries: one encode call and one matrix-matrix product.
+        Similarities match match() within DENSE_SCORE_TOLERANCE, not bit for bit (gemm vs gemv rounding).
+        """
+        self.ensure_loaded()
+        assert self._kw_emb is not None
+
+        qs = [(q or "").strip().lower() for q in queries]
+        live = [i for i, q in enumerate(qs) if q]
+        out: List[List[KeywordMatch]] = [[] for _ in qs]
+        if not live:
+            return out
+
+        q_embs = self.encode_queries([qs[i] for i in live])
+        scores = q_embs @ self._kw_emb.T
+        for row, i in enumerate(live):
+            out[i] = self._matches_from_scores(scores[row], top_k, threshold)
         return out
 
 
@@ -255,14 +332,31 @@ class ProductDescriptionEmbedder:
         self.data_dir = data_dir
 
         self._model: Optional[SentenceTransformer] = None
-        self.product_ids: List[int] = []
-        self.product_texts: List[str] = []
+        # lists, or (after load_arrays) an int64 array and a text sequence shared with other processes
+        self.product_ids: Union[List[int], np.ndarray] = []
+        self.product_texts: Sequence[str] = []
         self.product_embs: Optional[np.ndarray] = None
+        # bumped whenever the product vectors change (lets result caches detect stale entries)
+        self.version = 0
+        # (version, id array, id -> row) swapped as one tuple so readers never see a mix
+        self._id_cache: Tuple[int, np.ndarray, Dict[int, int]] = (-1, np.zeros(0, dtype=np.int64), {})
+        self._init_lock = threading.RLock()
 
     def _load_model(self) -> SentenceTransformer:
-        if self._model is None:
-            self._model = SentenceTransformer(self.model_name)
-        return self._model
+        model = self._model
+        if model is None:
+            with self._init_lock:
+                if self._model is None:
+                    self._model = SentenceTransformer(self.model_name)
+                model = self._model
+        return model
+
+    def with_data_dir(self, data_dir: str) -> "ProductDescriptionEmbedder":
+        # empty index over another data_dir that shares this instance's model (loaded here first,
+        # so the two never load their own copies)
+        other = ProductDescriptionEmbedder(model_name=self.model_name, data_dir=data_dir)
+        other._model = self._load_model()
+        return other
 
     def _cache_paths(self) -> Tuple[str, str]:
         os.makedirs(self.data_dir, exist_ok=True)
@@ -277,7 +371,7 @@ class ProductDescriptionEmbedder:
             texts,
             convert_to_numpy=True,
             normalize_embeddings=True
-        ).astype(np.float32)
+        ).astype(np.float32, copy=False)
         return emb
 
     def build_from_db(self, conn: sqlite3.Connection) -> None:
@@ -303,9 +397,12 @@ class ProductDescriptionEmbedder:
             ids.append(int(row["id"]))
             texts.append(text)
 
-        self.product_ids = ids
-        self.product_texts = texts
-        self.product_embs = self.encode_texts(texts) if texts else None
+        embs = self.encode_texts(texts) if texts else None
+        with self._init_lock:
+            self.product_ids = ids
+            self.product_texts = texts
+            self.product_embs = embs
+            self.version += 1
 
     def save_cache(self) -> None:
         if self.product_embs is None:
@@ -316,14 +413,14 @@ class ProductDescriptionEmbedder:
         meta = {
             "model_name": self.model_name,
             "count": len(self.product_ids),
-            "product_ids": self.product_ids,
-            "product_texts": self.product_texts,
+            "product_ids": [int(x) for x in self.product_ids],
+            "product_texts": list(self.product_texts),
         }
 
         with open(meta_path, "w", encoding="utf-8") as f:
             json.dump(meta, f, ensure_ascii=False, indent=2)
 
-        np.save(emb_path, self.product_embs.astype(np.float32))
+        np.save(emb_path, self.product_embs.astype(np.float32, copy=False))
 
     def load_cache(self) -> None:
         meta_path, emb_path = self._cache_paths()
@@ -332,29 +429,129 @@ class ProductDescriptionEmbedder:
 
         with open(meta_path, "r", encoding="utf-8") as f:
             meta = json.load(f)
+        embs = np.load(emb_path).astype(np.float32, copy=False)
 
-        self.product_ids = [int(x) for x in meta["product_ids"]]
-        self.product_texts = list(meta["product_texts"])
-        self.product_embs = np.load(emb_path).astype(np.float32)
+        with self._init_lock:
+            self.product_ids = [int(x) for x in meta["product_ids"]]
+            self.product_texts = list(meta["product_texts"])
+            self.product_embs = embs
+            self.version += 1
+
+    def load_arrays(
+        self,
+        product_ids: Union[List[int], np.ndarray],
+        product_texts: Sequence[str],
+        product_embs: np.ndarray,
+    ) -> None:
+        # adopt already-built ids, texts and vectors as-is (no copy), e.g. read-only views from shared_arrays.py
+        if product_embs.shape[0] != len(product_ids):
+            raise ValueError(f"{product_embs.shape[0]} product vectors for {len(product_ids)} products.")
+        with self._init_lock:
+            self.product_ids = product_ids
+            self.product_texts = product_texts
+            self.product_embs = product_embs
+            self.version += 1
 
     def ensure_loaded(self, conn: Optional[sqlite3.Connection] = None) -> None:
+        """
+        Load (or, given a connection, build) the vectors once; concurrent callers wait for the first.
+        Request paths call this without conn, so they never trigger a DB rebuild.
+        """
         if self.product_embs is not None:
             return
 
-        try:
-            self.load_cache()
-        except FileNotFoundError:
-            if conn is None:
-                raise FileNotFoundError(
-                    "Product description cache not found and no DB connection was provided to rebuild it."
-                )
-            self.build_from_db(conn)
-            self.save_cache()
+        with self._init_lock:
+            if self.product_embs is not None:
+                return
+            try:
+                self.load_cache()
+            except FileNotFoundError:
+                if conn is None:
+                    raise FileNotFoundError(
+                        "Product description cache not found and no DB connection was provided to rebuild it."
+                    )
+                self.build_from_db(conn)
+                self.save_cache()
 
     def rebuild_cache(self, conn: sqlite3.Connection) -> None:
         self.build_from_db(conn)
         self.save_cache()
 
+    def _id_index(self) -> Tuple[np.ndarray, Dict[int, int]]:
+        # product id array + id -> row map, rebuilt only when the vectors change
+        version, ids, row_of = self._id_cache
+        if version != self.version:
+            with self._init_lock:
+                version = self.version
+                ids = np.asarray(self.product_ids, dtype=np.int64)
+                row_of = {pid: i for i, pid in enumerate(ids.tolist())}
+                self._id_cache = (version, ids, row_of)
+        return ids, row_of
+
+    def texts_for(self, product_ids: List[int]) -> List[str]:
+        # indexed product texts for the given ids ("" for products without one)
+        self.ensure_loaded()
+        _, row_of = self._id_index()
+        return [self.product_texts[row_of[pid]] if pid in row_of else "" for pid in product_ids]
+
+    @staticmethod
+    def _top_k(scores: np.ndarray, top_k: int) -> np.ndarray:
+        # best first; ties keep position (= product id) order, also at the k-th place
+        k = min(max(1, top_k), len(scores))
+        if k < len(scores):
+            kth = np.partition(-scores, k - 1)[k - 1]
+            idx = np.flatnonzero(-scores <= kth)
+        else:
+            idx = np.arange(len(scores))
+        return idx[np.argsort(-scores[idx], kind="stable")][:k]
+
+    def score_vector(
+        self,
+        q_emb: np.ndarray,
+        top_k: int = 50,
+        product_ids: Optional[List[int]] = None,
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Top-k (product ids, scores) arrays for one query vector, best first.
+        If product_ids is given, only those products are scored (candidate rescoring).
+        """
+        self.ensure_loaded()
+        assert self.product_embs is not None
+        ids, row_of = self._id_index()
+
+        if product_ids is None:
+            scores = self.product_embs @ q_emb
+            idx = self._top_k(scores, top_k)
+            return ids[idx], scores[idx]
+
+        rows = np.array([row_of[pid] for pid in product_ids if pid in row_of], dtype=np.int64)
+        if len(rows) == 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+
+        scores = self.product_embs[rows] @ q_emb
+        idx = self._top_k(scores, top_k)
+        return ids[rows[idx]], scores[idx]
+
+    def score_batch(self, q_embs: np.ndarray, top_k: int = 50) -> List[Tuple[np.ndarray, np.ndarray]]:
+        """
+        score_vector() for a (n_queries, dim) matrix with one matrix-matrix product.
+        Scores match score_vector() within DENSE_SCORE_TOLERANCE, not bit for bit (gemm vs gemv rounding).
+        """
+        self.ensure_loaded()
+        assert self.product_embs is not None
+        ids, _ = self._id_index()
+
+        scores = q_embs @ self.product_embs.T
+        out = []
+        for i in range(scores.shape[0]):
+            idx = self._top_k(scores[i], top_k)
+            out.append((ids[idx], scores[i][idx]))
+        return out
+
+    @staticmethod
+    def _to_hits(ids: np.ndarray, scores: np.ndarray) -> List[ProductSemanticHit]:
+        return [ProductSemanticHit(product_id=int(pid), score=float(s)) for pid, s in zip(ids, scores)]
+
     def search(self, query: str, top_k: int = 50) -> List[ProductSemanticHit]:
         self.ensure_loaded()
         assert self.product_embs is not None
@@ -364,16 +561,27 @@ class ProductDescriptionEmbedder:
             return []
 
         q_emb = self.encode_texts([q])[0]
-        scores = self.product_embs @ q_emb
-        idx = np.argsort(-scores)[:max(1, top_k)]
+        return self.search_vector(q_emb, top_k=top_k)
 
-        out: List[ProductSemanticHit] = []
-        for i in idx:
-            out.append(ProductSemanticHit(
-                product_id=int(self.product_ids[int(i)]),
-                score=float(scores[int(i)])
-            ))
-        return out
+    def search_vector(self, q_emb: np.ndarray, top_k: int = 50) -> List[ProductSemanticHit]:
+        return self._to_hits(*self.score_vector(q_emb, top_k=top_k))
+
+    def search_batch_vectors(self, q_embs: np.ndarray, top_k: int = 50) -> List[List[ProductSemanticHit]]:
+        return [self._to_hits(ids, scores) for ids, scores in self.score_batch(q_embs, top_k=top_k)]
+
+    def search_ids(self, query: str, product_ids: List[int], top_k: int = 50) -> List[ProductSemanticHit]:
+        """
+        Same as search(), but only scores the given products (candidate rescoring).
+        """
+        q = (query or "").strip().lower()
+        if not q or not product_ids:
+            return []
+
+        q_emb = self.encode_texts([q])[0]
+        return self.search_ids_vector(q_emb, product_ids, top_k=top_k)
+
+    def search_ids_vector(self, q_emb: np.ndarray, product_ids: List[int], top_k: int = 50) -> List[ProductSemanticHit]:
+        return self._to_hits(*self.score_vector(q_emb, top_k=top_k, product_ids=product_ids))
 
 
 # -------------------------
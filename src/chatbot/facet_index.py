@@ -0,0 +1,256 @@
+# This file holds a bitmap index over product facets (gender, TEI, availability, price, product type)
+# It counts matches for any filter combination with bitwise AND/OR, so when filters eliminate
+# everything the bot can instantly say which single relaxation would bring results back
+from __future__ import annotations
+
+import sqlite3
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+# product-type keywords (PRODUCT TYPES group of DOMAIN_KEYWORDS)
+PRODUCT_TYPES = ("parka", "jacket", "vest", "hoody", "hoodie", "shell", "bomber", "coat", "cap", "beanie", "accessory")
+
+PRICE_STEP = 50.0
+
+
+def _to_bitmap(mask: np.ndarray) -> int:
+    # bool mask -> Python int with bit i set for row i
+    if not mask.any():
+        return 0
+    return int.from_bytes(np.packbits(mask, bitorder="little").tobytes(), "little")
+
+
+def normalize_availability(s: Optional[str]) -> str:
+    t = (s or "").strip().lower()
+    if "instock" in t or "in_stock" in t or "in stock" in t:
+        return "in_stock"
+    if "outofstock" in t or "out_of_stock" in t or "out of stock" in t:
+        return "out_of_stock"
+    return "unknown"
+
+
+def _matches(n: int) -> str:
+    return f"{n} match" if n == 1 else f"{n} matches"
+
+
+@dataclass(frozen=True)
+class Relaxation:
+    slot: str
+    value: Any
+    count: int
+    message: str
+
+
+class FacetIndex:
+    """
+    One bitmap (Python int, bit i = i-th product by id) per facet value.
+    Prices use cumulative bitmaps at PRICE_STEP edges plus an exact scan of one bucket.
+    """
+    def __init__(
+        self,
+        product_ids: np.ndarray,
+        prices: np.ndarray,
+        facets: Dict[str, Dict[Any, int]],
+        price_step: float = PRICE_STEP,
+        below: Optional[List[int]] = None,
+    ) -> None:
+        self.product_ids = product_ids
+        self.prices = prices
+        self.facets = facets
+        self.price_step = price_step
+        self.all = (1 << len(product_ids)) - 1
+
+        valid = ~np.isnan(prices)
+        top = float(prices[valid].max()) if valid.any() else 0.0
+        self.edges = np.arange(0.0, top + price_step * 2, price_step)
+
+        # below[j]: price < edges[j]; bucket_rows[j]: rows with edges[j] <= price < edges[j + 1]
+        bucket = np.full(len(prices), len(self.edges), dtype=np.int64)
+        bucket[valid] = np.floor(prices[valid] / price_step).astype(np.int64)
+        order = np.argsort(bucket, kind="stable")
+        bounds = np.searchsorted(bucket[order], np.arange(len(self.edges) + 1))
+        self._bucket_rows = [order[bounds[j]:bounds[j + 1]] for j in range(len(self.edges))]
+        self._below = below if below is not None else [_to_bitmap(valid & (prices < e)) for e in self.edges]
+        self._valid = _to_bitmap(valid)
+
+    @classmethod
+    def from_db(cls, conn: sqlite3.Connection, price_step: float = PRICE_STEP) -> "FacetIndex":
+        rows = conn.execute(
+            "SELECT id, price, gender_norm, tei_level, availability FROM products ORDER BY id"
+        ).fetchall()
+        ids = np.array([int(r[0]) for r in rows], dtype=np.int64)
+        row_of = {int(pid): i for i, pid in enumerate(ids)}
+        prices = np.array([np.nan if r[1] is None else float(r[1]) for r in rows], dtype=np.float64)
+
+        def bitmaps(values: List[Any]) -> Dict[Any, int]:
+            arr = np.array(values, dtype=object)
+            return {v: _to_bitmap(arr == v) for v in set(values) if v is not None}
+
+        facets: Dict[str, Dict[Any, int]] = {
+            "gender": bitmaps([r[2] for r in rows]),
+            "tei": bitmaps([None if r[3] is None else int(r[3]) for r in rows]),
+            "availability": bitmaps([normalize_availability(r[4]) for r in rows]),
+        }
+
+        placeholders = ",".join(["?"] * len(PRODUCT_TYPES))
+        type_masks = {t: np.zeros(len(ids), dtype=bool) for t in PRODUCT_TYPES}
+        for pid, kw in conn.execute(
+            f"SELECT product_id, keyword FROM product_keywords WHERE keyword IN ({placeholders})",
+            PRODUCT_TYPES,
+        ).fetchall():
+            i = row_of.get(int(pid))
+            if i is not None:
+                type_masks[kw][i] = True
+        facets["product_type"] = {t: _to_bitmap(m) for t, m in type_masks.items()}
+
+        return cls(ids, prices, facets, price_step=price_step)
+
+    def to_arrays(self) -> Tuple[Dict[str, np.ndarray], Dict[str, Any]]:
+        """
+        Flat form for shared_arrays.py: every facet and price bitmap as one fixed-width
+        little-endian byte row, plus the JSON-serializable (facet, value) key of each row.
+        """
+        width = (len(self.product_ids) + 7) // 8
+        keys = [[facet, value] for facet, values in self.facets.items() for value in values]
+        bitmaps = [self.facets[facet][value] for facet, value in keys] + self._below
+        rows = np.frombuffer(b"".join(b.to_bytes(width, "little") for b in bitmaps), dtype=np.uint8)
+        arrays = {
+            "product_ids": self.product_ids,
+            "prices": self.prices,
+            "bitmaps": rows.reshape(len(bitmaps), width),
+        }
+        meta = {"price_step": self.price_step, "facets": list(self.facets), "keys": keys}
+        return arrays, meta
+
+    @classmethod
+    def from_arrays(cls, arrays: Dict[str, np.ndarray], meta: Dict[str, Any]) -> "FacetIndex":
+        # ids/prices are adopted as-is; each bitmap is one bytes -> int copy (no DB scan, no mask building)
+        rows = arrays["bitmaps"]
+        bitmaps = [int.from_bytes(rows[i].tobytes(), "little") for i in range(len(rows))]
+        facets: Dict[str, Dict[Any, int]] = {facet: {} for facet in meta["facets"]}
+        for (facet, value), b in zip(meta["keys"], bitmaps):
+            facets[facet][value] = b
+        return cls(
+            arrays["product_ids"], arrays["prices"], facets,
+            price_step=meta["price_step"], below=bitmaps[len(meta["keys"]):],
+        )
+
+    # -------------------------
+    # Bitmaps
+    # -------------------------
+    def _bucket_of(self, x: float) -> int:
+        return int(min(max(np.floor(x / self.price_step), 0), len(self.edges) - 1))
+
+    def price_le(self, x: float) -> int:
+        j = self._bucket_of(x)
+        if x < 0:
+            return 0
+        rows = self._bucket_rows[j]
+        partial = np.zeros(len(self.prices), dtype=bool)
+        partial[rows[self.prices[rows] <= x]] = True
+        return self._below[j] | _to_bitmap(partial)
+
+    def price_ge(self, x: float) -> int:
+        # complement of price < x within products that have a price
+        j = self._bucket_of(x)
+        rows = self._bucket_rows[j]
+        partial = np.zeros(len(self.prices), dtype=bool)
+        partial[rows[self.prices[rows] < x]] = True
+        below_x = self._below[j] | _to_bitmap(partial) if x > 0 else 0
+        return self._valid & ~below_x
+
+    def bitmap(
+        self,
+        gender: Optional[str] = None,
+        price_min: Optional[float] = None,
+        price_max: Optional[float] = None,
+        tei: Optional[int] = None,
+        availability: Optional[str] = None,
+        product_type: Optional[str] = None,
+    ) -> int:
+        b = self.all
+        if gender is not None:
+            # same rule as retrieval: unisex products match any gender
+            g = self.facets["gender"]
+            b &= g.get(gender, 0) | g.get("unisex", 0)
+        if price_min is not None:
+            b &= self.price_ge(price_min)
+        if price_max is not None:
+            b &= self.price_le(price_max)
+        if tei is not None:
+            b &= self.facets["tei"].get(int(tei), 0)
+        if availability is not None:
+            b &= self.facets["availability"].get(availability, 0)
+        if product_type is not None:
+            b &= self.facets["product_type"].get(product_type, 0)
+        return b
+
+    def count(self, **constraints: Any) -> int:
+        return self.bitmap(**constraints).bit_count()
+
+    def ids_bitmap(self, ids: Any) -> int:
+        # bitmap of the given product ids (ids outside the index are ignored)
+        ids = np.asarray(ids, dtype=np.int64)
+        pos = np.searchsorted(self.product_ids, ids)
+        pos, ids = pos[pos < len(self.product_ids)], ids[pos < len(self.product_ids)]
+        mask = np.zeros(len(self.product_ids), dtype=bool)
+        mask[pos[self.product_ids[pos] == ids]] = True
+        return _to_bitmap(mask)
+
+    def matching_ids(self, **constraints: Any) -> List[int]:
+        b = self.bitmap(**constraints)
+        return [int(self.product_ids[i]) for i in range(len(self.product_ids)) if (b >> i) & 1]
+
+    # -------------------------
+    # Relaxation suggestions
+    # -------------------------
+    def suggest_relaxations(
+        self,
+        constraints: Dict[str, Any],
+        max_suggestions: int = 3,
+        candidates: Optional[int] = None,
+    ) -> List[Relaxation]:
+        """
+        For every active constraint, the smallest single change that yields matches
+        (budget/minimum price move to the nearest price edge with results, other facets are dropped).
+        candidates: bitmap (see ids_bitmap) of the products the search can return, e.g. the scored
+        candidates of the current query; only those are counted. Default: the whole catalog.
+        """
+        active = {k: v for k, v in constraints.items() if v is not None}
+        out: List[Relaxation] = []
+        scope = self.all if candidates is None else candidates
+
+        def count(**c: Any) -> int:
+            return (self.bitmap(**c) & scope).bit_count()
+
+        for slot, value in active.items():
+            others = {k: v for k, v in active.items() if k != slot}
+
+            if slot == "price_max":
+                for edge in self.edges[self.edges > value]:
+                    n = count(**others, price_max=float(edge))
+                    if n:
+                        out.append(Relaxation(slot, float(edge), n, f"{_matches(n)} if budget is ${edge:g}"))
+                        break
+            elif slot == "price_min":
+                for edge in self.edges[self.edges < value][::-1]:
+                    n = count(**others, price_min=float(edge))
+                    if n:
+                        out.append(Relaxation(slot, float(edge), n, f"{_matches(n)} if minimum price is ${edge:g}"))
+                        break
+            else:
+                n = count(**others)
+                if n:
+                    m = _matches(n)
+                    label = {
+                        "gender": f"{m} if you include all genders",
+                        "tei": f"{m} without the TEI {value} requirement",
+                        "availability": f"{m} including {value.replace('_', ' ')} items",
+                        "product_type": f"{m} for any product type",
+                    }.get(slot, f"{m} without the {slot} filter")
+                    out.append(Relaxation(slot, None, n, label))
+
+        out.sort(key=lambda r: r.count, reverse=True)
+        return out[:max_suggestions]
@@ -0,0 +1,209 @@
+# This file builds versioned index bundles (DB snapshot + description vectors) and hot-swaps them into a running process
+# A bundle is built off to the side with the already-loaded encoder and published with an atomic rename;
+# BundleManager swaps the live ChatResources, lets in-flight turns finish on the old one and closes it after
+# Build a bundle from the repo root: PYTHONPATH=src python -m chatbot.index_bundle
+from __future__ import annotations
+
+import json
+import os
+import shutil
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional
+
+from .chatbot_runner import DB_PATH, ChatResources, catalog_version
+from .embedder import ProductDescriptionEmbedder
+
+BUNDLES_DIR = "data/bundles"
+BUNDLE_DB = "catalog.db"
+MANIFEST = "manifest.json"
+
+
+# -------------------------
+# Build
+# -------------------------
+def bundle_versions(bundles_dir: str = BUNDLES_DIR) -> List[str]:
+    if not os.path.isdir(bundles_dir):
+        return []
+    return sorted(
+        d for d in os.listdir(bundles_dir)
+        if d.startswith("v") and os.path.exists(os.path.join(bundles_dir, d, MANIFEST))
+    )
+
+
+def latest_bundle(bundles_dir: str = BUNDLES_DIR) -> Optional[str]:
+    versions = bundle_versions(bundles_dir)
+    return os.path.join(bundles_dir, versions[-1]) if versions else None
+
+
+def build_bundle(
+    desc_index: ProductDescriptionEmbedder,
+    db_path: str = DB_PATH,
+    bundles_dir: str = BUNDLES_DIR,
+) -> str:
+    """
+    Snapshot db_path (SQLite online backup, consistent even while it is written to), embed the
+    snapshot's product descriptions with desc_index's model, and publish as bundles_dir/vNNNN.
+    The keyword matrix and facets are derived from the snapshot when the bundle is loaded.
+    """
+    os.makedirs(bundles_dir, exist_ok=True)
+    versions = bundle_versions(bundles_dir)
+    version = f"v{int(versions[-1][1:]) + 1 if versions else 1:04d}"
+
+    tmp_dir = os.path.join(bundles_dir, f".building-{version}-{os.getpid()}")
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+
+    try:
+        snapshot_path = os.path.join(tmp_dir, BUNDLE_DB)
+        src = sqlite3.connect(db_path)
+        snap = sqlite3.connect(snapshot_path)
+        try:
+            src.backup(snap)
+        finally:
+            src.close()
+        snap.row_factory = sqlite3.Row
+
+        bundle_index = desc_index.with_data_dir(tmp_dir)
+        bundle_index.build_from_db(snap)
+        bundle_index.save_cache()
+
+        manifest = {
+            "version": version,
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "source_db": os.path.abspath(db_path),
+            "catalog_version": catalog_version(snap),
+            "products": len(bundle_index.product_ids),
+            "model_name": bundle_index.model_name,
+        }
+        snap.close()
+
+        with open(os.path.join(tmp_dir, MANIFEST), "w", encoding="utf-8") as f:
+            json.dump(manifest, f, indent=2)
+
+        final_dir = os.path.join(bundles_dir, version)
+        os.replace(tmp_dir, final_dir)
+    except BaseException:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        raise
+    return final_dir
+
+
+def read_manifest(bundle_dir: str) -> Dict[str, object]:
+    with open(os.path.join(bundle_dir, MANIFEST), "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def load_bundle(bundle_dir: str, models: ChatResources, read_only_pool: bool = True) -> ChatResources:
+    # catalog side from the bundle, encoders shared with the running process (no model reload)
+    return ChatResources.load(
+        db_path=os.path.join(bundle_dir, BUNDLE_DB),
+        read_only_pool=read_only_pool,
+        data_dir=bundle_dir,
+        models=models,
+    )
+
+
+# -------------------------
+# Live swap
+# -------------------------
+class _Generation:
+    __slots__ = ("res", "version", "leases", "retired")
+
+    def __init__(self, res: ChatResources, version: str) -> None:
+        self.res = res
+        self.version = version
+        self.leases = 0
+        self.retired = False
+
+
+class BundleManager:
+    """
+    Holds the live ChatResources. Requests lease() the current generation for their duration;
+    swap() publishes a new one atomically, and a retired generation is closed as soon as
+    its last lease is returned.
+    """
+    def __init__(self, res: ChatResources, version: str = "startup") -> None:
+        self._lock = threading.Lock()
+        self._current = _Generation(res, version)
+        self._draining: List[_Generation] = []
+        self.swaps = 0
+
+    @property
+    def current(self) -> ChatResources:
+        return self._current.res
+
+    @property
+    def version(self) -> str:
+        return self._current.version
+
+    @contextmanager
+    def lease(self) -> Iterator[ChatResources]:
+        with self._lock:
+            gen = self._current
+            gen.leases += 1
+        try:
+            yield gen.res
+        finally:
+            with self._lock:
+                gen.leases -= 1
+                done = gen.retired and gen.leases == 0
+                if done:
+                    self._draining.remove(gen)
+            if done:
+                gen.res.close()
+
+    def swap(self, res: ChatResources, version: str) -> None:
+        with self._lock:
+            old = self._current
+            self._current = _Generation(res, version)
+            old.retired = True
+            idle = old.leases == 0
+            if not idle:
+                self._draining.append(old)
+            self.swaps += 1
+        if idle:
+            old.res.close()
+
+    def reload(self, bundle_dir: Optional[str] = None, db_path: str = DB_PATH) -> str:
+        """
+        Load bundle_dir (or build a fresh bundle from db_path) and swap it in. Blocking:
+        run it on a worker thread in servers. Returns the new version.
+        """
+        models = self.current
+        if bundle_dir is None:
+            bundle_dir = build_bundle(models.desc_index, db_path=db_path)
+        res = load_bundle(bundle_dir, models)
+        self.swap(res, str(read_manifest(bundle_dir)["version"]))
+        return self.version
+
+    def stats(self) -> Dict[str, object]:
+        with self._lock:
+            return {
+                "version": self._current.version,
+                "leases": self._current.leases,
+                "draining": [(g.version, g.leases) for g in self._draining],
+                "swaps": self.swaps,
+            }
+
+
+def prune_bundles(keep: int = 3, bundles_dir: str = BUNDLES_DIR) -> List[str]:
+    # delete all but the newest `keep` bundles
+    removed = []
+    for v in bundle_versions(bundles_dir)[:-keep] if keep > 0 else []:
+        shutil.rmtree(os.path.join(bundles_dir, v), ignore_errors=True)
+        removed.append(v)
+    return removed
+
+
+def main() -> None:
+    desc_index = ProductDescriptionEmbedder(data_dir="data")
+    t0 = time.perf_counter()
+    bundle_dir = build_bundle(desc_index)
+    print(f"Built {bundle_dir} in {time.perf_counter() - t0:.1f}s:", read_manifest(bundle_dir))
+
+
+if __name__ == "__main__":
+    main()
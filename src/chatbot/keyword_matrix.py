@@ -0,0 +1,106 @@
+# This file holds the product x keyword matrix used for keyword scoring
+# It is built once from product_keywords at startup, so ranking no longer queries SQL per turn
+from __future__ import annotations
+
+import sqlite3
+from typing import Dict, List, Sequence
+
+import numpy as np
+
+
+def to_canonical_kw(s: str) -> str:
+    return (s or "").strip().lower().replace(" ", "_")
+
+
+class ProductKeywordMatrix:
+    """
+    Sparse product x keyword matrix in CSR layout (indptr / indices / data).
+    Rows follow product id order, columns follow KeywordEmbedder token order.
+    """
+    def __init__(
+        self,
+        product_ids: Sequence[int],
+        tokens: Sequence[str],
+        indptr: np.ndarray,
+        indices: np.ndarray,
+        data: np.ndarray,
+    ) -> None:
+        self.product_ids = np.asarray(product_ids, dtype=np.int64)
+        self.tokens = [to_canonical_kw(t) for t in tokens]
+        self.indptr = np.asarray(indptr, dtype=np.int64)
+        self.indices = np.asarray(indices, dtype=np.int64)
+        self.data = np.asarray(data, dtype=np.float64)
+
+        self._col: Dict[str, int] = {t: i for i, t in enumerate(self.tokens)}
+        self._row_nnz = np.diff(self.indptr)
+        self._row_of = np.repeat(np.arange(len(self.product_ids), dtype=np.int64), self._row_nnz)
+        self.max_row_nnz = int(self._row_nnz.max()) if len(self._row_nnz) else 0
+
+    @property
+    def shape(self) -> tuple:
+        return len(self.product_ids), len(self.tokens)
+
+    @property
+    def nnz(self) -> int:
+        return int(len(self.indices))
+
+    @classmethod
+    def from_db(cls, conn: sqlite3.Connection, tokens: Sequence[str]) -> "ProductKeywordMatrix":
+        product_ids = [int(r[0]) for r in conn.execute("SELECT id FROM products ORDER BY id").fetchall()]
+        row_of_pid = {pid: i for i, pid in enumerate(product_ids)}
+        col_of_kw = {to_canonical_kw(t): j for j, t in enumerate(tokens)}
+
+        rows: List[int] = []
+        cols: List[int] = []
+        for pid, kw in conn.execute("SELECT product_id, keyword FROM product_keywords").fetchall():
+            i = row_of_pid.get(int(pid))
+            j = col_of_kw.get(to_canonical_kw(kw))
+            # keywords outside the embedder vocabulary can never be matched by a query
+            if i is None or j is None:
+                continue
+            rows.append(i)
+            cols.append(j)
+
+        r = np.asarray(rows, dtype=np.int64)
+        c = np.asarray(cols, dtype=np.int64)
+        order = np.lexsort((c, r))
+        indptr = np.zeros(len(product_ids) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(r, minlength=len(product_ids)), out=indptr[1:])
+
+        return cls(product_ids, tokens, indptr, c[order], np.ones(len(order), dtype=np.float64))
+
+    def query_vector(self, kw_scores: Dict[str, float]) -> np.ndarray:
+        q = np.zeros(len(self.tokens), dtype=np.float64)
+        for kw, s in kw_scores.items():
+            j = self._col.get(to_canonical_kw(kw))
+            if j is not None:
+                q[j] = float(s)
+        return q
+
+    def scores(self, kw_scores: Dict[str, float], top_per_product: int) -> np.ndarray:
+        """
+        Per-product keyword score aligned with self.product_ids:
+        the sum of the top `top_per_product` matched keyword scores of each row.
+        """
+        n_rows = len(self.product_ids)
+        if not kw_scores or n_rows == 0 or top_per_product <= 0:
+            return np.zeros(n_rows, dtype=np.float64)
+
+        q = self.query_vector(kw_scores)
+        vals = self.data * q[self.indices]
+
+        # every row fits inside the top-n budget -> plain sparse-dense product
+        if top_per_product >= self.max_row_nnz:
+            return np.bincount(self._row_of, weights=vals, minlength=n_rows)
+
+        hit = vals > 0
+        rows = self._row_of[hit]
+        vals = vals[hit]
+
+        order = np.lexsort((-vals, rows))
+        rows = rows[order]
+        vals = vals[order]
+        rank = np.arange(len(rows)) - np.searchsorted(rows, rows, side="left")
+        keep = rank < top_per_product
+
+        return np.bincount(rows[keep], weights=vals[keep], minlength=n_rows)
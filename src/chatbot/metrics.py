@@ -0,0 +1,165 @@
+# This file collects per-stage latency and throughput metrics for chat turns
+# Stages are timed with METRICS.span("name") and aggregated into fixed-size log-bucket histograms
+# (p50/p95/p99 within ~5%), so recording stays cheap and memory stays flat however long the process runs
+# The server exposes METRICS.snapshot() at GET /metrics; the console app dumps it to a JSON file periodically
+from __future__ import annotations
+
+import json
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional
+
+# histogram buckets: [0, LOW], then geometric buckets of width GROWTH up to LOW * GROWTH ** (N_BUCKETS - 1)
+LOW = 0.001
+GROWTH = 1.1
+N_BUCKETS = 260  # covers up to ~5e7 (ms: ~14 h, tokens/s: plenty)
+_LOG_GROWTH = math.log(GROWTH)
+
+PERCENTILES = (50, 95, 99)
+
+
+class Histogram:
+    """
+    Counts per geometric bucket + exact count/sum/min/max. Percentiles report the
+    geometric middle of the bucket they fall in (clamped to the observed min/max).
+    """
+    __slots__ = ("counts", "count", "total", "min", "max")
+
+    def __init__(self) -> None:
+        self.counts: List[int] = [0] * N_BUCKETS
+        self.count = 0
+        self.total = 0.0
+        self.min = math.inf
+        self.max = 0.0
+
+    @staticmethod
+    def bucket_of(value: float) -> int:
+        if value <= LOW:
+            return 0
+        return min(N_BUCKETS - 1, int(math.log(value / LOW) / _LOG_GROWTH) + 1)
+
+    def add(self, value: float) -> None:
+        self.counts[self.bucket_of(value)] += 1
+        self.count += 1
+        self.total += value
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+
+    def percentile(self, p: float) -> float:
+        if self.count == 0:
+            return 0.0
+        rank = max(1, math.ceil(p / 100.0 * self.count))
+        seen = 0
+        for i, c in enumerate(self.counts):
+            seen += c
+            if seen >= rank:
+                mid = LOW * GROWTH ** (i - 0.5) if i > 0 else LOW
+                return min(max(mid, self.min), self.max)
+        return self.max
+
+    def summary(self) -> Dict[str, float]:
+        out: Dict[str, float] = {"count": self.count}
+        if self.count:
+            out["mean"] = round(self.total / self.count, 4)
+            out.update({f"p{p}": round(self.percentile(p), 4) for p in PERCENTILES})
+            out["min"] = round(self.min, 4)
+            out["max"] = round(self.max, 4)
+        return out
+
+
+class Metrics:
+    """
+    Named histograms (span durations in ms, or any other observed value such as tokens/s)
+    and counters. Thread-safe; enabled=False turns every call into a no-op.
+    """
+    def __init__(self, enabled: bool = True) -> None:
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._hists: Dict[str, Histogram] = {}
+        self._counters: Dict[str, int] = {}
+        self._started = time.time()
+        self._dumper: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+    def observe(self, name: str, value: float) -> None:
+        if not self.enabled:
+            return
+        with self._lock:
+            hist = self._hists.get(name)
+            if hist is None:
+                hist = self._hists[name] = Histogram()
+            hist.add(value)
+
+    @contextmanager
+    def span(self, name: str) -> Iterator[None]:
+        # wall time of the block in ms, recorded even if it raises
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, (time.perf_counter() - t0) * 1000.0)
+
+    def incr(self, name: str, n: int = 1) -> None:
+        if not self.enabled:
+            return
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + n
+
+    def reset(self) -> None:
+        with self._lock:
+            self._hists.clear()
+            self._counters.clear()
+            self._started = time.time()
+
+    def snapshot(self) -> Dict[str, Any]:
+        """
+        {"uptime_s", "stages": {name: {count, mean, p50, p95, p99, min, max, per_s}}, "counters": {...}}
+        per_s is the stage's throughput (observations per second of uptime).
+        """
+        with self._lock:
+            uptime = max(1e-9, time.time() - self._started)
+            stages = {}
+            for name in sorted(self._hists):
+                s = self._hists[name].summary()
+                s["per_s"] = round(s["count"] / uptime, 4)
+                stages[name] = s
+            return {"uptime_s": round(uptime, 3), "stages": stages, "counters": dict(sorted(self._counters.items()))}
+
+    def dump(self, path: str) -> None:
+        # atomic write, so readers never see a half-written file
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self.snapshot(), f, indent=2)
+        os.replace(tmp, path)
+
+    def start_dump(self, path: str, interval_s: float = 30.0) -> None:
+        """
+        Write snapshot() to path every interval_s seconds from a daemon thread (and once more on stop_dump()).
+        """
+        if self._dumper is not None:
+            return
+        self._stop.clear()
+
+        def run() -> None:
+            while not self._stop.wait(interval_s):
+                self.dump(path)
+            self.dump(path)
+
+        self._dumper = threading.Thread(target=run, name="metrics-dump", daemon=True)
+        self._dumper.start()
+
+    def stop_dump(self) -> None:
+        if self._dumper is None:
+            return
+        self._stop.set()
+        self._dumper.join()
+        self._dumper = None
+
+
+# process-wide registry used by the chatbot modules
+METRICS = Metrics()
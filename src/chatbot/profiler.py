@@ -0,0 +1,171 @@
+# This file captures opt-in per-turn CPU profiles as folded stacks ("a;b;c 42" lines), the input format of
+# flamegraph.pl, inferno and speedscope. Each profile gets a JSON sidecar with the turn's tags (query, state, timing)
+# and the profile directory is pruned to a bounded number of files / bytes
+# mode="sample": a sampler thread reads the working thread's stack every interval_ms (low overhead, statistical)
+# mode="trace": sys.setprofile records every call and return (exact self time per stack, slows the turn down)
+from __future__ import annotations
+
+import itertools
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from types import FrameType
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+PROFILES_DIR = "data/profiles"
+MAX_PROFILES = 200                  # newest profiles kept
+MAX_PROFILE_BYTES = 200 * 1024**2   # and at most this much on disk
+SAMPLE_INTERVAL_MS = 2.0
+
+MODES = ("sample", "trace")
+
+_SEQ = itertools.count()
+
+
+def _label(code: Any) -> str:
+    # ';' separates frames in folded stacks (the count follows the last space, so spaces are fine)
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})".replace(";", ":")
+
+
+def _stack(frame: Optional[FrameType], root: Optional[FrameType]) -> Tuple[str, ...]:
+    # frames from root (exclusive) down to frame, outermost first
+    labels: List[str] = []
+    while frame is not None and frame is not root:
+        labels.append(_label(frame.f_code))
+        frame = frame.f_back
+    return tuple(reversed(labels))
+
+
+class TurnProfile:
+    """
+    Folded stacks of one turn. A turn can run on several threads (the server runs slot filling
+    and search on different executors): every capture() block adds to the same profile.
+    Weights are samples (mode="sample") or microseconds of self time (mode="trace").
+    """
+    def __init__(self, mode: str = "sample", interval_ms: float = SAMPLE_INTERVAL_MS, tags: Optional[Dict[str, Any]] = None) -> None:
+        if mode not in MODES:
+            raise ValueError(f"Unknown profile mode: {mode!r} (expected one of {MODES}).")
+        self.mode = mode
+        self.interval_ms = interval_ms
+        self.tags: Dict[str, Any] = dict(tags or {})
+        self.stacks: Dict[Tuple[str, ...], float] = {}
+        self.captured_ms = 0.0
+        self._lock = threading.Lock()
+
+    def _add(self, stack: Tuple[str, ...], weight: float) -> None:
+        with self._lock:
+            self.stacks[stack] = self.stacks.get(stack, 0.0) + weight
+
+    @contextmanager
+    def capture(self) -> Iterator[None]:
+        # frames 0/1/2: this generator, contextlib's __enter__, the block's caller
+        root = sys._getframe(2).f_back
+        t0 = time.perf_counter()
+        try:
+            if self.mode == "sample":
+                with self._sampling(threading.get_ident(), root):
+                    yield
+            else:
+                with self._tracing():
+                    yield
+        finally:
+            self.captured_ms += (time.perf_counter() - t0) * 1000.0
+
+    @contextmanager
+    def _sampling(self, thread_id: int, root: Optional[FrameType]) -> Iterator[None]:
+        stop = threading.Event()
+
+        def run() -> None:
+            while not stop.wait(self.interval_ms / 1000.0):
+                frame = sys._current_frames().get(thread_id)
+                if frame is not None:
+                    self._add(_stack(frame, root), 1.0)
+
+        sampler = threading.Thread(target=run, name="turn-profiler", daemon=True)
+        sampler.start()
+        try:
+            yield
+        finally:
+            stop.set()
+            sampler.join()
+
+    @contextmanager
+    def _tracing(self) -> Iterator[None]:
+        stack: List[str] = []
+        last = [time.perf_counter()]
+
+        def tick() -> None:
+            now = time.perf_counter()
+            if stack:
+                self._add(tuple(stack), (now - last[0]) * 1e6)
+            last[0] = now
+
+        def on_event(frame: FrameType, event: str, arg: Any) -> None:
+            tick()
+            if event == "call":
+                stack.append(_label(frame.f_code))
+            elif event == "c_call":
+                stack.append(f"{getattr(arg, '__qualname__', repr(arg))} (native)".replace(";", ":"))
+            elif event in ("return", "c_return", "c_exception") and stack:
+                stack.pop()
+
+        previous = sys.getprofile()
+        sys.setprofile(on_event)
+        try:
+            yield
+        finally:
+            sys.setprofile(previous)
+            tick()
+
+    def folded(self) -> str:
+        with self._lock:
+            items = sorted(self.stacks.items())
+        return "".join(f"{';'.join(stack)} {max(1, round(w))}\n" for stack, w in items if stack and w > 0)
+
+    def write(self, out_dir: str = PROFILES_DIR, name: Optional[str] = None) -> str:
+        """
+        Write <name>.folded + <name>.json (tags) into out_dir, prune old profiles, return the .folded path.
+        """
+        os.makedirs(out_dir, exist_ok=True)
+        name = name or f"{time.strftime('%Y%m%dT%H%M%S')}-{os.getpid()}-{next(_SEQ):06d}"
+        path = os.path.join(out_dir, f"{name}.folded")
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(self.folded())
+
+        meta = dict(self.tags)
+        meta.update({
+            "mode": self.mode,
+            "weight_unit": "samples" if self.mode == "sample" else "us",
+            "interval_ms": self.interval_ms if self.mode == "sample" else None,
+            "captured_ms": round(self.captured_ms, 3),
+            "stacks": len(self.stacks),
+        })
+        with open(os.path.join(out_dir, f"{name}.json"), "w", encoding="utf-8") as f:
+            json.dump(meta, f, indent=2, default=str)
+
+        prune_profiles(out_dir)
+        return path
+
+
+def prune_profiles(out_dir: str = PROFILES_DIR, max_files: int = MAX_PROFILES, max_bytes: int = MAX_PROFILE_BYTES) -> int:
+    # drop the oldest profiles (both files) beyond max_files or max_bytes; returns how many were removed
+    entries = []
+    for fn in os.listdir(out_dir):
+        if fn.endswith(".folded"):
+            base = os.path.join(out_dir, fn[:-len(".folded")])
+            files = [p for p in (base + ".folded", base + ".json") if os.path.exists(p)]
+            entries.append((os.path.getmtime(base + ".folded"), base, files, sum(os.path.getsize(p) for p in files)))
+    entries.sort(reverse=True)
+
+    removed = 0
+    total = 0
+    for i, (_, _, files, size) in enumerate(entries):
+        total += size
+        if i >= max_files or total > max_bytes:
+            for p in files:
+                os.remove(p)
+            removed += 1
+    return removed
@@ -0,0 +1,90 @@
+# This file builds query embeddings from cached slot-component embeddings + a fresh message embedding
+# Slot values (gender, use case, TEI, flags, domain keywords) come from a small closed vocabulary,
+# so after warm-up most of the encoder work becomes dictionary lookups
+from __future__ import annotations
+
+import threading
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+
+
+class ComposedQueryEncoder:
+    """
+    query_vec = normalize(slot_weight * normalize(mean(component vectors)) + message_weight * message vector)
+    Component vectors are cached; only the user message is encoded per turn.
+    """
+    def __init__(
+        self,
+        encode_fn: Callable[[List[str]], np.ndarray],
+        slot_weight: float = 0.4,
+        message_weight: float = 0.6,
+        max_cached: int = 4096,
+    ) -> None:
+        self.encode_fn = encode_fn
+        self.slot_weight = slot_weight
+        self.message_weight = message_weight
+        self.max_cached = max_cached
+
+        self._cache: Dict[str, np.ndarray] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.message_encodes = 0
+
+    @staticmethod
+    def _unit(v: np.ndarray) -> np.ndarray:
+        return v / (np.linalg.norm(v) + 1e-12)
+
+    def component_vectors(self, components: List[str]) -> Optional[np.ndarray]:
+        comps = [c.strip().lower() for c in components if c and c.strip()]
+        if not comps:
+            return None
+
+        with self._lock:
+            found = {c: self._cache[c] for c in comps if c in self._cache}
+            missing = list(dict.fromkeys(c for c in comps if c not in found))
+            self.hits += len(comps) - len(missing)
+            self.misses += len(missing)
+
+        if missing:
+            # encode outside the lock so other sessions' cache hits don't queue behind the model;
+            # two threads may encode the same component, setdefault keeps the first vector
+            vecs = self.encode_fn(missing)
+            with self._lock:
+                if len(self._cache) + len(missing) > self.max_cached:
+                    self._cache.clear()
+                for c, v in zip(missing, vecs):
+                    found[c] = self._cache.setdefault(c, np.asarray(v, dtype=np.float32))
+
+        return np.stack([found[c] for c in comps])
+
+    def encode(self, components: List[str], message: str) -> np.ndarray:
+        comp_vecs = self.component_vectors(components)
+        msg = (message or "").strip().lower()
+
+        msg_vec = None
+        if msg:
+            msg_vec = np.asarray(self.encode_fn([msg])[0], dtype=np.float32)
+            self.message_encodes += 1
+
+        if comp_vecs is None and msg_vec is None:
+            raise ValueError("Nothing to encode: no slot components and an empty message.")
+        if comp_vecs is None:
+            return self._unit(msg_vec).astype(np.float32)
+
+        slot_vec = self._unit(comp_vecs.mean(axis=0))
+        if msg_vec is None:
+            return slot_vec.astype(np.float32)
+
+        return self._unit(self.slot_weight * slot_vec + self.message_weight * msg_vec).astype(np.float32)
+
+    def stats(self) -> Dict[str, float]:
+        total = self.hits + self.misses
+        return {
+            "cached_components": len(self._cache),
+            "component_hits": self.hits,
+            "component_misses": self.misses,
+            "component_hit_rate": round(self.hits / total, 4) if total else 0.0,
+            "message_encodes": self.message_encodes,
+        }
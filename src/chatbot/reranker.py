@@ -0,0 +1,172 @@
+# This file adds an optional second ranking stage: a small CPU cross-encoder rescores the top N fused results
+# All (query, product) pairs of a turn go through one batched forward pass; pair scores are cached,
+# and the stage is skipped whenever it would not fit in the per-turn latency budget
+from __future__ import annotations
+
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+from sentence_transformers import CrossEncoder
+
+
+class CrossEncoderReranker:
+    """
+    Reorders the first top_n of a fused ranking by cross-encoder score (ties keep the fused order).
+    Pair scores are cached by (catalog version, query hash, product id), so a hot-reloaded
+    catalog bundle whose product texts changed never reuses scores of the old texts.
+    The budget check uses a running estimate of per-pair cost: if the uncached pairs would not
+    finish before the turn's deadline, the fused order is returned unchanged. Every such skip
+    shrinks the estimate by skip_decay, so an estimate that is too high cannot skip forever.
+    """
+    def __init__(
+        self,
+        model_name: str = "cross-encoder/ms-marco-MiniLM-L-6-v2",
+        top_n: int = 20,
+        budget_ms: float = 150.0,
+        batch_size: int = 32,
+        max_cached: int = 20000,
+        skip_decay: float = 0.9,
+    ) -> None:
+        self.model_name = model_name
+        self.top_n = top_n
+        self.budget_ms = budget_ms
+        self.batch_size = batch_size
+        self.max_cached = max_cached
+        self.skip_decay = skip_decay
+
+        self._model: Optional[CrossEncoder] = None
+        self._pair_scores: "OrderedDict[Tuple[int, str, int], float]" = OrderedDict()
+        self._ms_per_pair: Optional[float] = None
+        # pair cache + cost estimate are shared by all retrieval threads
+        self._lock = threading.Lock()
+
+        self.reranked = 0
+        self.skipped = 0
+        self.over_budget = 0
+        self.pair_hits = 0
+        self.pair_misses = 0
+
+    def _load_model(self) -> CrossEncoder:
+        model = self._model
+        if model is None:
+            with self._lock:
+                if self._model is None:
+                    self._model = CrossEncoder(self.model_name)
+                model = self._model
+        return model
+
+    @staticmethod
+    def query_hash(query: str) -> str:
+        q = " ".join((query or "").lower().split())
+        return hashlib.sha1(q.encode("utf-8")).hexdigest()
+
+    def warm_up(self) -> None:
+        # load the model and seed the per-pair cost estimate outside any turn budget.
+        # The first forward pass pays one-off setup costs, so it runs untimed; the estimate
+        # comes from a second pass over a turn-sized batch
+        model = self._load_model()
+        pairs = [("warm up", "warm up")] * max(2, self.top_n)
+        model.predict(pairs, batch_size=self.batch_size)
+        with self._lock:
+            self._ms_per_pair = None
+        self._predict(pairs)
+
+    def _predict(self, pairs: List[Tuple[str, str]]) -> np.ndarray:
+        model = self._load_model()
+        t0 = time.perf_counter()
+        scores = np.asarray(model.predict(pairs, batch_size=self.batch_size), dtype=np.float64).reshape(-1)
+        per_pair = (time.perf_counter() - t0) * 1000.0 / max(1, len(pairs))
+        with self._lock:
+            if self._ms_per_pair is None:
+                self._ms_per_pair = per_pair
+            else:
+                self._ms_per_pair = 0.7 * self._ms_per_pair + 0.3 * per_pair
+        return scores
+
+    def _cache_put(self, items: List[Tuple[Tuple[int, str, int], float]]) -> None:
+        with self._lock:
+            for key, score in items:
+                self._pair_scores[key] = score
+                self._pair_scores.move_to_end(key)
+            while len(self._pair_scores) > self.max_cached:
+                self._pair_scores.popitem(last=False)
+
+    def rerank(
+        self,
+        query: str,
+        ids: np.ndarray,
+        scores: np.ndarray,
+        text_fn: Callable[[List[int]], List[str]],
+        deadline: Optional[float] = None,
+        catalog_version: int = 0,
+    ) -> Tuple[np.ndarray, np.ndarray, bool]:
+        """
+        ids/scores: fused ranking (best first). text_fn maps product ids to their texts.
+        deadline: time.perf_counter() value the turn must finish by (default: now + budget_ms).
+        catalog_version: version of the catalog text_fn reads from (part of the pair cache key).
+        Returns (ids, scores, reranked). The head keeps its fused scores, handed out by the new rank
+        (highest to the new first), so scores stay non-increasing and the tail stays below the head.
+        """
+        n = min(self.top_n, len(ids))
+        if n < 2:
+            return ids, scores, False
+        if deadline is None:
+            deadline = time.perf_counter() + self.budget_ms / 1000.0
+
+        qh = self.query_hash(query)
+        head = [int(x) for x in ids[:n]]
+        with self._lock:
+            known = {
+                pid: self._pair_scores[(catalog_version, qh, pid)]
+                for pid in head if (catalog_version, qh, pid) in self._pair_scores
+            }
+            self.pair_hits += len(known)
+            self.pair_misses += n - len(known)
+        missing = [pid for pid in head if pid not in known]
+
+        if missing:
+            if self._ms_per_pair is None:
+                # not warmed up: the model load counts against this turn's budget
+                self.warm_up()
+            remaining_ms = (deadline - time.perf_counter()) * 1000.0
+            estimate_ms = self._ms_per_pair * len(missing)
+            if remaining_ms <= 0 or estimate_ms > remaining_ms:
+                if remaining_ms > 0:
+                    # skipped on the estimate alone: decay it so the stage is retried eventually
+                    # and _predict measures the real cost again
+                    with self._lock:
+                        self._ms_per_pair *= self.skip_decay
+                self.skipped += 1
+                return ids, scores, False
+
+            texts = text_fn(missing)
+            q = " ".join((query or "").split())
+            ce = self._predict([(q, t) for t in texts])
+            fresh = {pid: float(s) for pid, s in zip(missing, ce.tolist())}
+            self._cache_put([((catalog_version, qh, pid), s) for pid, s in fresh.items()])
+            known.update(fresh)
+            if time.perf_counter() > deadline:
+                self.over_budget += 1
+
+        ce_head = np.array([known[pid] for pid in head], dtype=np.float64)
+        order = np.lexsort((np.arange(n), -ce_head))
+
+        new_ids = np.concatenate([ids[:n][order], ids[n:]])
+        new_scores = np.concatenate([-np.sort(-scores[:n]), scores[n:]])
+        self.reranked += 1
+        return new_ids, new_scores, True
+
+    def stats(self) -> Dict[str, float]:
+        total = self.pair_hits + self.pair_misses
+        return {
+            "reranked": self.reranked,
+            "skipped": self.skipped,
+            "over_budget": self.over_budget,
+            "cached_pairs": len(self._pair_scores),
+            "pair_hit_rate": round(self.pair_hits / total, 4) if total else 0.0,
+            "ms_per_pair": round(self._ms_per_pair, 4) if self._ms_per_pair is not None else None,
+        }
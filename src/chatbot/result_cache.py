@@ -0,0 +1,122 @@
+# This file caches scored retrieval candidates so repeated searches skip encoding + scoring
+# Entries are dropped whenever the catalog or index version changes
+from __future__ import annotations
+
+import sys
+import threading
+from collections import OrderedDict, deque
+from typing import Any, Dict, Hashable, Optional, Tuple
+
+import numpy as np
+
+
+def approx_size(obj: Any, seen: Optional[set] = None) -> int:
+    # recursive sys.getsizeof (containers, __dict__/__slots__ objects, numpy buffers)
+    seen = seen if seen is not None else set()
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+
+    if isinstance(obj, np.ndarray):
+        return sys.getsizeof(obj) + (obj.nbytes if obj.base is not None else 0)
+
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(approx_size(k, seen) + approx_size(v, seen) for k, v in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset, deque)):
+        size += sum(approx_size(x, seen) for x in obj)
+    elif hasattr(obj, "__dict__"):
+        size += approx_size(vars(obj), seen)
+    elif hasattr(type(obj), "__slots__"):
+        size += sum(approx_size(getattr(obj, a), seen) for a in type(obj).__slots__ if hasattr(obj, a))
+    return size
+
+
+class RankedResultCache:
+    """
+    LRU cache of RankingSession candidate sets, shared by all sessions of one ChatResources.
+    Keys are (normalized query, filter tuple, scoring params); values are (channel scores, filter columns)
+    and are read-only for the sessions that get them. Safe to share across search worker threads.
+    """
+    def __init__(self, max_entries: int = 1024) -> None:
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Hashable, Tuple[Any, int]]" = OrderedDict()
+        self._version: Optional[Hashable] = None
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    @staticmethod
+    def make_key(query: str, filters: Tuple[Any, ...], params: Tuple[Any, ...]) -> Hashable:
+        q = " ".join((query or "").lower().split())
+        return q, tuple(filters), tuple(params)
+
+    def sync_version(self, version: Hashable) -> None:
+        with self._lock:
+            if version == self._version:
+                return
+            if self._entries:
+                self.invalidations += 1
+            self._entries.clear()
+            self._bytes = 0
+            self._version = version
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key: Hashable, value: Any, version: Optional[Hashable] = None) -> None:
+        # version: what the value was computed against; skipped if the cache has moved on since
+        if self.max_entries <= 0:
+            return
+        size = approx_size(key) + approx_size(value)
+        with self._lock:
+            if version is not None and version != self._version:
+                return
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= old[1]
+
+            self._entries[key] = (value, size)
+            self._bytes += size
+
+            while len(self._entries) > self.max_entries:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self._bytes -= evicted_size
+                self.evictions += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hit_rate, 4),
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+                "approx_bytes": self._bytes,
+                "version": self._version,
+            }
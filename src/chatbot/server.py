@@ -0,0 +1,242 @@
+# This file serves the chatbot to many concurrent users over HTTP and WebSocket (aiohttp)
+# All sessions share one ChatResources (models + indexes); the blocking LLM and retrieval work
+# runs on executor pools so the event loop only does I/O and session bookkeeping
+# Idle sessions are spilled to disk by the session store and rehydrated on their next message
+# POST /admin/reload hot-swaps a new catalog bundle (see index_bundle.py) without reloading any model
+# GET /metrics returns per-stage latency histograms and counters (see metrics.py)
+# "profile": true in a /chat body (or ?profile=1 on /ws) writes a CPU profile per turn (see profiler.py)
+# Run from the repo root: PYTHONPATH=src python -m chatbot.server
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+import uuid
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict
+from typing import Any, Dict, Optional
+
+from aiohttp import WSMsgType, web
+
+from .chatbot_runner import LOG_LEVEL, ChatResources, ChatSession, TurnResult
+from .index_bundle import BundleManager
+from .metrics import METRICS
+from .session_store import SessionStore
+
+HOST = "127.0.0.1"
+PORT = 8080
+
+# the local LLM is one model instance -> one worker; retrieval uses one read-only connection per worker
+LLM_WORKERS = 1
+SEARCH_WORKERS = 4
+
+MAX_MESSAGE_CHARS = 2000
+
+# session store: spill sessions idle for SESSION_TTL_S, keep at most MAX_LIVE_SESSIONS in memory
+SESSION_TTL_S = 1800.0
+MAX_LIVE_SESSIONS = 1000
+SWEEP_INTERVAL_S = 60.0
+
+
+class ChatServer:
+    """
+    Session registry + turn scheduling on top of one shared ChatResources.
+    """
+    def __init__(
+        self,
+        res: ChatResources,
+        llm_workers: int = LLM_WORKERS,
+        search_workers: int = SEARCH_WORKERS,
+    ) -> None:
+        self.bundles = BundleManager(res)
+        self.sessions = SessionStore(
+            lambda: ChatSession(self.bundles.current), ttl_s=SESSION_TTL_S, max_live=MAX_LIVE_SESSIONS,
+        )
+        # turns of one session run one at a time; a lock lives only while a turn holds or awaits it
+        self._locks: "weakref.WeakValueDictionary[str, asyncio.Lock]" = weakref.WeakValueDictionary()
+        self.llm_pool = ThreadPoolExecutor(max_workers=llm_workers, thread_name_prefix="llm")
+        self.search_pool = ThreadPoolExecutor(max_workers=search_workers, thread_name_prefix="search")
+        self.reload_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="reload")
+
+    @staticmethod
+    def new_session_id(session_id: Optional[str]) -> str:
+        return session_id or uuid.uuid4().hex
+
+    def _lock(self, sid: str) -> asyncio.Lock:
+        lock = self._locks.get(sid)
+        if lock is None:
+            lock = asyncio.Lock()
+            self._locks[sid] = lock
+        return lock
+
+    async def run_turn(self, sid: str, message: str, profile: bool = False) -> TurnResult:
+        loop = asyncio.get_running_loop()
+
+        # the lease keeps this turn on one catalog version even if a reload swaps mid-turn
+        # server.turn also counts the wait for the session lock and for a free worker
+        with METRICS.span("server.turn"):
+            async with self._lock(sid):
+                with self.bundles.lease() as res, self.sessions.checkout(sid) as session:
+                    session.rebind(res)
+                    session.begin_turn(message, profile=profile, tags={"session_id": sid})
+                    out: Optional[TurnResult] = None
+                    error: Optional[BaseException] = None
+                    try:
+                        out = await self._turn(loop, session, message)
+                        return out
+                    except BaseException as e:
+                        # failed or cancelled (client went away) turns are traced too
+                        error = e
+                        raise
+                    finally:
+                        if session.profiling:
+                            await loop.run_in_executor(self.search_pool, session.end_turn, out, error)
+                        else:
+                            session.end_turn(out, error)  # at most one trace line
+
+    async def _turn(self, loop: asyncio.AbstractEventLoop, session: ChatSession, message: str) -> TurnResult:
+        if session.is_more_command(message):
+            return await loop.run_in_executor(self.search_pool, session.more)
+
+        qtext = await loop.run_in_executor(self.llm_pool, session.fill_slots, message)
+        if qtext is not None:
+            return TurnResult(reply=f"Bot: {qtext}", question=qtext)
+        return await loop.run_in_executor(self.search_pool, session.search, message)
+
+    @staticmethod
+    async def json_object(request: web.Request, usage: str) -> Dict[str, Any]:
+        # parsed JSON body; anything but an object (invalid JSON, list, string, number, null) is a 400
+        try:
+            body = await request.json()
+        except ValueError:
+            body = None
+        if not isinstance(body, dict):
+            raise web.HTTPBadRequest(text=f"Body must be a JSON object: {usage}")
+        return body
+
+    @staticmethod
+    def turn_payload(sid: str, out: TurnResult, started: float) -> Dict[str, Any]:
+        payload = {
+            "session_id": sid,
+            "reply": out.reply,
+            "question": out.question,
+            "results": [asdict(p) for p in out.results],
+            "relaxations": [r.message for r in out.relaxations],
+            "has_more": out.has_more,
+            "latency_ms": round((time.perf_counter() - started) * 1000.0, 2),
+        }
+        if out.profile is not None:
+            payload["profile"] = out.profile
+        return payload
+
+    # -------------------------
+    # HTTP handlers
+    # -------------------------
+    async def handle_chat(self, request: web.Request) -> web.Response:
+        started = time.perf_counter()
+        body = await self.json_object(request, '{"session_id": ..., "message": ...}')
+
+        message = str(body.get("message") or "").strip()[:MAX_MESSAGE_CHARS]
+        if not message:
+            raise web.HTTPBadRequest(text="Empty message.")
+        if not isinstance(body.get("session_id"), (str, type(None))):
+            raise web.HTTPBadRequest(text="session_id must be a string.")
+
+        sid = self.new_session_id(body.get("session_id"))
+        out = await self.run_turn(sid, message, profile=bool(body.get("profile")))
+        return web.json_response(self.turn_payload(sid, out, started))
+
+    async def handle_ws(self, request: web.Request) -> web.WebSocketResponse:
+        ws = web.WebSocketResponse(heartbeat=30.0)
+        await ws.prepare(request)
+        sid = self.new_session_id(request.query.get("session_id"))
+        profile = request.query.get("profile") in ("1", "true")
+        await ws.send_json({"session_id": sid})
+
+        async for msg in ws:
+            if msg.type != WSMsgType.TEXT:
+                if msg.type == WSMsgType.ERROR:
+                    break
+                continue
+            message = msg.data.strip()[:MAX_MESSAGE_CHARS]
+            if not message:
+                continue
+            started = time.perf_counter()
+            out = await self.run_turn(sid, message, profile=profile)
+            await ws.send_json(self.turn_payload(sid, out, started))
+        return ws
+
+    async def handle_end_session(self, request: web.Request) -> web.Response:
+        removed = self.sessions.drop(request.match_info["session_id"])
+        return web.json_response({"removed": removed})
+
+    async def handle_health(self, request: web.Request) -> web.Response:
+        cache = self.bundles.current.result_cache
+        return web.json_response({
+            "ok": True,
+            "sessions": self.sessions.stats(),
+            "catalog": self.bundles.stats(),
+            "result_cache": cache.stats() if cache is not None else None,
+        })
+
+    async def handle_metrics(self, request: web.Request) -> web.Response:
+        return web.json_response(METRICS.snapshot())
+
+    async def handle_reload(self, request: web.Request) -> web.Response:
+        # body (optional): {"bundle": "data/bundles/v0003"}; without it a bundle is built from the live DB
+        body = await self.json_object(request, '{"bundle": "data/bundles/v0003"}') if request.can_read_body else {}
+        if not isinstance(body.get("bundle"), (str, type(None))):
+            raise web.HTTPBadRequest(text="bundle must be a string.")
+        loop = asyncio.get_running_loop()
+        started = time.perf_counter()
+        version = await loop.run_in_executor(self.reload_pool, self.bundles.reload, body.get("bundle"))
+
+        # idle sessions drop their references to the old catalog now; busy ones rebind on their next turn
+        for session in self.sessions.idle_sessions():
+            session.rebind(self.bundles.current)
+        return web.json_response({
+            "version": version,
+            "reload_ms": round((time.perf_counter() - started) * 1000.0, 2),
+            "catalog": self.bundles.stats(),
+        })
+
+    def app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post("/chat", self.handle_chat)
+        app.router.add_get("/ws", self.handle_ws)
+        app.router.add_delete("/sessions/{session_id}", self.handle_end_session)
+        app.router.add_get("/health", self.handle_health)
+        app.router.add_get("/metrics", self.handle_metrics)
+        app.router.add_post("/admin/reload", self.handle_reload)
+        app.on_startup.append(self._on_startup)
+        app.on_cleanup.append(self._on_cleanup)
+        return app
+
+    async def _sweep_sessions(self) -> None:
+        while True:
+            await asyncio.sleep(SWEEP_INTERVAL_S)
+            self.sessions.evict_idle()
+
+    async def _on_startup(self, app: web.Application) -> None:
+        self._sweeper = asyncio.create_task(self._sweep_sessions())
+
+    async def _on_cleanup(self, app: web.Application) -> None:
+        self._sweeper.cancel()
+        self.llm_pool.shutdown(wait=True)
+        self.search_pool.shutdown(wait=True)
+        self.reload_pool.shutdown(wait=True)
+        self.sessions.close()
+        self.bundles.current.close()
+
+
+def main() -> None:
+    logging.basicConfig(level=LOG_LEVEL, format="%(message)s")
+    res = ChatResources.load(read_only_pool=True)
+    server = ChatServer(res)
+    print(f"Serving on http://{HOST}:{PORT} (POST /chat, GET /ws, GET /health, GET /metrics)")
+    web.run_app(server.app(), host=HOST, port=PORT, print=None)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,238 @@
+# This file keeps chat sessions compact in memory and spills idle ones to disk
+# Live sessions are evicted by TTL (idle time) and LRU (live-session cap) into a small SQLite file
+# as compressed binary blobs, and rehydrated transparently on the session's next request
+from __future__ import annotations
+
+import marshal
+import os
+import sqlite3
+import time
+import zlib
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, Optional
+
+from .chatbot_runner import ChatSession
+from .result_cache import approx_size
+
+SESSIONS_DB_PATH = "data/sessions.db"
+
+# bump when the payload layout below changes; blobs of other versions are dropped
+FORMAT_VERSION = 2
+
+
+# -------------------------
+# Binary form
+# -------------------------
+def dump_session(session: ChatSession) -> bytes:
+    """
+    Session identity (id, turn count, profiling opt-in) + conversation state + bounded history
+    + last text query as a flat tuple of builtins, marshal-encoded and zlib-compressed.
+    Scored candidates are not stored: the rehydrated session rescores on its next search.
+    """
+    st = session.state
+    payload = (
+        FORMAT_VERSION,
+        session.session_id, session.turns, session.profile,
+        st.price_min, st.price_max, st.gender, st.tei, st.use_case, st.waterproof, st.windproof,
+        tuple(st.keywords),
+        tuple(st.asked_questions),
+        tuple(st.attempts.items()),
+        tuple((m["role"], m["content"]) for m in session.history),
+        session.ranking.text_query,
+    )
+    return zlib.compress(marshal.dumps(payload), 6)
+
+
+def load_session(blob: bytes, session: ChatSession) -> ChatSession:
+    payload = marshal.loads(zlib.decompress(blob))
+    if payload[0] != FORMAT_VERSION:
+        raise ValueError(f"Unsupported session format {payload[0]} (expected {FORMAT_VERSION}).")
+
+    (_, session_id, turns, profile, pmin, pmax, gender, tei, use_case, waterproof, windproof,
+     keywords, asked, attempts, history, text_query) = payload
+
+    session.session_id, session.turns, session.profile = session_id, turns, profile
+    st = session.state
+    st.price_min, st.price_max, st.gender, st.tei = pmin, pmax, gender, tei
+    st.use_case, st.waterproof, st.windproof = use_case, waterproof, windproof
+    st.keywords = list(keywords)
+    st.asked_questions = list(asked)
+    st.attempts = dict(attempts)
+
+    session.history.clear()
+    session.history.extend({"role": r, "content": c} for r, c in history)
+    session.ranking.text_query = text_query
+    return session
+
+
+def session_memory(session: ChatSession) -> Dict[str, int]:
+    # bytes owned by one session (shared models/indexes/connection excluded)
+    r = session.ranking
+    ranking = sum(
+        approx_size(x)
+        for x in (r.text_query, r._channels, r._cols, r._filters, r._ranked_ids, r._ranked_scores, r._variants)
+    )
+    state = approx_size(session.state)
+    history = approx_size(session.history)
+    return {"state": state, "history": history, "ranking": ranking, "total": state + history + ranking}
+
+
+# -------------------------
+# Store
+# -------------------------
+class LiveSession:
+    __slots__ = ("session", "last_seen", "in_use")
+
+    def __init__(self, session: ChatSession) -> None:
+        self.session = session
+        self.last_seen = time.time()
+        self.in_use = 0
+
+
+class SessionStore:
+    """
+    session id -> ChatSession with at most max_live sessions in memory.
+    Sessions idle for ttl_s, or least recently used beyond max_live, are written to
+    db_path and dropped from memory; sessions checked out by a running turn are never evicted.
+    """
+    def __init__(
+        self,
+        factory: Callable[[], ChatSession],
+        db_path: str = SESSIONS_DB_PATH,
+        ttl_s: float = 1800.0,
+        max_live: int = 1000,
+        disk_ttl_s: float = 7 * 24 * 3600.0,
+    ) -> None:
+        self.factory = factory
+        self.ttl_s = ttl_s
+        self.max_live = max_live
+        self.disk_ttl_s = disk_ttl_s
+
+        self._live: "OrderedDict[str, LiveSession]" = OrderedDict()
+
+        if os.path.dirname(db_path):
+            os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self._disk = sqlite3.connect(db_path, check_same_thread=False)
+        self._disk.execute("PRAGMA journal_mode=WAL")
+        self._disk.execute("""
+            CREATE TABLE IF NOT EXISTS sessions (
+                session_id TEXT PRIMARY KEY,
+                last_seen REAL NOT NULL,
+                blob BLOB NOT NULL
+            )
+        """)
+        self._disk.commit()
+
+        self.created = 0
+        self.evicted_ttl = 0
+        self.evicted_lru = 0
+        self.rehydrated = 0
+
+    def _rehydrate(self, session_id: str) -> Optional[ChatSession]:
+        row = self._disk.execute("SELECT blob FROM sessions WHERE session_id = ?", (session_id,)).fetchone()
+        if row is None:
+            return None
+        # decode before deleting: only a blob that is loaded, or can never be loaded, is removed
+        try:
+            session: Optional[ChatSession] = load_session(row[0], self.factory())
+        except (ValueError, EOFError, TypeError, zlib.error):
+            session = None
+        self._disk.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+        self._disk.commit()
+        if session is not None:
+            self.rehydrated += 1
+        return session
+
+    def get(self, session_id: str) -> ChatSession:
+        live = self._live.get(session_id)
+        if live is None:
+            session = self._rehydrate(session_id)
+            if session is None:
+                session = self.factory()
+                self.created += 1
+            live = LiveSession(session)
+            self._live[session_id] = live
+            self._enforce_cap()
+        self._live.move_to_end(session_id)
+        live.last_seen = time.time()
+        return live.session
+
+    @contextmanager
+    def checkout(self, session_id: str) -> Iterator[ChatSession]:
+        # pin the session in memory while a turn runs
+        session = self.get(session_id)
+        live = self._live[session_id]
+        live.in_use += 1
+        try:
+            yield session
+        finally:
+            live.in_use -= 1
+            live.last_seen = time.time()
+
+    def idle_sessions(self) -> Iterator[ChatSession]:
+        # live sessions with no turn running
+        for live in list(self._live.values()):
+            if live.in_use == 0:
+                yield live.session
+
+    def drop(self, session_id: str) -> bool:
+        live = self._live.pop(session_id, None)
+        cur = self._disk.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+        self._disk.commit()
+        return live is not None or cur.rowcount > 0
+
+    def _spill(self, session_id: str, live: LiveSession) -> None:
+        blob = dump_session(live.session)
+        self._disk.execute(
+            "INSERT OR REPLACE INTO sessions(session_id, last_seen, blob) VALUES (?, ?, ?)",
+            (session_id, live.last_seen, blob),
+        )
+        del self._live[session_id]
+
+    def _enforce_cap(self) -> None:
+        over = len(self._live) - self.max_live
+        if over <= 0:
+            return
+        for sid in [sid for sid, live in self._live.items() if live.in_use == 0][:over]:
+            self._spill(sid, self._live[sid])
+            self.evicted_lru += 1
+        self._disk.commit()
+
+    def evict_idle(self, now: Optional[float] = None) -> int:
+        """
+        Spill sessions idle for longer than ttl_s and purge on-disk sessions older than disk_ttl_s.
+        """
+        now = time.time() if now is None else now
+        idle = [sid for sid, live in self._live.items() if live.in_use == 0 and now - live.last_seen > self.ttl_s]
+        for sid in idle:
+            self._spill(sid, self._live[sid])
+        self.evicted_ttl += len(idle)
+        self._disk.execute("DELETE FROM sessions WHERE last_seen < ?", (now - self.disk_ttl_s,))
+        self._disk.commit()
+        return len(idle)
+
+    def __len__(self) -> int:
+        return len(self._live)
+
+    def stats(self) -> Dict[str, Any]:
+        per_session = [session_memory(live.session)["total"] for live in self._live.values()]
+        on_disk, disk_bytes = self._disk.execute("SELECT COUNT(*), COALESCE(SUM(length(blob)), 0) FROM sessions").fetchone()
+        return {
+            "live": len(self._live),
+            "on_disk": on_disk,
+            "created": self.created,
+            "evicted_ttl": self.evicted_ttl,
+            "evicted_lru": self.evicted_lru,
+            "rehydrated": self.rehydrated,
+            "bytes_per_live_session": round(sum(per_session) / len(per_session)) if per_session else 0,
+            "max_live_session_bytes": max(per_session) if per_session else 0,
+            "bytes_per_disk_session": round(disk_bytes / on_disk) if on_disk else 0,
+        }
+
+    def close(self) -> None:
+        # keep every live session across restarts
+        for sid in list(self._live):
+            self._spill(sid, self._live[sid])
+        self._disk.commit()
+        self._disk.close()
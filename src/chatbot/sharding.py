@@ -0,0 +1,563 @@
+# This file partitions the product index into shards (by id range or by brand) and searches them scatter-gather
+# Each shard is a self-contained catalog (SQLite DB + FTS index, description vectors, keyword matrix) served by
+# its own process, standing in for a remote node. ShardedSearch fans every query phase out to all shards in parallel
+# and merges the per-shard results into the ranking retrieve_and_rank_hybrid gives on the unsharded catalog:
+# BM25 is computed with catalog-wide term statistics, and every top-k cut breaks ties by product id on both paths.
+# Dense scores can differ by float rounding (see DENSE_SCORE_TOLERANCE), so rankings are compared with rankings_match
+# Build shards and compare with the unsharded ranking from the repo root: PYTHONPATH=src python -m chatbot.sharding
+from __future__ import annotations
+
+import json
+import math
+import multiprocessing as mp
+import os
+import re
+import shutil
+import sqlite3
+import threading
+import time
+from multiprocessing.connection import Connection
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from .chatbot_runner import (
+    DB_PATH,
+    FTS_WEIGHTS,
+    ScoredProduct,
+    SparseScores,
+    _candidate_ids,
+    _dense_pool,
+    _desc_channel,
+    _empty_scores,
+    _filter_ids,
+    _fuse_topk,
+    _keyword_channel,
+    _matched_debug,
+    _materialize,
+    catalog_version,
+    fts_query_tokens,
+    rankings_match,
+    retrieve_and_rank_hybrid,
+)
+from .db_pool import read_only_uri
+from .embedder import DOMAIN_KEYWORDS, KeywordEmbedder, KeywordMatch, ProductDescriptionEmbedder
+from .keyword_matrix import ProductKeywordMatrix
+
+SHARDS_DIR = "data/shards"
+SHARD_DB = "catalog.db"
+MANIFEST = "manifest.json"
+FTS_STATS_TABLE = "fts_doc_stats"  # shard-only: tokens per products_fts row, written with the FTS rebuild
+
+N_SHARDS = 4
+SHARD_BY = "id"  # "id": contiguous id ranges of equal size, "brand": whole brands per shard
+
+# FTS5 bm25() constants (fts5_aux.c)
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+
+# -------------------------
+# Build
+# -------------------------
+def partition_ids(conn: sqlite3.Connection, n_shards: int, by: str = SHARD_BY) -> List[List[int]]:
+    """
+    Disjoint product id lists, one per shard (ascending ids within a shard).
+    by="brand" keeps every brand on one shard (largest brands first onto the emptiest shard).
+    """
+    if by == "id":
+        ids = [int(r[0]) for r in conn.execute("SELECT id FROM products ORDER BY id").fetchall()]
+        bounds = np.linspace(0, len(ids), n_shards + 1).astype(int)
+        return [ids[bounds[i]:bounds[i + 1]] for i in range(n_shards)]
+
+    if by == "brand":
+        by_brand: Dict[str, List[int]] = {}
+        for pid, brand in conn.execute("SELECT id, coalesce(brand, '') FROM products ORDER BY id").fetchall():
+            by_brand.setdefault(brand, []).append(int(pid))
+        shards: List[List[int]] = [[] for _ in range(n_shards)]
+        for brand in sorted(by_brand, key=lambda b: (-len(by_brand[b]), b)):
+            min(shards, key=len).extend(by_brand[brand])
+        return [sorted(s) for s in shards]
+
+    raise ValueError(f"Unknown shard key: {by!r} (expected 'id' or 'brand').")
+
+
+def build_shards(
+    embedder: KeywordEmbedder,
+    desc_index: ProductDescriptionEmbedder,
+    db_path: str = DB_PATH,
+    n_shards: int = N_SHARDS,
+    by: str = SHARD_BY,
+    shards_dir: str = SHARDS_DIR,
+) -> List[str]:
+    """
+    Split db_path into shards_dir/shard-NNN directories: a catalog DB holding only the shard's
+    products (FTS index rebuilt), the matching slice of desc_index's vectors (no re-encoding) and a manifest.
+    The keyword matrix is derived from the shard DB when the shard is loaded.
+    """
+    src = sqlite3.connect(db_path)
+    src.row_factory = sqlite3.Row
+    desc_index.ensure_loaded(src)
+    assert desc_index.product_embs is not None
+
+    parts = partition_ids(src, n_shards, by)
+    # shards must pick the same top-n keyword path as the full matrix (see ProductKeywordMatrix.scores)
+    kw_max_row_nnz = ProductKeywordMatrix.from_db(src, embedder.tokens).max_row_nnz
+    row_of = {pid: i for i, pid in enumerate(desc_index.product_ids)}
+
+    tmp_dir = f"{shards_dir}.building-{os.getpid()}"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+    try:
+        for i, ids in enumerate(parts):
+            shard_dir = os.path.join(tmp_dir, f"shard-{i:03d}")
+            os.makedirs(shard_dir)
+            shard_db = sqlite3.connect(os.path.join(shard_dir, SHARD_DB))
+            src.backup(shard_db)
+
+            shard_db.execute("CREATE TEMP TABLE keep_ids (id INTEGER PRIMARY KEY)")
+            shard_db.executemany("INSERT INTO keep_ids(id) VALUES (?)", [(pid,) for pid in ids])
+            shard_db.execute("DELETE FROM products WHERE id NOT IN (SELECT id FROM keep_ids)")
+            shard_db.execute("DELETE FROM product_keywords WHERE product_id NOT IN (SELECT id FROM keep_ids)")
+            shard_db.execute("INSERT INTO products_fts(products_fts) VALUES ('rebuild')")
+            write_fts_stats(shard_db)
+            # one version bump per write transaction, as in database/migrate_db.py
+            shard_db.execute("UPDATE catalog_meta SET value = value + 1 WHERE key = 'version'")
+            shard_db.commit()
+            shard_db.execute("VACUUM")
+            version = catalog_version(shard_db)
+            shard_db.close()
+
+            rows = [row_of[pid] for pid in ids if pid in row_of]
+            shard_index = desc_index.with_data_dir(shard_dir)
+            shard_index.load_arrays(
+                [desc_index.product_ids[r] for r in rows],
+                [desc_index.product_texts[r] for r in rows],
+                desc_index.product_embs[rows],
+            )
+            shard_index.save_cache()
+
+            manifest = {
+                "shard": i,
+                "n_shards": n_shards,
+                "by": by,
+                "products": len(ids),
+                "id_min": ids[0] if ids else None,
+                "id_max": ids[-1] if ids else None,
+                "catalog_version": version,
+                "source_db": os.path.abspath(db_path),
+                "model_name": desc_index.model_name,
+                "kw_tokens": embedder.tokens,
+                "kw_max_row_nnz": kw_max_row_nnz,
+            }
+            with open(os.path.join(shard_dir, MANIFEST), "w", encoding="utf-8") as f:
+                json.dump(manifest, f, indent=2)
+    except BaseException:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        raise
+    finally:
+        src.close()
+
+    shutil.rmtree(shards_dir, ignore_errors=True)
+    os.replace(tmp_dir, shards_dir)
+    return shard_dirs(shards_dir)
+
+
+def shard_dirs(shards_dir: str = SHARDS_DIR) -> List[str]:
+    if not os.path.isdir(shards_dir):
+        return []
+    return [os.path.join(shards_dir, d) for d in sorted(os.listdir(shards_dir)) if d.startswith("shard-")]
+
+
+# -------------------------
+# FTS5 statistics
+# -------------------------
+def fts_doc_lengths(conn: sqlite3.Connection) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    (rowids, token counts over all columns) of products_fts, from its fts5vocab instance table:
+    the per-row lengths bm25() uses (rows without any token are left out; they never match).
+    """
+    conn.execute("CREATE VIRTUAL TABLE IF NOT EXISTS temp.fts_instances USING fts5vocab(main, products_fts, instance)")
+    rows = conn.execute("SELECT doc, COUNT(*) FROM temp.fts_instances GROUP BY doc ORDER BY doc").fetchall()
+    return np.array([int(r[0]) for r in rows], dtype=np.int64), np.array([float(r[1]) for r in rows], dtype=np.float64)
+
+
+def write_fts_stats(conn: sqlite3.Connection) -> None:
+    # run in the transaction that (re)builds products_fts, so the lengths always match the index
+    ids, lengths = fts_doc_lengths(conn)
+    conn.execute(f"DROP TABLE IF EXISTS {FTS_STATS_TABLE}")
+    conn.execute(f"CREATE TABLE {FTS_STATS_TABLE} (id INTEGER PRIMARY KEY, tokens INTEGER NOT NULL)")
+    conn.executemany(f"INSERT INTO {FTS_STATS_TABLE}(id, tokens) VALUES (?, ?)", zip(ids.tolist(), lengths.astype(int).tolist()))
+
+
+class FtsStats:
+    """
+    What FTS5's bm25() uses (row count, token totals, per-row token counts, per-term hits), so a shard
+    can score BM25 with catalog-wide statistics. Per-row lengths come from the shard's FTS_STATS_TABLE
+    (or fts5vocab for shards built without one); terms and hits from fts5vocab.
+    """
+    def __init__(self, conn: sqlite3.Connection) -> None:
+        self.conn = conn
+        sql = conn.execute("SELECT sql FROM sqlite_master WHERE name = 'products_fts'").fetchone()[0]
+        m = re.search(r"tokenize\s*=\s*'([^']*)'", sql)
+        tokenizer = m.group(1) if m else "unicode61"
+
+        # a scratch FTS table with the same tokenizer maps query tokens to indexed terms (porter stems)
+        conn.execute(f"CREATE VIRTUAL TABLE temp.fts_stem USING fts5(x, tokenize='{tokenizer}')")
+        conn.execute("CREATE VIRTUAL TABLE temp.fts_stem_terms USING fts5vocab(temp, fts_stem, instance)")
+        conn.execute("CREATE VIRTUAL TABLE temp.fts_rows USING fts5vocab(main, products_fts, row)")
+        conn.execute("CREATE VIRTUAL TABLE IF NOT EXISTS temp.fts_instances USING fts5vocab(main, products_fts, instance)")
+
+        self.n_rows = int(conn.execute("SELECT COUNT(*) FROM products_fts").fetchone()[0])
+        has_table = conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (FTS_STATS_TABLE,)).fetchone()
+        if has_table:
+            docs = conn.execute(f"SELECT id, tokens FROM {FTS_STATS_TABLE} ORDER BY id").fetchall()
+            self.doc_ids = np.array([int(r[0]) for r in docs], dtype=np.int64)
+            self.doc_len = np.array([float(r[1]) for r in docs], dtype=np.float64)
+        else:
+            self.doc_ids, self.doc_len = fts_doc_lengths(conn)
+        self.n_tokens = int(self.doc_len.sum())
+
+    def terms(self, tokens: Sequence[str]) -> List[str]:
+        self.conn.execute("DELETE FROM temp.fts_stem")
+        self.conn.executemany("INSERT INTO temp.fts_stem(rowid, x) VALUES (?, ?)", [(i + 1, t) for i, t in enumerate(tokens)])
+        term_of = {int(doc): term for doc, term in self.conn.execute("SELECT doc, term FROM temp.fts_stem_terms")}
+        return [term_of[i + 1] for i in range(len(tokens))]
+
+    def hits(self, terms: Sequence[str]) -> List[int]:
+        # rows containing each term
+        out = []
+        for term in terms:
+            row = self.conn.execute("SELECT doc FROM temp.fts_rows WHERE term = ?", (term,)).fetchone()
+            out.append(int(row[0]) if row else 0)
+        return out
+
+    def bm25(self, terms: Sequence[str], idf: Sequence[float], avgdl: float, limit: int) -> SparseScores:
+        """
+        -bm25(products_fts, *FTS_WEIGHTS) of the rows matching any term, top `limit` by
+        (score desc, id asc) like lexical_scores(); the arithmetic follows fts5_aux.c operation by operation.
+        """
+        per_term: List[Tuple[np.ndarray, np.ndarray]] = []
+        for term in terms:
+            inst = self.conn.execute("SELECT doc, col FROM temp.fts_instances WHERE term = ?", (term,)).fetchall()
+            per_term.append((
+                np.array([int(r[0]) for r in inst], dtype=np.int64),
+                np.array([FTS_WEIGHTS[r[1]] for r in inst], dtype=np.float64),
+            ))
+        docs = np.unique(np.concatenate([d for d, _ in per_term])) if per_term else np.zeros(0, dtype=np.int64)
+        if len(docs) == 0:
+            return _empty_scores()
+
+        D = self.doc_len[np.searchsorted(self.doc_ids, docs)]
+        score = np.zeros(len(docs), dtype=np.float64)
+        for (d, w), term_idf in zip(per_term, idf):
+            freq = np.bincount(np.searchsorted(docs, d), weights=w, minlength=len(docs))
+            score += term_idf * ((freq * (BM25_K1 + 1.0)) / (freq + BM25_K1 * (1 - BM25_B + BM25_B * D / avgdl)))
+
+        order = np.lexsort((docs, -score))[:limit]
+        return docs[order], score[order]
+
+
+def bm25_idf(n_rows: int, n_hits: Sequence[int]) -> List[float]:
+    out = []
+    for n_hit in n_hits:
+        idf = math.log((n_rows - n_hit + 0.5) / (n_hit + 0.5))
+        out.append(idf if idf > 0.0 else 1e-6)
+    return out
+
+
+# -------------------------
+# Shard (worker side)
+# -------------------------
+class ShardIndex:
+    """
+    One shard's catalog. Every public method answers one phase of a ShardedSearch query
+    and only returns arrays and small objects, so the calls can cross a process (or network) boundary.
+    """
+    def __init__(self, shard_dir: str) -> None:
+        with open(os.path.join(shard_dir, MANIFEST), "r", encoding="utf-8") as f:
+            self.manifest: Dict[str, Any] = json.load(f)
+
+        self.conn = sqlite3.connect(read_only_uri(os.path.join(shard_dir, SHARD_DB)), uri=True)
+        self.conn.row_factory = sqlite3.Row
+
+        self.desc_index = ProductDescriptionEmbedder(model_name=self.manifest["model_name"], data_dir=shard_dir)
+        self.desc_index.load_cache()
+        self.kw_matrix = ProductKeywordMatrix.from_db(self.conn, self.manifest["kw_tokens"])
+        self.kw_matrix.max_row_nnz = self.manifest["kw_max_row_nnz"]
+        self.fts = FtsStats(self.conn)
+
+    def info(self) -> Dict[str, Any]:
+        return {
+            "shard": self.manifest["shard"],
+            "products": self.manifest["products"],
+            "indexed": len(self.desc_index.product_ids),
+            "fts_rows": self.fts.n_rows,
+            "fts_tokens": self.fts.n_tokens,
+        }
+
+    def term_stats(self, tokens: List[str]) -> Tuple[List[str], List[int]]:
+        terms = self.fts.terms(tokens)
+        return terms, self.fts.hits(terms)
+
+    def channels(
+        self,
+        matches: List[KeywordMatch],
+        top_per_product: int,
+        terms: List[str],
+        idf: List[float],
+        avgdl: float,
+        lex_limit: int,
+        q_emb: np.ndarray,
+        desc_top_k: Optional[int],
+    ) -> Tuple[Dict[str, float], SparseScores, Optional[SparseScores], SparseScores]:
+        # desc_top_k=None: the coordinator rescores a candidate pool instead (desc_scores)
+        kw_scores, kw = _keyword_channel(self.kw_matrix, matches, top_per_product)
+        lex = self.fts.bm25(terms, idf, avgdl, lex_limit) if terms else _empty_scores()
+        desc = None
+        if desc_top_k is not None and len(self.desc_index.product_ids):
+            desc = self.desc_index.score_vector(q_emb, top_k=desc_top_k)
+        return kw_scores, kw, desc, lex
+
+    def desc_scores(self, product_ids: List[int], q_emb: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        # unranked scores of the pool ids this shard holds
+        ids, row_of = self.desc_index._id_index()
+        rows = np.array([row_of[pid] for pid in product_ids if pid in row_of], dtype=np.int64)
+        if len(rows) == 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+        assert self.desc_index.product_embs is not None
+        return ids[rows], self.desc_index.product_embs[rows] @ q_emb
+
+    def filter(
+        self,
+        candidate_ids: np.ndarray,
+        price_min: Optional[float],
+        price_max: Optional[float],
+        gender: Optional[str],
+    ) -> np.ndarray:
+        return _filter_ids(self.conn, candidate_ids, price_min, price_max, gender)
+
+    def materialize(self, ids: np.ndarray, scores: np.ndarray) -> List[ScoredProduct]:
+        return _materialize(self.conn, ids, scores)
+
+
+def _serve(shard_dir: str, pipe: Connection) -> None:
+    # worker process: one request at a time, (ok, result) replies
+    shard = ShardIndex(shard_dir)
+    pipe.send((True, shard.info()))
+    while True:
+        request = pipe.recv()
+        if request is None:
+            break
+        method, args = request
+        try:
+            pipe.send((True, getattr(shard, method)(*args)))
+        except Exception as e:
+            pipe.send((False, f"{type(e).__name__}: {e}"))
+    shard.conn.close()
+
+
+class ShardProcess:
+    """
+    A shard served by a local process (stand-in for a remote node). send() and recv() are split
+    so the coordinator can have a request in flight on every shard at once.
+    """
+    def __init__(self, shard_dir: str, ctx: Any) -> None:
+        self.shard_dir = shard_dir
+        self._pipe, child = ctx.Pipe()
+        self._proc = ctx.Process(target=_serve, args=(shard_dir, child), daemon=True)
+        self._proc.start()
+        child.close()
+        self.info: Dict[str, Any] = self.recv()
+
+    def send(self, method: str, *args: Any) -> None:
+        self._pipe.send((method, args))
+
+    def recv(self) -> Any:
+        ok, result = self._pipe.recv()
+        if not ok:
+            raise RuntimeError(f"Shard {self.shard_dir} failed: {result}")
+        return result
+
+    def close(self) -> None:
+        try:
+            self._pipe.send(None)
+        except (BrokenPipeError, OSError):
+            pass
+        self._proc.join(timeout=5)
+        self._pipe.close()
+
+
+# -------------------------
+# Coordinator
+# -------------------------
+class ShardedSearch:
+    """
+    Scatter-gather retrieve_and_rank_hybrid over shard processes.
+    The coordinator holds only the query encoders (embedder, desc_encoder's model); everything
+    indexed lives in the shards. Variant clusters, rerank and result caching are not sharded.
+    """
+    def __init__(
+        self,
+        dirs: Sequence[str],
+        embedder: KeywordEmbedder,
+        desc_encoder: ProductDescriptionEmbedder,
+    ) -> None:
+        if not dirs:
+            raise ValueError("No shards given; build them with build_shards().")
+        self.embedder = embedder
+        self.desc_encoder = desc_encoder
+
+        ctx = mp.get_context("spawn")
+        self.shards = [ShardProcess(d, ctx) for d in dirs]
+        self.n_rows = sum(s.info["fts_rows"] for s in self.shards)
+        self.n_tokens = sum(s.info["fts_tokens"] for s in self.shards)
+        self.n_indexed = sum(s.info["indexed"] for s in self.shards)
+        self._lock = threading.Lock()
+
+    def _scatter(self, method: str, *args: Any) -> List[Any]:
+        # the same request to every shard, all in flight at once; replies in shard order
+        with self._lock:
+            for shard in self.shards:
+                shard.send(method, *args)
+            return [shard.recv() for shard in self.shards]
+
+    def search(
+        self,
+        user_query: str,
+        price_min: Optional[float] = None,
+        price_max: Optional[float] = None,
+        gender: Optional[str] = None,
+        top_keywords: int = 12,
+        kw_threshold: float = 0.42,
+        top_per_product: int = 4,
+        candidate_limit: int = 300,
+        return_k: int = 5,
+        alpha: float = 0.35,
+        beta: float = 0.65,
+        gamma: float = 0.15,
+        dense_full_scan_max: int = 20000,
+        query_vec: Optional[np.ndarray] = None,
+    ) -> Tuple[List[ScoredProduct], List[Tuple[str, float]]]:
+        """
+        Same arguments and results as retrieve_and_rank_hybrid (without reranker/clusters/cache).
+        """
+        q = (user_query or "").strip().lower()
+        if not q:
+            return [], []
+
+        if query_vec is not None:
+            matches = self.embedder.match_vector(query_vec, top_k=top_keywords, threshold=kw_threshold)
+        else:
+            matches = self.embedder.match(q, top_k=top_keywords, threshold=kw_threshold)
+        q_emb = query_vec if query_vec is not None else self.desc_encoder.encode_texts([q])[0]
+
+        # phase 1: catalog-wide term statistics for BM25
+        terms: List[str] = []
+        idf: List[float] = []
+        tokens = fts_query_tokens(q)
+        if tokens:
+            stats = self._scatter("term_stats", tokens)
+            terms = stats[0][0]
+            idf = bm25_idf(self.n_rows, [sum(s[1][i] for s in stats) for i in range(len(terms))])
+        avgdl = float(self.n_tokens) / float(self.n_rows) if self.n_rows else 1.0
+
+        # phase 2: per-shard channels
+        full_scan = self.n_indexed <= dense_full_scan_max
+        parts = self._scatter(
+            "channels", matches, top_per_product, terms, idf, avgdl, candidate_limit, q_emb,
+            candidate_limit if full_scan else None,
+        )
+        kw_scores = parts[0][0]
+        kw = _merge_by_id([p[1] for p in parts])
+        lex_ids, lex_vals = _concat([p[3] for p in parts])
+        order = np.lexsort((lex_ids, -lex_vals))[:candidate_limit]
+        keep = order[lex_vals[order] > 0]
+        lex = (lex_ids[keep], lex_vals[keep])
+
+        if full_scan:
+            # the global top k is inside the union of the shard top ks; cut it exactly like one index would
+            ids, scores = _merge_by_id([p[2] for p in parts if p[2] is not None])
+            idx = ProductDescriptionEmbedder._top_k(scores, candidate_limit) if len(ids) else np.zeros(0, dtype=np.int64)
+            desc = _desc_channel(ids[idx], scores[idx])
+        else:
+            pool = _dense_pool(kw, lex, candidate_limit)
+            got: Dict[int, float] = {}
+            for ids, scores in self._scatter("desc_scores", pool, q_emb):
+                got.update(zip(ids.tolist(), scores.tolist()))
+            ids = np.array([pid for pid in pool if pid in got], dtype=np.int64)
+            scores = np.array([got[pid] for pid in ids.tolist()], dtype=np.float32)
+            idx = ProductDescriptionEmbedder._top_k(scores, candidate_limit) if len(ids) else np.zeros(0, dtype=np.int64)
+            desc = _desc_channel(ids[idx], scores[idx])
+
+        channels = (kw_scores, kw, desc, lex)
+        matched_debug = _matched_debug(kw_scores)
+        candidate_ids = _candidate_ids(channels)
+        if len(candidate_ids) == 0:
+            return [], matched_debug
+
+        # phase 3: hard filters where the product rows live
+        filtered_ids = np.sort(np.concatenate(self._scatter("filter", candidate_ids, price_min, price_max, gender)))
+        top_ids, top_scores = _fuse_topk(filtered_ids, channels, alpha, beta, gamma, return_k)
+
+        # phase 4: product rows of the winners
+        by_id = {p.id: p for part in self._scatter("materialize", top_ids, top_scores) for p in part}
+        return [by_id[pid] for pid in top_ids.tolist() if pid in by_id], matched_debug
+
+    def close(self) -> None:
+        for shard in self.shards:
+            shard.close()
+
+
+def _concat(parts: List[SparseScores]) -> SparseScores:
+    if not parts:
+        return _empty_scores()
+    return np.concatenate([p[0] for p in parts]), np.concatenate([p[1] for p in parts])
+
+
+def _merge_by_id(parts: List[SparseScores]) -> SparseScores:
+    # shards hold disjoint ids: concatenated and id-sorted equals the unsharded (id-ordered) channel
+    ids, vals = _concat(parts)
+    order = np.argsort(ids, kind="stable")
+    return ids[order], vals[order]
+
+
+def main() -> None:
+    conn = sqlite3.connect(DB_PATH)
+    conn.row_factory = sqlite3.Row
+    embedder = KeywordEmbedder(cache_dir="data/embeddings", keywords=DOMAIN_KEYWORDS)
+    desc_index = ProductDescriptionEmbedder(data_dir="data")
+    desc_index.ensure_loaded(conn)
+
+    t0 = time.perf_counter()
+    dirs = build_shards(embedder, desc_index)
+    print(f"Built {len(dirs)} shards by {SHARD_BY} in {time.perf_counter() - t0:.1f}s")
+
+    prompts_path = os.path.join(os.path.dirname(__file__), "..", "test", "prompts.txt")
+    with open(prompts_path, "r", encoding="utf-8") as f:
+        prompts = [line.strip() for line in f if line.strip() and not line.startswith("#")]
+
+    sharded = ShardedSearch(dirs, embedder, desc_index)
+    try:
+        same = exact = 0
+        t_flat = t_sharded = 0.0
+        for p in prompts:
+            t0 = time.perf_counter()
+            flat, _ = retrieve_and_rank_hybrid(conn, embedder, desc_index, p)
+            t1 = time.perf_counter()
+            split, _ = sharded.search(p)
+            t2 = time.perf_counter()
+            t_flat += t1 - t0
+            t_sharded += t2 - t1
+            a, b = [(x.id, x.score) for x in flat], [(x.id, x.score) for x in split]
+            exact += a == b
+            same += rankings_match(a, b)
+        print(f"Matching rankings: {same}/{len(prompts)} (bit-identical scores: {exact})")
+        print(f"Mean latency: unsharded {t_flat / len(prompts) * 1000:.1f} ms, sharded {t_sharded / len(prompts) * 1000:.1f} ms")
+    finally:
+        sharded.close()
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,317 @@
+# This file shares the read-only embedding matrices and catalog arrays of one ChatResources between worker processes
+# A parent process writes them once into a single flat file (under /dev/shm when available) and every worker
+# maps that file read-only: the arrays are numpy views into the shared page cache, so adding workers adds no copies
+# Demo / memory check from the repo root: PYTHONPATH=src python -m chatbot.shared_arrays
+from __future__ import annotations
+
+import json
+import mmap
+import multiprocessing as mp
+import os
+import sqlite3
+import struct
+import tempfile
+from typing import Any, Dict, Iterator, Optional, Sequence, Tuple
+
+import numpy as np
+
+from .chatbot_runner import (
+    COMPOSED_QUERY_EMBEDDINGS,
+    CROSS_ENCODER_RERANK,
+    DB_PATH,
+    RERANK_BUDGET_MS,
+    RERANK_MODEL,
+    RERANK_TOP_N,
+    RESULT_CACHE_ENTRIES,
+    ChatResources,
+)
+from .db_pool import ReadOnlyConnectionPool
+from .embedder import DOMAIN_KEYWORDS, KeywordEmbedder, ProductDescriptionEmbedder
+from .facet_index import FacetIndex
+from .keyword_matrix import ProductKeywordMatrix
+from .query_composer import ComposedQueryEncoder
+from .reranker import CrossEncoderReranker
+from .result_cache import RankedResultCache
+from .variant_clusters import VariantClusters
+
+# tmpfs keeps the file in RAM only; elsewhere the OS page cache still shares one copy between processes
+SHARED_DIR = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+
+MAGIC = b"CBARR001"
+ALIGN = 64  # array offsets are cache-line aligned
+
+N_WORKERS = 4
+
+
+# -------------------------
+# File format
+# -------------------------
+# MAGIC | u64 header length | JSON header {"arrays": {name: [dtype, shape, offset]}, "meta": {...}} | aligned array data
+def _aligned(n: int) -> int:
+    return (n + ALIGN - 1) // ALIGN * ALIGN
+
+
+def write_arrays(path: str, arrays: Dict[str, np.ndarray], meta: Optional[Dict[str, Any]] = None) -> int:
+    """
+    Write arrays (+ JSON-serializable meta) to path atomically; returns the file size.
+    Arrays are stored C-contiguous in their own dtype, so readers never convert or copy.
+    """
+    layout: Dict[str, Tuple[str, Tuple[int, ...], int]] = {}
+    offset = 0
+    for name, a in arrays.items():
+        layout[name] = (a.dtype.str, tuple(int(d) for d in a.shape), offset)
+        offset = _aligned(offset + a.nbytes)
+
+    header = json.dumps({"arrays": layout, "meta": meta or {}}).encode("utf-8")
+    data_start = _aligned(len(MAGIC) + 8 + len(header))
+
+    tmp_path = f"{path}.tmp-{os.getpid()}"
+    try:
+        with open(tmp_path, "wb") as f:
+            f.write(MAGIC)
+            f.write(struct.pack("<Q", len(header)))
+            f.write(header)
+            for name, a in arrays.items():
+                f.seek(data_start + layout[name][2])
+                f.write(np.ascontiguousarray(a).tobytes(order="C"))
+            size = data_start + offset
+            f.truncate(size)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return size
+
+
+class SharedArrays:
+    """
+    Read-only, zero-copy view of a file written by write_arrays().
+    arrays[name] are numpy arrays backed by the mapping (writes raise ValueError).
+    """
+    def __init__(self, path: str) -> None:
+        self.path = path
+        with open(path, "rb") as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        if self._mm[:len(MAGIC)] != MAGIC:
+            raise ValueError(f"Not a shared array file: {path}")
+        (header_len,) = struct.unpack_from("<Q", self._mm, len(MAGIC))
+        header_start = len(MAGIC) + 8
+        header = json.loads(bytes(self._mm[header_start:header_start + header_len]).decode("utf-8"))
+        data_start = _aligned(header_start + header_len)
+
+        self.meta: Dict[str, Any] = header["meta"]
+        self.arrays: Dict[str, np.ndarray] = {}
+        for name, (dtype, shape, offset) in header["arrays"].items():
+            dt = np.dtype(dtype)
+            count = int(np.prod(shape)) if shape else 1
+            a = np.frombuffer(self._mm, dtype=dt, count=count, offset=data_start + offset)
+            self.arrays[name] = a.reshape(shape)
+
+    def __getitem__(self, name: str) -> np.ndarray:
+        return self.arrays[name]
+
+    @property
+    def nbytes(self) -> int:
+        return sum(a.nbytes for a in self.arrays.values())
+
+    def close(self) -> None:
+        # the mapping can only be closed once no array view is referenced any more
+        self.arrays = {}
+        try:
+            self._mm.close()
+        except BufferError:
+            pass
+
+
+# -------------------------
+# Strings
+# -------------------------
+def pack_strings(strings: Sequence[str]) -> Tuple[np.ndarray, np.ndarray]:
+    # (n + 1) byte offsets + one utf-8 blob; string i is blob[offsets[i]:offsets[i + 1]]
+    encoded = [s.encode("utf-8") for s in strings]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(b) for b in encoded], out=offsets[1:])
+    return offsets, np.frombuffer(b"".join(encoded), dtype=np.uint8)
+
+
+class SharedStrings(Sequence[str]):
+    """
+    Read-only list of strings over pack_strings() arrays: only the string that is
+    accessed is decoded, so the texts stay in the shared mapping instead of every worker's heap.
+    """
+    def __init__(self, offsets: np.ndarray, blob: np.ndarray) -> None:
+        self._offsets = offsets
+        self._blob = blob
+
+    def __len__(self) -> int:
+        return len(self._offsets) - 1
+
+    def __getitem__(self, i):  # type: ignore[override]
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        n = len(self)
+        if i < 0:
+            i += n
+        if not 0 <= i < n:
+            raise IndexError("SharedStrings index out of range")
+        return self._blob[self._offsets[i]:self._offsets[i + 1]].tobytes().decode("utf-8")
+
+    def __iter__(self) -> Iterator[str]:
+        return (self[i] for i in range(len(self)))
+
+
+def _put_strings(arrays: Dict[str, np.ndarray], name: str, strings: Sequence[str]) -> None:
+    arrays[f"{name}_offsets"], arrays[f"{name}_blob"] = pack_strings(strings)
+
+
+def _get_strings(shared: "SharedArrays", name: str) -> SharedStrings:
+    return SharedStrings(shared[f"{name}_offsets"], shared[f"{name}_blob"])
+
+
+# -------------------------
+# ChatResources <-> shared arrays
+# -------------------------
+def publish_resources(res: ChatResources, path: Optional[str] = None) -> str:
+    """
+    Parent side: write the keyword vectors, description ids/texts/vectors, keyword matrix,
+    facet bitmaps and variant clusters of res to one shared file and return its path (pass it to the workers).
+    """
+    res.embedder.ensure_loaded()
+    res.desc_index.ensure_loaded(res.conn)
+    path = path or os.path.join(SHARED_DIR, f"chatbot-arrays-{os.getpid()}.bin")
+
+    m = res.kw_matrix
+    arrays: Dict[str, np.ndarray] = {
+        "kw_emb": res.embedder._kw_emb,
+        "desc_ids": np.asarray(res.desc_index.product_ids, dtype=np.int64),
+        "desc_embs": res.desc_index.product_embs,
+        "kwm_product_ids": m.product_ids,
+        "kwm_indptr": m.indptr,
+        "kwm_indices": m.indices,
+        "kwm_data": m.data,
+    }
+    _put_strings(arrays, "kw_texts", res.embedder._kw_texts)
+    _put_strings(arrays, "desc_texts", res.desc_index.product_texts)
+
+    facet_arrays, facet_meta = res.facets.to_arrays()
+    arrays.update({f"facets_{k}": v for k, v in facet_arrays.items()})
+
+    meta: Dict[str, Any] = {
+        "kw_model": res.embedder.model_name,
+        "kw_tokens": res.embedder.tokens,
+        "desc_model": res.desc_index.model_name,
+        "kwm_tokens": m.tokens,
+        "facets": facet_meta,
+        "clusters": None,
+    }
+    if res.clusters is not None:
+        arrays.update({f"clusters_{k}": v for k, v in res.clusters.to_arrays().items()})
+        meta["clusters"] = {"sim_threshold": res.clusters.sim_threshold}
+
+    write_arrays(path, arrays, meta)
+    return path
+
+
+def attach_resources(path: str, db_path: str = DB_PATH, read_only_pool: bool = False) -> Tuple[ChatResources, SharedArrays]:
+    """
+    Worker side: ChatResources whose matrices, ids and texts are read-only views into the shared file.
+    Only the DB connection, the query-time models and the facet bitmaps (copied out as Python ints,
+    not rebuilt from the DB) are per process.
+    Keep the returned SharedArrays alive as long as the resources are used.
+    """
+    shared = SharedArrays(path)
+    meta = shared.meta
+
+    conn = sqlite3.connect(db_path, check_same_thread=not read_only_pool)
+    conn.row_factory = sqlite3.Row
+
+    emb = KeywordEmbedder(model_name=meta["kw_model"], cache_dir="data/embeddings", keywords=DOMAIN_KEYWORDS)
+    emb.load_arrays(meta["kw_tokens"], _get_strings(shared, "kw_texts"), shared["kw_emb"])
+
+    desc_index = ProductDescriptionEmbedder(model_name=meta["desc_model"])
+    desc_index.load_arrays(shared["desc_ids"], _get_strings(shared, "desc_texts"), shared["desc_embs"])
+
+    kw_matrix = ProductKeywordMatrix(
+        shared["kwm_product_ids"], meta["kwm_tokens"],
+        shared["kwm_indptr"], shared["kwm_indices"], shared["kwm_data"],
+    )
+    facets = FacetIndex.from_arrays(
+        {k[len("facets_"):]: v for k, v in shared.arrays.items() if k.startswith("facets_")},
+        meta["facets"],
+    )
+
+    clusters = None
+    if meta["clusters"] is not None:
+        clusters = VariantClusters.from_arrays(
+            {k[len("clusters_"):]: v for k, v in shared.arrays.items() if k.startswith("clusters_")},
+            source_version=desc_index.version,
+            sim_threshold=meta["clusters"]["sim_threshold"],
+        )
+
+    reranker = None
+    if CROSS_ENCODER_RERANK:
+        reranker = CrossEncoderReranker(RERANK_MODEL, top_n=RERANK_TOP_N, budget_ms=RERANK_BUDGET_MS)
+        reranker.warm_up()
+    composer = ComposedQueryEncoder(emb.encode_queries) if COMPOSED_QUERY_EMBEDDINGS else None
+    pool = ReadOnlyConnectionPool(db_path) if read_only_pool else None
+    result_cache = RankedResultCache(max_entries=RESULT_CACHE_ENTRIES) if RESULT_CACHE_ENTRIES > 0 else None
+
+    res = ChatResources(conn, emb, desc_index, kw_matrix, facets, reranker, clusters, composer, pool, result_cache)
+    return res, shared
+
+
+# -------------------------
+# Memory check
+# -------------------------
+def process_memory_kib() -> Dict[str, int]:
+    # Linux: private (anon) vs file/shmem-backed resident memory of this process
+    out = {}
+    try:
+        with open("/proc/self/status", "r", encoding="utf-8") as f:
+            for line in f:
+                key, _, value = line.partition(":")
+                if key in ("VmRSS", "RssAnon", "RssFile", "RssShmem"):
+                    out[key] = int(value.split()[0])
+    except OSError:
+        pass
+    return out
+
+
+def _worker(mode: str, path: str, out: "mp.Queue") -> None:
+    if mode == "attach":
+        res, _shared = attach_resources(path)
+    else:
+        res = ChatResources.load()
+    # touch every matrix once, as a first search would
+    q = np.asarray(res.desc_index.product_embs[0], dtype=np.float32)
+    res.desc_index.score_vector(q, top_k=10)
+    res.embedder.match_vector(np.asarray(res.embedder._kw_emb[0], dtype=np.float32))
+    res.kw_matrix.scores({res.kw_matrix.tokens[0]: 1.0}, top_per_product=3)
+    out.put((mode, process_memory_kib()))
+
+
+def main() -> None:
+    parent = ChatResources.load()
+    path = publish_resources(parent)
+    print(f"Published {path} ({os.path.getsize(path) / 1e6:.1f} MB)")
+
+    ctx = mp.get_context("spawn")
+    try:
+        for mode in ("load", "attach"):
+            out = ctx.Queue()
+            procs = [ctx.Process(target=_worker, args=(mode, path, out)) for _ in range(N_WORKERS)]
+            for p in procs:
+                p.start()
+            results = [out.get() for _ in procs]
+            for p in procs:
+                p.join()
+            anon = [r[1].get("RssAnon", 0) for r in results]
+            print(f"{mode:>6}: {N_WORKERS} workers, private RSS per worker (KiB) {anon}, total {sum(anon)}")
+    finally:
+        os.remove(path)
+
+
+if __name__ == "__main__":
+    main()
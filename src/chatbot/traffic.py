@@ -0,0 +1,124 @@
+# This file records chat turns as compact JSONL traces (one line per turn) for replay against newer code
+# A trace line holds the user's input, the slot state before/after, every raw LLM output of the turn,
+# the follow-up question or ranked results and the per-stage wall times (see src/test/replay_traces.py)
+# While a stage of a traced turn runs, its TurnTrace is the thread's active trace: llm_generate() appends
+# its raw outputs to it, or, for a replayed turn, serves the recorded outputs instead of running the model
+from __future__ import annotations
+
+import json
+import os
+import threading
+from collections import deque
+from contextlib import contextmanager
+from typing import Any, Deque, Dict, Iterator, List, Optional
+
+TRACE_VERSION = 2
+MAX_TRACE_BYTES = 256 * 1024**2  # the trace file is rotated to <path>.1 beyond this
+
+
+class RecordedOutputMissing(LookupError):
+    """A replayed turn asked the LLM for more outputs (or other stages) than were recorded."""
+
+
+class TurnTrace:
+    """
+    Everything recorded about one turn. replay_llm (recorded {"stage", "out"|"error", "ms"} entries)
+    makes llm_generate() answer from the recording, in order, instead of running the model.
+    An entry's ms is its generation time; replayed entries have none (nothing was generated).
+    """
+    def __init__(self, record: Dict[str, Any], replay_llm: Optional[List[Dict[str, Any]]] = None) -> None:
+        self.record = record
+        self.record.setdefault("llm", [])
+        self.record.setdefault("ms", {})
+        self.replay: Optional[Deque[Dict[str, Any]]] = deque(replay_llm) if replay_llm is not None else None
+
+    def add_llm(self, stage: str, out: Optional[str] = None, error: Optional[str] = None, ms: Optional[float] = None) -> None:
+        entry: Dict[str, Any] = {"stage": stage}
+        if error is not None:
+            entry["error"] = error
+        else:
+            entry["out"] = out
+        if ms is not None:
+            entry["ms"] = round(ms, 3)
+        self.record["llm"].append(entry)
+
+    def recorded_llm(self, stage: str) -> str:
+        # next recorded output; a recorded failure is raised again so fallbacks replay too
+        if not self.replay or self.replay[0]["stage"] != stage:
+            raise RecordedOutputMissing(f"No recorded {stage!r} output left for this turn.")
+        entry = self.replay.popleft()
+        self.add_llm(stage, entry.get("out"), entry.get("error"))
+        if "error" in entry:
+            raise RuntimeError(f"Recorded LLM failure: {entry['error']}")
+        return entry["out"]
+
+    def add_ms(self, stage: str, ms: float) -> None:
+        self.record["ms"][stage] = round(self.record["ms"].get(stage, 0.0) + ms, 3)
+
+
+_active = threading.local()
+
+
+def active_trace() -> Optional[TurnTrace]:
+    return getattr(_active, "trace", None)
+
+
+@contextmanager
+def activate(trace: Optional[TurnTrace]) -> Iterator[None]:
+    # make trace the calling thread's active trace for the block (stages can run on different threads)
+    previous = active_trace()
+    _active.trace = trace
+    try:
+        yield
+    finally:
+        _active.trace = previous
+
+
+def compact_state(state: Dict[str, Any]) -> Dict[str, Any]:
+    # slots at their defaults are left out; ConversationState(**compact_state(...)) restores the rest
+    return {k: v for k, v in state.items() if v is not None and v != [] and v != {}}
+
+
+class TraceWriter:
+    """
+    Thread-safe JSONL appender. Lines are flushed as they are written, so a crash loses at most
+    the turn in flight; past max_bytes the file is rotated to <path>.1 (replacing the previous one).
+    """
+    def __init__(self, path: str, max_bytes: int = MAX_TRACE_BYTES) -> None:
+        self.path = path
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._f = open(path, "a", encoding="utf-8")
+
+    def write(self, record: Dict[str, Any]) -> None:
+        line = json.dumps(record, ensure_ascii=False, separators=(",", ":")) + "\n"
+        with self._lock:
+            self._f.write(line)
+            self._f.flush()
+            if self._f.tell() > self.max_bytes:
+                self._f.close()
+                os.replace(self.path, f"{self.path}.1")
+                self._f = open(self.path, "a", encoding="utf-8")
+
+    def close(self) -> None:
+        with self._lock:
+            self._f.close()
+
+
+def read_traces(path: str) -> Iterator[Dict[str, Any]]:
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                yield json.loads(line)
+
+
+def group_sessions(records: List[Dict[str, Any]]) -> Dict[str, List[Dict[str, Any]]]:
+    # session id -> its turns in file order: concurrent sessions interleave, but the turns of one
+    # session run one at a time, so their lines are in turn order
+    sessions: Dict[str, List[Dict[str, Any]]] = {}
+    for r in records:
+        sessions.setdefault(r["sid"], []).append(r)
+    return sessions
@@ -0,0 +1,195 @@
+# This file collapses near-duplicate catalog rows (Black Label / Heritage / "Updated" re-listings of one model)
+# into variant clusters at index-build time: one representative vector per cluster is scored,
+# and the other variants are expanded again when results are shown
+from __future__ import annotations
+
+import re
+import sqlite3
+from typing import Dict, List, Optional, Tuple, Union
+
+import numpy as np
+
+from .embedder import ProductDescriptionEmbedder
+
+# name suffixes that mark a variant listing rather than a different model
+VARIANT_MARKERS = ("black label", "heritage", "updated", "cr", "pbi")
+
+_MARKER_RE = re.compile(r"\b(" + "|".join(re.escape(m) for m in VARIANT_MARKERS) + r")\b")
+
+
+def variant_name_key(name: Optional[str]) -> str:
+    t = (name or "").lower()
+    t = t.replace("canada goose", " ")
+    t = _MARKER_RE.sub(" ", t)
+    t = re.sub(r"[^a-z0-9']+", " ", t)
+    return " ".join(t.split())
+
+
+class VariantClusters:
+    """
+    Products with the same normalized name + gender whose description vectors have
+    cosine >= sim_threshold to the cluster's first member form one cluster.
+    rep_embs holds one normalized mean vector per cluster; every member inherits its cluster's score.
+    Everything is kept in flat arrays (no per-product Python objects), so workers can adopt them from shared memory.
+    """
+    def __init__(
+        self,
+        rep_ids: np.ndarray,
+        rep_embs: np.ndarray,
+        members: np.ndarray,
+        offsets: np.ndarray,
+        source_version: int,
+        sim_threshold: float,
+        lookup: Optional[Tuple[np.ndarray, np.ndarray]] = None,
+    ) -> None:
+        self.rep_ids = rep_ids
+        self.rep_embs = rep_embs
+        # member ids of cluster c: members[offsets[c]:offsets[c + 1]]
+        self.members = members
+        self.offsets = offsets
+        self.source_version = source_version
+        self.sim_threshold = sim_threshold
+
+        # (sorted member ids, cluster of each): id -> cluster lookup by binary search
+        if lookup is None:
+            order = np.argsort(members, kind="stable")
+            cluster = np.repeat(np.arange(len(offsets) - 1, dtype=np.int64), np.diff(offsets))
+            lookup = (members[order], cluster[order])
+        self._lookup_ids, self._lookup_clusters = lookup
+        self.n_products = len(members)
+
+    @classmethod
+    def build(
+        cls,
+        conn: sqlite3.Connection,
+        desc_index: ProductDescriptionEmbedder,
+        sim_threshold: float = 0.9,
+    ) -> "VariantClusters":
+        desc_index.ensure_loaded(conn)
+        assert desc_index.product_embs is not None
+        row_of = {pid: i for i, pid in enumerate(desc_index.product_ids)}
+
+        meta = {
+            int(r[0]): (variant_name_key(r[1]), r[2] or "")
+            for r in conn.execute("SELECT id, name, gender_norm FROM products").fetchall()
+        }
+
+        groups: Dict[Tuple[str, str], List[List[int]]] = {}
+        for pid in desc_index.product_ids:
+            key = meta.get(pid, (str(pid), ""))
+            clusters = groups.setdefault(key, [])
+            v = desc_index.product_embs[row_of[pid]]
+            for members in clusters:
+                if float(desc_index.product_embs[row_of[members[0]]] @ v) >= sim_threshold:
+                    members.append(pid)
+                    break
+            else:
+                clusters.append([pid])
+
+        all_clusters = sorted((members for cl in groups.values() for members in cl), key=lambda m: m[0])
+        rep_embs = np.zeros((len(all_clusters), desc_index.product_embs.shape[1]), dtype=np.float32)
+        for c, members in enumerate(all_clusters):
+            v = desc_index.product_embs[[row_of[pid] for pid in members]].mean(axis=0)
+            rep_embs[c] = v / (np.linalg.norm(v) + 1e-12)
+
+        offsets = np.zeros(len(all_clusters) + 1, dtype=np.int64)
+        np.cumsum([len(m) for m in all_clusters], out=offsets[1:])
+        return cls(
+            rep_ids=np.array([m[0] for m in all_clusters], dtype=np.int64),
+            rep_embs=rep_embs,
+            members=np.array([int(pid) for m in all_clusters for pid in m], dtype=np.int64),
+            offsets=offsets,
+            source_version=desc_index.version,
+            sim_threshold=sim_threshold,
+        )
+
+    def to_arrays(self) -> Dict[str, np.ndarray]:
+        # flat form for shared_arrays.py
+        return {
+            "rep_ids": self.rep_ids,
+            "rep_embs": self.rep_embs,
+            "members": self.members,
+            "offsets": self.offsets,
+            "lookup_ids": self._lookup_ids,
+            "lookup_clusters": self._lookup_clusters,
+        }
+
+    @classmethod
+    def from_arrays(
+        cls,
+        arrays: Dict[str, np.ndarray],
+        source_version: int,
+        sim_threshold: float,
+    ) -> "VariantClusters":
+        # every array is adopted as-is, so shared arrays are neither copied nor re-indexed
+        return cls(
+            arrays["rep_ids"], arrays["rep_embs"], arrays["members"], arrays["offsets"],
+            source_version, sim_threshold,
+            lookup=(arrays["lookup_ids"], arrays["lookup_clusters"]),
+        )
+
+    def is_current(self, desc_index: ProductDescriptionEmbedder) -> bool:
+        return self.source_version == desc_index.version
+
+    def clusters_of(self, product_ids: Union[List[int], np.ndarray]) -> np.ndarray:
+        # cluster index per product id (-1 for products that are not clustered)
+        pids = np.asarray(product_ids, dtype=np.int64)
+        if not len(self._lookup_ids):
+            return np.full(len(pids), -1, dtype=np.int64)
+        pos = np.minimum(np.searchsorted(self._lookup_ids, pids), len(self._lookup_ids) - 1)
+        return np.where(self._lookup_ids[pos] == pids, self._lookup_clusters[pos], -1)
+
+    def score_vector(
+        self,
+        q_emb: np.ndarray,
+        top_k: int = 50,
+        product_ids: Optional[List[int]] = None,
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Same contract as ProductDescriptionEmbedder.score_vector, but only cluster vectors are scored:
+        the top_k clusters are expanded to all their members (product ids, scores), best first.
+        """
+        if product_ids is None:
+            clusters = np.arange(len(self.rep_ids))
+        else:
+            clusters = self.clusters_of(product_ids)
+            clusters = np.unique(clusters[clusters >= 0])
+        if len(clusters) == 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+
+        scores = self.rep_embs[clusters] @ q_emb
+        k = min(max(1, top_k), len(scores))
+        idx = np.argsort(-scores, kind="stable")[:k]
+        top = clusters[idx]
+
+        out_ids = np.concatenate([self.members[self.offsets[c]:self.offsets[c + 1]] for c in top])
+        out_scores = np.repeat(scores[idx], np.diff(self.offsets)[top])
+        return out_ids, out_scores
+
+    def collapse(self, ids: np.ndarray, scores: np.ndarray) -> Tuple[np.ndarray, np.ndarray, List[List[int]]]:
+        """
+        Keep the best-ranked product of each cluster in a ranking; the other ranked
+        members of its cluster become its variant list (in ranking order).
+        """
+        keep: List[int] = []
+        variants: List[List[int]] = []
+        slot_of: Dict[int, int] = {}
+        for i, (pid, c) in enumerate(zip(ids.tolist(), self.clusters_of(ids).tolist())):
+            if c < 0:
+                c = -1 - pid
+            if c in slot_of:
+                variants[slot_of[c]].append(pid)
+                continue
+            slot_of[c] = len(keep)
+            keep.append(i)
+            variants.append([])
+        sel = np.array(keep, dtype=np.int64)
+        return ids[sel], scores[sel], variants
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            "products": self.n_products,
+            "clusters": len(self.rep_ids),
+            "multi_variant_clusters": int((np.diff(self.offsets) > 1).sum()),
+            "index_shrink": round(1 - len(self.rep_ids) / self.n_products, 4) if self.n_products else 0.0,
+        }
@@ -3,6 +3,8 @@ import re
 import sqlite3
 from typing import Optional, Set, Tuple, List
 
+from migrate_db import bump_catalog_version, migrate
+
 DB_PATH = "data/canada_goose.db"
 
 # -------------------------
@@ -238,6 +240,7 @@ def rebuild_keywords(conn: sqlite3.Connection, clear_existing: bool = True) -> N
                 (pid, kw)
             )
 
+    bump_catalog_version(conn)
     conn.commit()
 
 def print_sanity(conn: sqlite3.Connection) -> None:
@@ -262,6 +265,8 @@ def print_sanity(conn: sqlite3.Connection) -> None:
 
 def main() -> None:
     conn = connect_db()
+    # bring the schema up to date first so the rebuild bumps catalog_meta once (v4), not per row
+    migrate(conn)
 
     rebuild_keywords(conn, clear_existing=True)
     print_sanity(conn)
@@ -2,17 +2,20 @@
 import csv
 import sqlite3
 
-import csv
-import sqlite3
+from migrate_db import bump_catalog_version, migrate, rebuild_fts
 
 conn = sqlite3.connect("data/canada_goose.db")
+# make sure gender_norm / indexes / triggers exist before ingesting
+migrate(conn)
 cur = conn.cursor()
 
 with open("data/extracted/products.csv", newline='', encoding="utf-8") as f:
     reader = csv.DictReader(f)
     for row in reader:
+        # gender_norm and products_fts are filled by the insert triggers from migrate_db.py
         cur.execute("""
             INSERT OR IGNORE INTO products
+                (id, brand, name, gender, price, currency, availability, sku, description, url, image_url)
             VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
         """, (
             row["id"],
@@ -28,6 +31,8 @@ with open("data/extracted/products.csv", newline='', encoding="utf-8") as f:
             row["image_url"]
         ))
 
+# full re-index keeps the lexical channel consistent even if rows were loaded another way
+rebuild_fts(conn)
+bump_catalog_version(conn)
 conn.commit()
 conn.close()
-
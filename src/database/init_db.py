@@ -1,39 +1,56 @@
 # This file craetes the database and tables for the project, including the keywords table and procduct table
 import sqlite3
 
-conn = sqlite3.connect("data/canada_goose.db")
-cur = conn.cursor()
+from migrate_db import migrate
 
-cur.execute("""
-CREATE TABLE IF NOT EXISTS products (
-    id INTEGER PRIMARY KEY,
-    brand TEXT,
-    name TEXT,
-    gender TEXT,
-    price REAL,
-    currency TEXT,
-    availability TEXT,
-    sku TEXT UNIQUE,
-    description TEXT,
-    url TEXT,
-    image_url TEXT
-);
-""")
-
-# keyword table + indexes
-cur.executescript("""
-CREATE TABLE IF NOT EXISTS product_keywords (
-    product_id INTEGER NOT NULL,
-    keyword TEXT NOT NULL,
-    PRIMARY KEY (product_id, keyword),
-    FOREIGN KEY (product_id) REFERENCES products(id)
-);
-
-CREATE INDEX IF NOT EXISTS idx_keyword ON product_keywords(keyword);
-CREATE INDEX IF NOT EXISTS idx_product_id ON product_keywords(product_id);
-""")
-conn.commit()
-conn.close()
+DB_PATH = "data/canada_goose.db"
+
+
+def create_schema(conn: sqlite3.Connection) -> None:
+    # base tables only; migrate() adds the derived columns, indexes, triggers and FTS on top
+    cur = conn.cursor()
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS products (
+        id INTEGER PRIMARY KEY,
+        brand TEXT,
+        name TEXT,
+        gender TEXT,
+        price REAL,
+        currency TEXT,
+        availability TEXT,
+        sku TEXT UNIQUE,
+        description TEXT,
+        url TEXT,
+        image_url TEXT
+    );
+    """)
+
+    # keyword table + indexes
+    cur.executescript("""
+    CREATE TABLE IF NOT EXISTS product_keywords (
+        product_id INTEGER NOT NULL,
+        keyword TEXT NOT NULL,
+        PRIMARY KEY (product_id, keyword),
+        FOREIGN KEY (product_id) REFERENCES products(id)
+    );
+
+    CREATE INDEX IF NOT EXISTS idx_keyword ON product_keywords(keyword);
+    CREATE INDEX IF NOT EXISTS idx_product_id ON product_keywords(product_id);
+    """)
+    conn.commit()
+
+
+def main() -> None:
+    conn = sqlite3.connect(DB_PATH)
+    create_schema(conn)
+
+    # bring the fresh schema up to date (tei_level, gender_norm, filter indexes)
+    migrate(conn)
+    conn.close()
+
+
+if __name__ == "__main__":
+    main()
 
 '''
 conn = sqlite3.connect("data/canada_goose.db")
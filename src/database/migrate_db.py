@@ -0,0 +1,170 @@
+# This file upgrades an existing database to the current schema (run after init_db.py, safe to re-run)
+# Each step is applied once and recorded in PRAGMA user_version
+import sqlite3
+from typing import Callable, List, Set, Tuple
+
+DB_PATH = "data/canada_goose.db"
+
+# Same rules as the old Python-side gender filter: "women" must be tested before "men"
+GENDER_NORM_SQL = """
+CASE
+    WHEN lower(trim(coalesce({col}, ''))) LIKE '%unisex%' THEN 'unisex'
+    WHEN lower(trim(coalesce({col}, ''))) LIKE '%women%'
+      OR lower(trim(coalesce({col}, ''))) LIKE '%woman%'
+      OR lower(trim(coalesce({col}, ''))) LIKE '%female%' THEN 'women'
+    WHEN lower(trim(coalesce({col}, ''))) LIKE '%men%'
+      OR lower(trim(coalesce({col}, ''))) LIKE '%man%'
+      OR lower(trim(coalesce({col}, ''))) LIKE '%male%' THEN 'men'
+    ELSE NULL
+END
+"""
+
+
+def column_names(conn: sqlite3.Connection, table: str) -> Set[str]:
+    return {r[1] for r in conn.execute(f"PRAGMA table_info({table})").fetchall()}
+
+
+def bump_catalog_version(conn: sqlite3.Connection) -> None:
+    # writers call this once per write transaction, before commit (no-op before migration v3 created catalog_meta)
+    if conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'catalog_meta'").fetchone():
+        conn.execute("UPDATE catalog_meta SET value = value + 1 WHERE key = 'version'")
+
+
+def rebuild_fts(conn: sqlite3.Connection) -> None:
+    # re-index products_fts from the products table (after bulk loads that bypass triggers)
+    conn.execute("INSERT INTO products_fts(products_fts) VALUES ('rebuild')")
+
+
+# -------------------------
+# Migration steps
+# -------------------------
+def _v1_gender_norm_and_filter_indexes(conn: sqlite3.Connection) -> None:
+    cols = column_names(conn, "products")
+    if "tei_level" not in cols:
+        conn.execute("ALTER TABLE products ADD COLUMN tei_level INTEGER")
+    if "gender_norm" not in cols:
+        conn.execute("ALTER TABLE products ADD COLUMN gender_norm TEXT")
+
+    conn.execute(f"UPDATE products SET gender_norm = {GENDER_NORM_SQL.format(col='gender')}")
+
+    # keep gender_norm populated for every ingest path
+    conn.executescript(f"""
+    CREATE TRIGGER IF NOT EXISTS trg_products_gender_norm_insert
+    AFTER INSERT ON products
+    BEGIN
+        UPDATE products SET gender_norm = {GENDER_NORM_SQL.format(col='NEW.gender')} WHERE id = NEW.id;
+    END;
+
+    CREATE TRIGGER IF NOT EXISTS trg_products_gender_norm_update
+    AFTER UPDATE OF gender ON products
+    BEGIN
+        UPDATE products SET gender_norm = {GENDER_NORM_SQL.format(col='NEW.gender')} WHERE id = NEW.id;
+    END;
+
+    CREATE INDEX IF NOT EXISTS idx_products_gender_price ON products(gender_norm, price);
+    CREATE INDEX IF NOT EXISTS idx_products_price ON products(price);
+    CREATE INDEX IF NOT EXISTS idx_products_tei ON products(tei_level);
+    """)
+
+
+def _v2_products_fts(conn: sqlite3.Connection) -> None:
+    # external-content FTS5 index over products; triggers keep it in sync with every write
+    conn.executescript("""
+    CREATE VIRTUAL TABLE IF NOT EXISTS products_fts USING fts5(
+        name, description, sku,
+        content='products', content_rowid='id',
+        tokenize='porter unicode61'
+    );
+
+    CREATE TRIGGER IF NOT EXISTS trg_products_fts_insert AFTER INSERT ON products
+    BEGIN
+        INSERT INTO products_fts(rowid, name, description, sku)
+        VALUES (NEW.id, NEW.name, NEW.description, NEW.sku);
+    END;
+
+    CREATE TRIGGER IF NOT EXISTS trg_products_fts_delete AFTER DELETE ON products
+    BEGIN
+        INSERT INTO products_fts(products_fts, rowid, name, description, sku)
+        VALUES ('delete', OLD.id, OLD.name, OLD.description, OLD.sku);
+    END;
+
+    CREATE TRIGGER IF NOT EXISTS trg_products_fts_update AFTER UPDATE OF name, description, sku ON products
+    BEGIN
+        INSERT INTO products_fts(products_fts, rowid, name, description, sku)
+        VALUES ('delete', OLD.id, OLD.name, OLD.description, OLD.sku);
+        INSERT INTO products_fts(rowid, name, description, sku)
+        VALUES (NEW.id, NEW.name, NEW.description, NEW.sku);
+    END;
+    """)
+    rebuild_fts(conn)
+
+
+def _v3_catalog_version(conn: sqlite3.Connection) -> None:
+    # monotonically increasing catalog version, bumped by any write to the catalog tables;
+    # readers (e.g. the ranked-result cache) compare it to know when their data is stale
+    conn.execute("CREATE TABLE IF NOT EXISTS catalog_meta (key TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+    conn.execute("INSERT OR IGNORE INTO catalog_meta(key, value) VALUES ('version', 1)")
+
+    for table in ("products", "product_keywords"):
+        for event in ("INSERT", "UPDATE", "DELETE"):
+            conn.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS trg_{table}_version_{event.lower()}
+            AFTER {event} ON {table}
+            BEGIN
+                UPDATE catalog_meta SET value = value + 1 WHERE key = 'version';
+            END
+            """)
+
+
+def _v4_version_bump_per_transaction(conn: sqlite3.Connection) -> None:
+    # v3's per-row triggers cost one extra write per row written (two per insert, since the gender_norm
+    # trigger's UPDATE fires again); writers bump once per transaction with bump_catalog_version() instead
+    for table in ("products", "product_keywords"):
+        for event in ("insert", "update", "delete"):
+            conn.execute(f"DROP TRIGGER IF EXISTS trg_{table}_version_{event}")
+    bump_catalog_version(conn)
+
+
+MIGRATIONS: List[Tuple[int, Callable[[sqlite3.Connection], None]]] = [
+    (1, _v1_gender_norm_and_filter_indexes),
+    (2, _v2_products_fts),
+    (3, _v3_catalog_version),
+    (4, _v4_version_bump_per_transaction),
+]
+
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+
+def schema_version(conn: sqlite3.Connection) -> int:
+    return int(conn.execute("PRAGMA user_version").fetchone()[0])
+
+
+def migrate(conn: sqlite3.Connection) -> int:
+    current = schema_version(conn)
+    for version, step in MIGRATIONS:
+        if version <= current:
+            continue
+        step(conn)
+        conn.execute(f"PRAGMA user_version = {version}")
+        conn.commit()
+        print(f"Applied migration v{version}: {step.__name__}")
+        current = version
+    return current
+
+
+def main() -> None:
+    conn = sqlite3.connect(DB_PATH)
+    version = migrate(conn)
+    print("Schema version:", version)
+    print(conn.execute("""
+        SELECT gender, gender_norm, COUNT(*)
+        FROM products
+        GROUP BY gender, gender_norm
+    """).fetchall())
+    print("Catalog version:", conn.execute("SELECT value FROM catalog_meta WHERE key = 'version'").fetchone()[0])
+    print("FTS rows:", conn.execute("SELECT COUNT(*) FROM products_fts").fetchone()[0])
+    conn.close()
+
+
+if __name__ == "__main__":
+    main()
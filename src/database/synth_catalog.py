@@ -0,0 +1,350 @@
+# This file generates synthetic catalogs (10k / 100k / 1M products) for scaling tests, modelled on data/extracted/products.csv
+# Per product type (parka, vest, hoody, ...) it resamples the real genders, model names, editions, prices, TEI levels
+# and description sentences, and writes the rows into the same schema as init_db.py (migrations, keywords, FTS included)
+# With EMBEDDINGS it also writes description vectors: the real vector of the product each synthetic one was modelled on,
+# plus noise, in the ProductDescriptionEmbedder cache format, so no model has to encode a million texts
+# Output: data/synthetic/<n>/canada_goose.db (+ vectors) -> ChatResources.load(db_path=..., data_dir=...) / catalog_paths(n)
+# Run from the repo root: python src/database/synth_catalog.py
+import csv
+import json
+import os
+import random
+import re
+import shutil
+import sqlite3
+import time
+import zlib
+from collections import defaultdict
+from typing import Dict, FrozenSet, Iterator, List, Optional, Set, Tuple
+
+import numpy as np
+
+from build_kw_sql import extract_keywords
+from init_db import create_schema
+from migrate_db import migrate
+
+SOURCE_CSV = "data/extracted/products.csv"
+SOURCE_DATA_DIR = "data"  # real description vectors (product_desc_* files) the synthetic ones are derived from
+OUT_DIR = "data/synthetic"
+
+SIZES = [10_000, 100_000, 1_000_000]
+SEED = 7
+CHUNK = 20_000  # rows generated, inserted and embedded per batch
+
+EMBEDDINGS = True
+EMBED_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+EMBED_DIM = 384       # only used when SOURCE_DATA_DIR has no vectors (pure random unit vectors)
+EMBED_NOISE = 0.35    # norm of the noise added to the source vector before re-normalizing
+
+PRODUCT_TYPES = {
+    "Jacket", "Hoody", "Hoodie", "Vest", "Parka", "Coat", "Cap", "Puffer", "Sweater", "Hat", "Bomber",
+    "Glove", "Gloves", "Mitts", "Toque", "Beanie", "Scarf", "Shell", "Pullover", "Cardigan", "Anorak",
+}
+GENDER_PREFIX = {"Men": "Men's ", "Women": "Women's "}
+TEI_TEXT = {
+    1: "TEI1LIGHTWEIGHT5°C / -5°C41°F / 23°F",
+    2: "TEI2VERSATILE0°C / -10°C32°F / 14°F",
+    3: "TEI3FUNDAMENTAL-10°C / -20°C14°F / -4°F",
+    4: "TEI4ENDURING-15°C / -25°C5°F / -13°F",
+    5: "TEI5EXTREME-25°C / -30°C-13°F / -22°F",
+}
+TEI_IN_TEXT = re.compile(r"TEI\s*[1-5]", re.IGNORECASE)
+SENTENCE_SPLIT = re.compile(r"(?<=[.!?])\s*(?=[A-Z])")
+GENDER_WORD = re.compile(r"\b(?:wo)?men[’']s\b", re.IGNORECASE)
+
+# syllables for new model names in the style of the real ones (Canadian place names)
+NAME_HEADS = ["Ash", "Bel", "Brook", "Carl", "Chil", "Cor", "Dun", "Elm", "Fair", "Glen", "Hal", "Kel",
+              "Lang", "Mac", "Nor", "Osh", "Pem", "Quin", "Ross", "Sel", "Tam", "Ux", "Wen", "Whit"]
+NAME_TAILS = ["ford", "ton", "wick", "ridge", "dale", "mere", "field", "wood", "brook", "haven", "port", "ville"]
+
+
+def catalog_paths(n: int, out_dir: str = OUT_DIR) -> Tuple[str, str]:
+    # (db_path, data_dir) of the synthetic catalog with n products
+    data_dir = os.path.join(out_dir, str(n))
+    return os.path.join(data_dir, "canada_goose.db"), data_dir
+
+
+def desc_cache_paths(data_dir: str, model_name: str = EMBED_MODEL) -> Tuple[str, str]:
+    # same file names as ProductDescriptionEmbedder._cache_paths
+    safe_name = model_name.replace("/", "__")
+    return (
+        os.path.join(data_dir, f"product_desc_meta__{safe_name}.json"),
+        os.path.join(data_dir, f"product_desc_emb__{safe_name}.npy"),
+    )
+
+
+# -------------------------
+# Source distribution
+# -------------------------
+class SourceProduct:
+    __slots__ = ("id", "brand", "gender", "model", "ptype", "edition", "price", "currency", "availability", "sentences", "tei")
+
+    def __init__(self, row: Dict[str, str]) -> None:
+        self.id = int(row["id"])
+        self.brand = row["brand"]
+        self.gender = row["gender"]
+        self.price = float(row["price"])
+        self.currency = row["currency"]
+        self.availability = row["availability"]
+
+        words = row["name"].replace(f"{self.brand} ", "", 1).replace("Men's ", "").replace("Women's ", "").split()
+        at = next((i for i, w in enumerate(words) if w in PRODUCT_TYPES), None)
+        if at is None:
+            self.model, self.ptype, self.edition = " ".join(words), "", ""
+        else:
+            self.model, self.ptype, self.edition = " ".join(words[:at]), words[at], " ".join(words[at + 1:])
+
+        m = TEI_IN_TEXT.search(row["description"])
+        self.tei = int(m.group(0)[-1]) if m else None
+        # TEI blocks are regenerated per product, so sentences carrying one are left out of the pool
+        self.sentences = [s for s in SENTENCE_SPLIT.split(row["description"].strip()) if s and not TEI_IN_TEXT.search(s)]
+
+
+class CatalogProfile:
+    """
+    The real catalog grouped by product type: synthetic products of a type are built from
+    a random real product of that type (its price, TEI and opening sentence) plus sentences
+    and editions drawn from all products of the type.
+    """
+    def __init__(self, products: List[SourceProduct]) -> None:
+        self.products = products
+        self.by_type: Dict[str, List[SourceProduct]] = defaultdict(list)
+        for p in products:
+            self.by_type[p.ptype].append(p)
+        self.types = sorted(self.by_type)
+        self.type_weights = [len(self.by_type[t]) for t in self.types]
+        self.sentences = {t: [s for p in ps for s in p.sentences[1:]] for t, ps in self.by_type.items()}
+        self.editions = {t: [p.edition for p in ps] for t, ps in self.by_type.items()}
+        self.model_words = {t: [w for p in ps for w in p.model.split()[1:]] for t, ps in self.by_type.items()}
+        # real model names of a type (and their first words, e.g. "HyBridge" of "Hybridge Lite"), longest first
+        self.model_names: Dict[str, Optional[re.Pattern]] = {}
+        for t, ps in self.by_type.items():
+            names = {p.model for p in ps if p.model} | {p.model.split()[0] for p in ps if p.model}
+            alts = "|".join(re.escape(m) for m in sorted(names, key=len, reverse=True))
+            self.model_names[t] = re.compile(rf"\b(?:{alts})\b", re.IGNORECASE) if alts else None
+
+    @classmethod
+    def from_csv(cls, path: str = SOURCE_CSV) -> "CatalogProfile":
+        with open(path, newline="", encoding="utf-8") as f:
+            return cls([SourceProduct(row) for row in csv.DictReader(f)])
+
+
+# -------------------------
+# Row generation
+# -------------------------
+def new_model_name(rng: random.Random, profile: CatalogProfile, ptype: str) -> str:
+    name = rng.choice(NAME_HEADS) + rng.choice(NAME_TAILS)
+    words = profile.model_words[ptype]
+    if words and rng.random() < 0.3:
+        name = f"{name} {rng.choice(words)}"
+    return name
+
+
+def generate_products(profile: CatalogProfile, n: int, seed: int = SEED) -> Iterator[Tuple[tuple, SourceProduct]]:
+    """
+    Yields (products row, the real product it was modelled on) for ids 1..n.
+    The row matches the INSERT in write_catalog (same columns as csv_to_sql.py).
+    """
+    rng = random.Random(seed)
+    for pid in range(1, n + 1):
+        ptype = rng.choices(profile.types, weights=profile.type_weights)[0]
+        src = rng.choice(profile.by_type[ptype])
+
+        model = src.model if rng.random() < 0.25 else new_model_name(rng, profile, ptype)
+        edition = rng.choice(profile.editions[ptype])
+        gender = rng.choice(profile.by_type[ptype]).gender
+        name = " ".join(w for w in (src.brand, GENDER_PREFIX.get(gender, "") + model, ptype, edition) if w)
+
+        price = src.price * rng.lognormvariate(0.0, 0.12)
+        if "Black Label" in edition and "Black Label" not in src.edition:
+            price *= 1.1
+        price = max(5.0, round(price / 5.0) * 5.0)
+
+        # the opening sentence names the product: point it at the new model and gender
+        opening = src.sentences[:1]
+        if opening:
+            first = opening[0]
+            if profile.model_names[ptype] is not None:
+                first = profile.model_names[ptype].sub(model, first)
+            if gender in GENDER_PREFIX:
+                first = GENDER_WORD.sub(GENDER_PREFIX[gender].strip().replace("'", "’"), first)
+            opening = [first]
+        pool = profile.sentences[ptype]
+        k = min(len(pool), max(2, len(src.sentences) - 1 + rng.randint(-2, 2)))
+        sentences = opening + rng.sample(pool, k)
+
+        tei = src.tei
+        if tei is not None:
+            tei = min(5, max(1, tei + rng.choice((-1, 0, 0, 0, 1))))
+            sentences.append(TEI_TEXT[tei])
+        description = " ".join(sentences)
+
+        gcode = {"Men": "M", "Women": "W"}.get(gender, "U") + ("B" if "Black Label" in edition else "")
+        sku = f"S{zlib.crc32(model.encode('utf-8')) % 9000 + 1000}{gcode}-{pid:07d}"
+        slug = re.sub(r"[^a-z0-9]+", "-", name.lower()).strip("-")
+        row = (
+            pid, src.brand, name, gender, price, src.currency,
+            rng.choice(profile.products).availability, sku, description,
+            f"https://www.example.com/synthetic/{slug}-{pid}/", f"https://cdn.example.com/synthetic/{pid}.jpg",
+            tei,
+        )
+        yield row, src
+
+
+class KeywordCache:
+    """
+    build_kw_sql.extract_keywords() per distinct name / sentence, unioned per product: descriptions are
+    recombined sentences, so this gives the same keywords (up to phrases spanning two sentences) at a
+    fraction of the cost for large catalogs.
+    """
+    def __init__(self) -> None:
+        self._cache: Dict[str, FrozenSet[str]] = {}
+
+    def _part(self, text: str) -> FrozenSet[str]:
+        kws = self._cache.get(text)
+        if kws is None:
+            kws = self._cache[text] = frozenset(extract_keywords(text))
+        return kws
+
+    def keywords(self, name: str, description: str) -> Set[str]:
+        out = set(self._part(name))
+        for s in SENTENCE_SPLIT.split(description):
+            out |= self._part(s)
+        return out
+
+
+def product_text(name: str, gender: str, description: str) -> str:
+    # same text as chatbot.embedder.build_product_text
+    parts = [str(name or "").strip().lower(), str(gender or "").strip().lower(), str(description or "").strip().lower()]
+    return " ".join([p for p in parts if p]).strip()
+
+
+def load_source_vectors(data_dir: str = SOURCE_DATA_DIR) -> Optional[Tuple[Dict[int, int], np.ndarray]]:
+    meta_path, emb_path = desc_cache_paths(data_dir)
+    if not (os.path.exists(meta_path) and os.path.exists(emb_path)):
+        return None
+    with open(meta_path, "r", encoding="utf-8") as f:
+        ids = [int(x) for x in json.load(f)["product_ids"]]
+    return {pid: i for i, pid in enumerate(ids)}, np.load(emb_path).astype(np.float32, copy=False)
+
+
+# -------------------------
+# Writer
+# -------------------------
+def write_catalog(n: int, profile: CatalogProfile, out_dir: str = OUT_DIR, embeddings: bool = EMBEDDINGS) -> Tuple[str, str]:
+    """
+    Generate the n-product catalog into catalog_paths(n); returns (db_path, data_dir).
+    Rows are bulk-loaded before the migrations run, so gender_norm, FTS and the catalog
+    version are built once at the end instead of by per-row triggers.
+    """
+    db_path, data_dir = catalog_paths(n, out_dir)
+    os.makedirs(data_dir, exist_ok=True)
+    tmp_db = f"{db_path}.tmp"
+    if os.path.exists(tmp_db):
+        os.remove(tmp_db)
+
+    conn = sqlite3.connect(tmp_db)
+    conn.execute("PRAGMA journal_mode = OFF")
+    conn.execute("PRAGMA synchronous = OFF")
+    create_schema(conn)
+    conn.execute("ALTER TABLE products ADD COLUMN tei_level INTEGER")  # filled here instead of by build_kw_sql.py
+
+    vectors = None
+    if embeddings:
+        source = load_source_vectors()
+        dim = source[1].shape[1] if source is not None else EMBED_DIM
+        meta_path, emb_path = desc_cache_paths(data_dir)
+        vectors = np.lib.format.open_memmap(emb_path, mode="w+", dtype=np.float32, shape=(n, dim))
+        # product texts are streamed to a side file and spliced into the meta JSON at the end
+        texts = open(f"{meta_path}.texts.tmp", "w", encoding="utf-8")
+    vec_rng = np.random.default_rng(SEED)
+
+    kw_cache = KeywordCache()
+    rows: List[tuple] = []
+    src_ids: List[int] = []
+    done = 0
+
+    def flush() -> None:
+        nonlocal done
+        conn.executemany("""
+            INSERT INTO products
+                (id, brand, name, gender, price, currency, availability, sku, description, url, image_url, tei_level)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """, rows)
+        conn.executemany(
+            "INSERT INTO product_keywords(product_id, keyword) VALUES (?, ?)",
+            [(r[0], kw) for r in rows for kw in sorted(kw_cache.keywords(r[2], r[8]))],
+        )
+        if vectors is not None:
+            for r in rows:
+                texts.write((", " if r[0] > 1 else "") + json.dumps(product_text(r[2], r[3], r[8]), ensure_ascii=False))
+            noise = vec_rng.standard_normal((len(rows), vectors.shape[1])).astype(np.float32)
+            noise *= EMBED_NOISE / np.linalg.norm(noise, axis=1, keepdims=True)
+            if source is not None:
+                index, base = source
+                block = base[[index[s] for s in src_ids]] + noise
+            else:
+                block = noise
+            block /= np.linalg.norm(block, axis=1, keepdims=True) + 1e-12
+            vectors[done:done + len(rows)] = block
+        done += len(rows)
+        rows.clear()
+        src_ids.clear()
+
+    started = time.perf_counter()
+    for row, src in generate_products(profile, n):
+        rows.append(row)
+        src_ids.append(src.id)
+        if len(rows) >= CHUNK:
+            flush()
+            print(f"  {done}/{n} rows ({time.perf_counter() - started:.1f}s)")
+    if rows:
+        flush()
+    conn.commit()
+
+    migrate(conn)
+    conn.execute("PRAGMA journal_mode = DELETE")
+    conn.close()
+    os.replace(tmp_db, db_path)
+
+    if vectors is not None:
+        vectors.flush()
+        del vectors
+        texts.close()
+        with open(meta_path, "w", encoding="utf-8") as meta, open(texts.name, "r", encoding="utf-8") as parts:
+            meta.write(json.dumps({"model_name": EMBED_MODEL, "count": n})[:-1])
+            meta.write(', "product_ids": ' + json.dumps(list(range(1, n + 1))))
+            meta.write(', "product_texts": [')
+            shutil.copyfileobj(parts, meta)
+            meta.write("]}")
+        os.remove(texts.name)
+
+    print(f"Wrote {n} products to {db_path} in {time.perf_counter() - started:.1f}s")
+    return db_path, data_dir
+
+
+def catalog_size(db_path: str) -> int:
+    if not os.path.exists(db_path):
+        return 0
+    conn = sqlite3.connect(db_path)
+    try:
+        return int(conn.execute("SELECT COUNT(*) FROM products").fetchone()[0])
+    except sqlite3.Error:
+        return 0
+    finally:
+        conn.close()
+
+
+def main() -> None:
+    profile = CatalogProfile.from_csv()
+    print(f"Source: {len(profile.products)} products, types {dict(zip(profile.types, profile.type_weights))}")
+    for n in SIZES:
+        db_path, _ = catalog_paths(n)
+        if catalog_size(db_path) == n:
+            print(f"{db_path} already has {n} products, skipping")
+            continue
+        write_catalog(n, profile)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,357 @@
+import hashlib
+import json
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import get_context
+from pathlib import Path
+from typing import Any, Deque, Dict, Iterator, List, Optional, Tuple
+
+# Parallel, resumable version of evaluator.py for full-suite runs.
+# The parent loads ChatResources once and publishes its matrices to a shared file (chatbot/shared_arrays.py);
+# WORKERS spawned processes attach to it and evaluate CHUNK_SIZE prompts per task: slot filling per prompt,
+# then one retrieve_and_rank_hybrid_batch call for the whole chunk. Every finished case is appended to
+# RESULTS_FILE as one JSONL line as soon as its chunk returns, so an interrupted run resumes where it stopped
+# (cases already in the file for the same prompt and settings are skipped). At the end the text report
+# (same format as evaluator.py) and a summary (per-prompt latency, FALLBACK_USED rate, errors) are built from
+# the JSONL file. Retrieval is timed per chunk, so per-case retrieval/total latencies are amortized
+# (chunk time / chunk size), not the latency of one query; evaluator.py times queries one by one.
+# Each worker loads its own copy of the LLM on first use: with a GPU model, keep WORKERS at
+# what fits in memory. Run from the repo root: python src/test/batch_evaluator.py
+CURRENT_DIR = Path(__file__).resolve().parent
+PROJECT_ROOT = CURRENT_DIR.parents[1]
+SRC_DIR = PROJECT_ROOT / "src"
+
+if str(PROJECT_ROOT) not in sys.path:
+    sys.path.insert(0, str(PROJECT_ROOT))
+if str(SRC_DIR) not in sys.path:
+    sys.path.insert(0, str(SRC_DIR))
+
+import numpy as np
+
+from chatbot.chatbot_runner import DB_PATH, ChatResources, catalog_version, production_query, retrieve_and_rank_hybrid_batch
+from chatbot.shared_arrays import attach_resources, publish_resources
+from evaluator import OUTPUT_FILE, PROMPTS_FILE, RETRIEVAL_PARAMS, fill_state, format_case, load_prompts, state_to_dict
+
+RESULTS_FILE = "data/eval/results.jsonl"
+SUMMARY_FILE = "data/eval/summary.json"
+
+WORKERS = os.cpu_count() or 1
+CHUNK_SIZE = 8             # prompts per task (one batched retrieval call)
+RETRY_ERRORS = True        # on resume, re-run cases whose record is an error
+MAX_CHUNK_ATTEMPTS = 3     # a chunk that crashes its worker (or fails) on its own is given up after this many times
+
+PERCENTILES = (50, 95, 99)
+
+
+# ----------------------------
+# Worker side
+# ----------------------------
+_res: Optional[ChatResources] = None
+_shared = None
+
+
+def init_worker(arrays_path: str, db_path: str) -> None:
+    global _res, _shared
+    _res, _shared = attach_resources(arrays_path, db_path=db_path)
+
+
+def evaluate_chunk(cases: List[Tuple[int, str]], config_key: str) -> List[Dict[str, Any]]:
+    """
+    Evaluate (case number, prompt) pairs; returns one record per case. A prompt whose slot filling
+    raises past fill_state's own fallback gets an error record, the rest of the chunk still runs.
+    """
+    res = _res
+    records: List[Dict[str, Any]] = []
+    filled = []
+    for case, prompt in cases:
+        rec: Dict[str, Any] = {"case": case, "prompt": prompt, "config": config_key, "pid": os.getpid()}
+        t0 = time.perf_counter()
+        try:
+            state, fallback_used, mapping_debug = fill_state(prompt, res.embedder)
+        except Exception as e:
+            rec["error"] = repr(e)
+            records.append(rec)
+            continue
+        rec["ms"] = {"slot_fill": round((time.perf_counter() - t0) * 1000.0, 3)}
+        records.append(rec)
+        filled.append((rec, state, fallback_used, mapping_debug))
+
+    if not filled:
+        return records
+
+    t0 = time.perf_counter()
+    try:
+        queries = [production_query(state, rec["prompt"], res.composer) for rec, state, _, _ in filled]
+        batch_results = retrieve_and_rank_hybrid_batch(
+            conn=res.conn,
+            embedder=res.embedder,
+            desc_index=res.desc_index,
+            user_queries=[q for q, _ in queries],
+            filters=[(state.price_min, state.price_max, state.gender) for _, state, _, _ in filled],
+            kw_matrix=res.kw_matrix,
+            query_vecs=[v for _, v in queries],
+            **RETRIEVAL_PARAMS,
+        )
+    except Exception as e:
+        for rec, _, _, _ in filled:
+            rec.pop("ms", None)
+            rec["error"] = repr(e)
+        return records
+    # one batched call serves the whole chunk: every case is charged an equal (amortized) share
+    batch_ms = (time.perf_counter() - t0) * 1000.0
+    retrieval_ms = batch_ms / len(filled)
+
+    for (rec, state, fallback_used, mapping_debug), (results, _matched) in zip(filled, batch_results):
+        rec["ms"]["retrieval_amortized"] = round(retrieval_ms, 3)
+        rec["ms"]["total_amortized"] = round(rec["ms"]["slot_fill"] + retrieval_ms, 3)
+        rec["ms"]["retrieval_batch"] = round(batch_ms, 3)
+        rec["batch_size"] = len(filled)
+        rec["fallback_used"] = fallback_used
+        rec["missing_slots"] = state.missing_slots()
+        rec["state"] = state_to_dict(state)
+        rec["results"] = [[p.id, round(p.score, 6)] for p in results]
+        rec["text"] = format_case(rec["prompt"], state, fallback_used, mapping_debug, results)
+    return records
+
+
+# ----------------------------
+# Results file
+# ----------------------------
+def read_results(path: str) -> Iterator[Tuple[int, Dict[str, Any]]]:
+    # (byte offset, record) per line; a line cut off by a crash is skipped
+    if not os.path.exists(path):
+        return
+    with open(path, "rb") as f:
+        offset = 0
+        for line in f:
+            start, offset = offset, offset + len(line)
+            if not line.strip():
+                continue
+            try:
+                yield start, json.loads(line)
+            except ValueError:
+                print(f"Skipping unreadable line at byte {start} of {path}")
+
+
+def latest_records(path: str, prompts: List[str], config_key: str) -> Dict[int, Tuple[int, Dict[str, Any]]]:
+    # case number -> (offset, record) of its last record for the current prompt and settings
+    latest: Dict[int, Tuple[int, Dict[str, Any]]] = {}
+    for offset, rec in read_results(path):
+        case = rec.get("case", 0)
+        if rec.get("config") == config_key and 1 <= case <= len(prompts) and prompts[case - 1] == rec.get("prompt"):
+            # only the small fields are kept in memory; the text is read back from the file when needed
+            latest[case] = (offset, {k: v for k, v in rec.items() if k not in ("text", "state", "results")})
+    return latest
+
+
+def open_for_append(path: str):
+    Path(path).parent.mkdir(parents=True, exist_ok=True)
+    f = open(path, "ab")
+    # a crash can leave a partial last line: start the next record on a fresh line
+    if f.tell() > 0:
+        with open(path, "rb") as r:
+            r.seek(-1, os.SEEK_END)
+            if r.read(1) != b"\n":
+                f.write(b"\n")
+    return f
+
+
+def append_records(f, records: List[Dict[str, Any]]) -> None:
+    f.write(b"".join(json.dumps(r, ensure_ascii=False, separators=(",", ":")).encode("utf-8") + b"\n" for r in records))
+    f.flush()
+    os.fsync(f.fileno())
+
+
+def run_config_key(res: ChatResources) -> str:
+    # a resumed run only reuses records produced with the same retrieval settings and catalog
+    key = {"db": DB_PATH, "catalog_version": catalog_version(res.conn), "retrieval": RETRIEVAL_PARAMS, "record_format": 2}
+    return hashlib.sha1(json.dumps(key, sort_keys=True).encode("utf-8")).hexdigest()[:12]
+
+
+# ----------------------------
+# Parallel run
+# ----------------------------
+def run_pending(pending: List[Tuple[int, str]], arrays_path: str, config_key: str, out) -> Tuple[int, int]:
+    """
+    Evaluate pending cases on a worker pool, appending records as chunks finish.
+    At most one chunk per worker is in flight. When a worker dies, the pool is replaced and the chunks
+    that were in flight are rerun one at a time on a single worker, so a crash is only charged to the
+    chunk that caused it; a chunk that fails MAX_CHUNK_ATTEMPTS times on its own is recorded as errors.
+    Returns (cases written, pool restarts).
+    """
+    chunks = [pending[i:i + CHUNK_SIZE] for i in range(0, len(pending), CHUNK_SIZE)]
+    failures = [0] * len(chunks)
+    todo: Deque[int] = deque(range(len(chunks)))
+    suspects: Deque[int] = deque()  # in flight when a worker died: culprit unknown until rerun alone
+    written = 0
+    restarts = 0
+    started = time.perf_counter()
+
+    def write(records: List[Dict[str, Any]]) -> None:
+        nonlocal written
+        append_records(out, records)
+        written += len(records)
+        rate = written / max(1e-9, time.perf_counter() - started)
+        print(f"  {written}/{len(pending)} cases ({rate:.1f}/s)")
+
+    def chunk_failed(ci: int, e: BaseException) -> None:
+        failures[ci] += 1
+        print(f"  chunk {ci + 1} failed on its own ({failures[ci]}/{MAX_CHUNK_ATTEMPTS}): {e!r}")
+        if failures[ci] < MAX_CHUNK_ATTEMPTS:
+            suspects.append(ci)
+        else:
+            write([{"case": c, "prompt": p, "config": config_key, "error": repr(e)} for c, p in chunks[ci]])
+
+    while todo or suspects:
+        isolated = bool(suspects)
+        source = suspects if isolated else todo
+        workers = 1 if isolated else min(WORKERS, len(todo))
+        pool = ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=get_context("spawn"),
+            initializer=init_worker,
+            initargs=(arrays_path, DB_PATH),
+        )
+        in_flight: Dict[Future, int] = {}
+        broken = False
+        try:
+            while (source or in_flight) and not broken:
+                while source and len(in_flight) < workers:
+                    ci = source.popleft()
+                    try:
+                        in_flight[pool.submit(evaluate_chunk, chunks[ci], config_key)] = ci
+                    except BrokenProcessPool:
+                        # the pool broke before this chunk was sent
+                        source.appendleft(ci)
+                        broken = True
+                        break
+                if broken:
+                    break
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for fut in done:
+                    ci = in_flight.pop(fut)
+                    try:
+                        records = fut.result()
+                    except BrokenProcessPool as e:
+                        broken = True
+                        if isolated:
+                            chunk_failed(ci, e)
+                        else:
+                            suspects.append(ci)
+                        continue
+                    except Exception as e:
+                        chunk_failed(ci, e)
+                        continue
+                    write(records)
+        except KeyboardInterrupt:
+            pool.shutdown(wait=False, cancel_futures=True)
+            raise
+        pool.shutdown(wait=True, cancel_futures=True)
+        if broken:
+            # the other chunks in flight were lost with the pool, not failed themselves
+            suspects.extend(in_flight.values())
+            restarts += 1
+            if not isolated:
+                print(f"Worker pool broke; rerunning {len(suspects)} in-flight chunks one at a time")
+    return written, restarts
+
+
+# ----------------------------
+# Report
+# ----------------------------
+def latency_summary(values: List[float]) -> Dict[str, float]:
+    if not values:
+        return {"count": 0}
+    a = np.asarray(values, dtype=np.float64)
+    out = {"count": int(a.size), "mean_ms": round(float(a.mean()), 3)}
+    out.update({f"p{p}_ms": round(float(np.percentile(a, p)), 3) for p in PERCENTILES})
+    out["max_ms"] = round(float(a.max()), 3)
+    return out
+
+
+def summarize(latest: Dict[int, Tuple[int, Dict[str, Any]]], n_prompts: int) -> Dict[str, Any]:
+    recs = [rec for _, rec in latest.values()]
+    ok = [r for r in recs if "error" not in r]
+    fallbacks = sum(1 for r in ok if r.get("fallback_used"))
+    return {
+        "prompts": n_prompts,
+        "evaluated": len(ok),
+        "errors": len(recs) - len(ok),
+        "missing": n_prompts - len(recs),
+        "fallback_used": fallbacks,
+        "fallback_rate": round(fallbacks / len(ok), 4) if ok else None,
+        "latency": {
+            stage: latency_summary([r["ms"][stage] for r in ok])
+            for stage in ("slot_fill", "retrieval_amortized", "total_amortized")
+        },
+        "worker_pids": sorted({r["pid"] for r in recs if "pid" in r}),
+    }
+
+
+def write_text_report(path: str, latest: Dict[int, Tuple[int, Dict[str, Any]]], n_prompts: int) -> None:
+    # evaluator.py's format, in prompt order, read case by case from the results file
+    with open(RESULTS_FILE, "rb") as src, open(path, "w", encoding="utf-8") as out:
+        out.write("BATCH EVALUATION OUTPUT\n")
+        for case in range(1, n_prompts + 1):
+            if case not in latest:
+                continue
+            offset, _ = latest[case]
+            src.seek(offset)
+            rec = json.loads(src.readline())
+            text = rec.get("text") or f"{'=' * 80}\nPROMPT: {rec['prompt']}\nERROR: {rec['error']}\n"
+            out.write(f"\nTEST CASE {case}\n{text}")
+
+
+def main() -> None:
+    prompts = load_prompts(PROMPTS_FILE)
+    res = ChatResources.load()
+    config_key = run_config_key(res)
+
+    latest = latest_records(RESULTS_FILE, prompts, config_key)
+    pending = [
+        (case, prompt) for case, prompt in enumerate(prompts, 1)
+        if case not in latest or (RETRY_ERRORS and "error" in latest[case][1])
+    ]
+    print(f"Loaded {len(prompts)} prompts from {PROMPTS_FILE}: {len(prompts) - len(pending)} already in {RESULTS_FILE}, "
+          f"{len(pending)} to run on {min(WORKERS, max(1, len(pending)))} workers")
+
+    started = time.perf_counter()
+    restarts = 0
+    if pending:
+        arrays_path = publish_resources(res)
+        try:
+            with open_for_append(RESULTS_FILE) as out:
+                _, restarts = run_pending(pending, arrays_path, config_key, out)
+        finally:
+            os.remove(arrays_path)
+    res.close()
+    wall_s = time.perf_counter() - started
+
+    latest = latest_records(RESULTS_FILE, prompts, config_key)
+    summary = summarize(latest, len(prompts))
+    summary.update({
+        "run": {"ran": len(pending), "wall_s": round(wall_s, 3), "workers": WORKERS, "chunk_size": CHUNK_SIZE, "pool_restarts": restarts},
+        "config": config_key,
+        "results_file": RESULTS_FILE,
+    })
+    write_text_report(str(OUTPUT_FILE), latest, len(prompts))
+    Path(SUMMARY_FILE).parent.mkdir(parents=True, exist_ok=True)
+    Path(SUMMARY_FILE).write_text(json.dumps(summary, indent=2), encoding="utf-8")
+
+    print(f"\n{summary['evaluated']}/{len(prompts)} evaluated, {summary['errors']} errors, {summary['missing']} missing; "
+          f"FALLBACK_USED {summary['fallback_used']} ({(summary['fallback_rate'] or 0) * 100:.1f}%)")
+    print(f"Ran {len(pending)} cases in {wall_s:.2f}s")
+    print(f"\n{'stage':<20}{'n':>6}{'mean':>10}{'p50':>10}{'p95':>10}{'p99':>10}{'max':>10}")
+    for stage, s in summary["latency"].items():
+        if s["count"]:
+            print(f"{stage:<20}{s['count']:>6}{s['mean_ms']:>10.2f}{s['p50_ms']:>10.2f}{s['p95_ms']:>10.2f}{s['p99_ms']:>10.2f}{s['max_ms']:>10.2f}")
+    print(f"\nSaved evaluation output to: {OUTPUT_FILE}")
+    print(f"Saved summary to: {SUMMARY_FILE}")
+
+
+if __name__ == "__main__":
+    main()
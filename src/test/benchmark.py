@@ -0,0 +1,383 @@
+import json
+import os
+import platform
+import re
+import resource
+import subprocess
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+# Stage-level benchmark over the prompts.txt corpus with a deterministic stand-in for the LLM:
+# every stage is run WARMUP_PASSES times over all prompts untimed, then REPEATS times timed per call
+# (p50/p95/p99), then once more under tracemalloc for its peak Python/numpy allocation.
+# Index load (catalog side of ChatResources.load) and cold start (fresh interpreter -> first ranked
+# result) are timed separately. Results are saved as JSON under OUTPUT_DIR; with BASELINE_FILE set,
+# stages whose p95 got slower than REGRESSION_TOLERANCE fail the run (exit code 1).
+# Run from the repo root: python src/test/benchmark.py
+CURRENT_DIR = Path(__file__).resolve().parent
+PROJECT_ROOT = CURRENT_DIR.parents[1]
+SRC_DIR = PROJECT_ROOT / "src"
+
+if str(PROJECT_ROOT) not in sys.path:
+    sys.path.insert(0, str(PROJECT_ROOT))
+if str(SRC_DIR) not in sys.path:
+    sys.path.insert(0, str(SRC_DIR))
+if str(SRC_DIR / "database") not in sys.path:
+    sys.path.insert(0, str(SRC_DIR / "database"))
+
+import numpy as np
+
+from chatbot import chatbot_runner
+from chatbot.chatbot_runner import (
+    DB_PATH,
+    DOMAIN_KEYWORDS,
+    ChatResources,
+    catalog_version,
+    map_llm_keywords_to_domain,
+    parse_filters,
+    production_query,
+    retrieve_and_rank_hybrid,
+)
+from evaluator import PROMPTS_FILE, RETRIEVAL_PARAMS, fill_state, load_prompts
+from synth_catalog import catalog_paths
+
+DATA_DIR = "data"
+OUTPUT_DIR = "data/benchmarks"
+BASELINE_FILE: Optional[str] = None  # e.g. "data/benchmarks/bench-20260101T120000.json"
+
+WARMUP_PASSES = 1
+REPEATS = 5
+COLD_START_RUNS = 3
+INDEX_LOAD_RUNS = 5
+
+# a stage regresses if its p95 is more than this fraction slower than the baseline's (and by at least MIN_DELTA_MS)
+REGRESSION_TOLERANCE = 0.15
+MIN_DELTA_MS = 0.05
+
+# catalog-size sweep over the synthetic catalogs of src/database/synth_catalog.py (generate them first);
+# empty: benchmark the catalog at DB_PATH only. Every call gets slower on large catalogs, so a sweep
+# runs fewer prompts and passes
+SWEEP_SIZES: List[int] = []  # e.g. [10_000, 100_000, 1_000_000]
+SWEEP_PROMPTS = 20
+SWEEP_REPEATS = 2
+
+PERCENTILES = (50, 95, 99)
+
+
+# ----------------------------
+# Deterministic LLM stand-in
+# ----------------------------
+USE_CASE_WORDS = {
+    "school": "school", "class": "school", "campus": "school",
+    "travel": "travel", "trip": "travel", "flight": "travel",
+    "extreme": "extreme_cold", "arctic": "extreme_cold", "expedition": "extreme_cold",
+    "rain": "rain", "rainy": "rain", "wet": "rain",
+    "everyday": "everyday", "daily": "everyday", "casual": "everyday",
+    "work": "work", "office": "work", "commuting": "work",
+}
+DOMAIN_WORDS = {kw.replace("_", " "): kw for kw in DOMAIN_KEYWORDS}
+
+
+def stub_slots(message: str) -> Dict[str, Any]:
+    # what the slot-filling LLM should extract from message, by regexes (same answer for the same message)
+    msg = message.lower()
+    pmin, pmax, gender = parse_filters(msg)
+    words = re.findall(r"[a-z]+", msg)
+    use_case = next((USE_CASE_WORDS[w] for w in words if w in USE_CASE_WORDS), None)
+    keywords = [kw for phrase, kw in DOMAIN_WORDS.items() if re.search(rf"\b{re.escape(phrase)}\b", msg)]
+    return {
+        "price_min": pmin,
+        "price_max": pmax,
+        "gender": gender,
+        "tei": None,
+        "use_case": use_case,
+        "waterproof": True if "waterproof" in words else None,
+        "windproof": True if "windproof" in words else None,
+        "keywords": keywords,
+    }
+
+
+def stub_llm(system: str, user_payload: str, *, max_new_tokens: int, temperature: float, stage: str) -> str:
+    """
+    Replaces chatbot_runner._run_llm: stub_slots() of the latest message as JSON for slot filling,
+    a fixed follow-up question otherwise.
+    """
+    if stage != "slot_fill":
+        return "What will you mainly use it for?"
+    return json.dumps(stub_slots(json.loads(user_payload)["latest_user_message"]))
+
+
+# ----------------------------
+# Timing
+# ----------------------------
+def latency_stats(samples_ms: Sequence[float]) -> Dict[str, float]:
+    a = np.asarray(samples_ms, dtype=np.float64)
+    out = {"calls": int(a.size), "mean_ms": round(float(a.mean()), 4)}
+    out.update({f"p{p}_ms": round(float(np.percentile(a, p)), 4) for p in PERCENTILES})
+    out["min_ms"] = round(float(a.min()), 4)
+    out["max_ms"] = round(float(a.max()), 4)
+    out["calls_per_s"] = round(1000.0 / max(1e-9, float(a.mean())), 2)
+    return out
+
+
+def bench_stage(fn: Callable[[Any], Any], inputs: Sequence[Any], warmup: int = WARMUP_PASSES, repeats: int = REPEATS) -> Dict[str, Any]:
+    """
+    fn(x) for every x in inputs: warmup untimed passes, repeats timed passes (one sample per call),
+    then one pass under tracemalloc for the peak allocation of a single call.
+    """
+    for _ in range(warmup):
+        for x in inputs:
+            fn(x)
+
+    samples: List[float] = []
+    for _ in range(repeats):
+        for x in inputs:
+            t0 = time.perf_counter_ns()
+            fn(x)
+            samples.append((time.perf_counter_ns() - t0) / 1e6)
+
+    peak = 0
+    tracemalloc.start()
+    try:
+        for x in inputs:
+            tracemalloc.reset_peak()
+            fn(x)
+            peak = max(peak, tracemalloc.get_traced_memory()[1])
+    finally:
+        tracemalloc.stop()
+
+    stats = latency_stats(samples)
+    stats["peak_alloc_kib"] = round(peak / 1024, 1)
+    return stats
+
+
+def rss_kib(ru_maxrss: int) -> int:
+    # ru_maxrss is KiB on Linux, bytes on macOS
+    return int(ru_maxrss / 1024) if sys.platform == "darwin" else int(ru_maxrss)
+
+
+def peak_rss_kib() -> int:
+    return rss_kib(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+
+
+COLD_START_SCRIPT = """
+import json, resource, sys, time
+t0 = time.perf_counter()
+sys.path.insert(0, {src!r})
+from chatbot.chatbot_runner import ChatResources, retrieve_and_rank_hybrid
+t_import = time.perf_counter()
+res = ChatResources.load(db_path={db_path!r}, data_dir={data_dir!r})
+t_load = time.perf_counter()
+retrieve_and_rank_hybrid(conn=res.conn, embedder=res.embedder, desc_index=res.desc_index, user_query={query!r},
+                         kw_matrix=res.kw_matrix, **{params!r})
+t_first = time.perf_counter()
+print(json.dumps({{"import_ms": (t_import - t0) * 1000, "load_ms": (t_load - t_import) * 1000,
+                   "first_query_ms": (t_first - t_load) * 1000,
+                   "ru_maxrss": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss}}))
+"""
+
+
+def bench_cold_start(db_path: str, data_dir: str, query: str, runs: int = COLD_START_RUNS) -> Dict[str, Any]:
+    """
+    Fresh interpreter -> imports -> ChatResources.load() -> first ranked result, runs times.
+    The OS page cache stays warm between runs (model weights and catalog files are not re-read from disk).
+    """
+    script = COLD_START_SCRIPT.format(src=str(SRC_DIR), db_path=db_path, data_dir=data_dir, query=query, params=RETRIEVAL_PARAMS)
+    wall: List[float] = []
+    parts: Dict[str, List[float]] = {"import_ms": [], "load_ms": [], "first_query_ms": []}
+    rss: List[int] = []
+    for _ in range(runs):
+        t0 = time.perf_counter()
+        proc = subprocess.run([sys.executable, "-c", script], capture_output=True, text=True, check=True)
+        wall.append((time.perf_counter() - t0) * 1000.0)
+        child = json.loads(proc.stdout.strip().splitlines()[-1])
+        for k in parts:
+            parts[k].append(child[k])
+        rss.append(rss_kib(child["ru_maxrss"]))
+
+    stats = latency_stats(wall)
+    stats.update({k: round(float(np.median(v)), 3) for k, v in parts.items()})
+    stats["peak_rss_kib"] = max(rss)
+    return stats
+
+
+# ----------------------------
+# Suite
+# ----------------------------
+def run_benchmark(
+    prompts: List[str],
+    db_path: str = DB_PATH,
+    data_dir: str = DATA_DIR,
+    warmup: int = WARMUP_PASSES,
+    repeats: int = REPEATS,
+) -> Dict[str, Any]:
+    """
+    Benchmark every stage against the catalog in db_path / data_dir; returns the JSON-ready result.
+    """
+    chatbot_runner._run_llm = stub_llm
+    chatbot_runner.TRACE_PATH = None
+
+    res = ChatResources.load(db_path=db_path, data_dir=data_dir)
+    emb, desc_index = res.embedder, res.desc_index
+    n_products = res.conn.execute("SELECT COUNT(*) FROM products").fetchone()[0]
+
+    # stage inputs, from the stub slot filling
+    filled = [fill_state(p, emb) for p in prompts]
+    states = [state for (state, _, _) in filled]
+    queries = [production_query(state, p)[0] for p, state in zip(prompts, states)]
+    raw_keywords = [stub_slots(p)["keywords"] for p in prompts]
+    retrieval_inputs: List[Tuple[str, Any]] = list(zip(prompts, states))
+
+    # the query vector (if a composer is configured) is built per call, as ChatSession does per turn
+    def retrieve(x: Tuple[str, Any]) -> Any:
+        prompt, state = x
+        query, query_vec = production_query(state, prompt, res.composer)
+        return retrieve_and_rank_hybrid(
+            conn=res.conn,
+            embedder=emb,
+            desc_index=desc_index,
+            user_query=query,
+            price_min=state.price_min,
+            price_max=state.price_max,
+            gender=state.gender,
+            kw_matrix=res.kw_matrix,
+            query_vec=query_vec,
+            **RETRIEVAL_PARAMS,
+        )
+
+    stages: Dict[str, Dict[str, Any]] = {}
+    passes = {"warmup": warmup, "repeats": repeats}
+    stages["parse_filters"] = bench_stage(parse_filters, prompts, **passes)
+    stages["slot_fill_stub_llm"] = bench_stage(lambda p: fill_state(p, emb), prompts, **passes)
+    stages["keyword_match"] = bench_stage(
+        lambda q: emb.match(q, top_k=RETRIEVAL_PARAMS["top_keywords"], threshold=RETRIEVAL_PARAMS["kw_threshold"]), queries, **passes,
+    )
+    stages["map_llm_keywords"] = bench_stage(lambda kws: map_llm_keywords_to_domain(emb, kws, sim_threshold=0.6), raw_keywords, **passes)
+    stages["description_search"] = bench_stage(
+        lambda q: desc_index.search(q, top_k=RETRIEVAL_PARAMS["candidate_limit"]), queries, **passes,
+    )
+    stages["retrieve_and_rank_hybrid"] = bench_stage(retrieve, retrieval_inputs, **passes)
+
+    # catalog side of a (re)load: description vectors from disk, keyword matrix, facets; the encoders are reused
+    def index_load(_: Any) -> None:
+        ChatResources.load(db_path=db_path, data_dir=data_dir, models=res).close()
+
+    stages["index_load"] = bench_stage(index_load, [None], warmup=1, repeats=INDEX_LOAD_RUNS)
+    stages["cold_start"] = bench_cold_start(db_path, data_dir, queries[0])
+
+    catalog = {"db_path": db_path, "data_dir": data_dir, "products": n_products, "version": catalog_version(res.conn)}
+    res.close()
+    return {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "git_commit": git_commit(),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "machine": platform.machine(),
+        "catalog": catalog,
+        "prompts": len(prompts),
+        "config": {"warmup_passes": warmup, "repeats": repeats, "retrieval": RETRIEVAL_PARAMS},
+        "stages": stages,
+        "peak_rss_kib": peak_rss_kib(),
+    }
+
+
+def git_commit() -> Optional[str]:
+    try:
+        out = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=PROJECT_ROOT, capture_output=True, text=True, check=True)
+        return out.stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+# ----------------------------
+# Baseline comparison
+# ----------------------------
+def baseline_run(baseline: Dict[str, Any], result: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    # the baseline run on the same catalog size (a single-run baseline is compared with any run)
+    runs = baseline.get("runs", [baseline])
+    same = [r for r in runs if r["catalog"]["products"] == result["catalog"]["products"]]
+    return same[0] if same else (runs[0] if len(runs) == 1 else None)
+
+
+def compare(result: Dict[str, Any], baseline: Dict[str, Any]) -> List[str]:
+    """
+    Messages for every stage whose p95 regressed against baseline (empty list: no regression).
+    """
+    if result["catalog"]["products"] != baseline["catalog"]["products"]:
+        print(f"Warning: baseline was run on {baseline['catalog']['products']} products, this run on {result['catalog']['products']}.")
+
+    regressions = []
+    size = result["catalog"]["products"]
+    for name, new in result["stages"].items():
+        old = baseline["stages"].get(name)
+        if old is None:
+            continue
+        delta = new["p95_ms"] - old["p95_ms"]
+        if delta > MIN_DELTA_MS and new["p95_ms"] > old["p95_ms"] * (1.0 + REGRESSION_TOLERANCE):
+            regressions.append(f"{name} ({size} products): p95 {old['p95_ms']:.3f} -> {new['p95_ms']:.3f} ms ({new['p95_ms'] / old['p95_ms'] - 1:+.0%})")
+    return regressions
+
+
+def print_table(result: Dict[str, Any], baseline: Optional[Dict[str, Any]] = None) -> None:
+    print(f"\n{'stage':<26}{'calls':>7}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'peak KiB':>11}{'base p95':>10}")
+    for name, s in result["stages"].items():
+        peak = s.get("peak_alloc_kib", s.get("peak_rss_kib", 0))
+        base = baseline["stages"].get(name, {}).get("p95_ms") if baseline else None
+        base_txt = f"{base:>10.3f}" if base is not None else f"{'-':>10}"
+        print(f"{name:<26}{s['calls']:>7}{s['p50_ms']:>10.3f}{s['p95_ms']:>10.3f}{s['p99_ms']:>10.3f}{peak:>11.1f}{base_txt}")
+    print(f"\nCatalog: {result['catalog']['products']} products, peak RSS {result['peak_rss_kib'] / 1024:.1f} MiB")
+
+
+def print_sweep(runs: List[Dict[str, Any]]) -> None:
+    sizes = [r["catalog"]["products"] for r in runs]
+    print("\np95 ms by catalog size")
+    print(f"{'stage':<26}" + "".join(f"{n:>12}" for n in sizes))
+    for name in runs[0]["stages"]:
+        print(f"{name:<26}" + "".join(f"{r['stages'][name]['p95_ms']:>12.3f}" for r in runs))
+    print(f"{'peak RSS MiB':<26}" + "".join(f"{r['peak_rss_kib'] / 1024:>12.1f}" for r in runs))
+
+
+def main() -> None:
+    prompts = load_prompts(PROMPTS_FILE)
+    baseline = json.loads(Path(BASELINE_FILE).read_text(encoding="utf-8")) if BASELINE_FILE else None
+
+    if SWEEP_SIZES:
+        prompts = prompts[:SWEEP_PROMPTS]
+        runs = []
+        for n in SWEEP_SIZES:
+            db_path, data_dir = catalog_paths(n)
+            print(f"Benchmarking {len(prompts)} prompts on {db_path} ({WARMUP_PASSES} warm-up + {SWEEP_REPEATS} timed passes)")
+            runs.append(run_benchmark(prompts, db_path, data_dir, repeats=SWEEP_REPEATS))
+            print_table(runs[-1], baseline_run(baseline, runs[-1]) if baseline else None)
+        print_sweep(runs)
+        output: Dict[str, Any] = {"sweep": SWEEP_SIZES, "runs": runs}
+    else:
+        print(f"Benchmarking {len(prompts)} prompts from {PROMPTS_FILE} ({WARMUP_PASSES} warm-up + {REPEATS} timed passes)")
+        runs = [run_benchmark(prompts)]
+        print_table(runs[0], baseline)
+        output = runs[0]
+
+    os.makedirs(OUTPUT_DIR, exist_ok=True)
+    out_path = Path(OUTPUT_DIR) / f"bench-{time.strftime('%Y%m%dT%H%M%S')}.json"
+    out_path.write_text(json.dumps(output, indent=2), encoding="utf-8")
+    print(f"Saved benchmark results to: {out_path}")
+
+    if baseline is not None:
+        regressions = []
+        for run in runs:
+            base = baseline_run(baseline, run)
+            if base is not None:
+                regressions.extend(compare(run, base))
+        if regressions:
+            print("\nRegressions against " + BASELINE_FILE + ":")
+            for r in regressions:
+                print(f"  {r}")
+            raise SystemExit(1)
+        print(f"\nNo regressions against {BASELINE_FILE}")
+
+
+if __name__ == "__main__":
+    main()
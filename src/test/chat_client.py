@@ -0,0 +1,107 @@
+import asyncio
+import json
+import statistics
+import time
+from pathlib import Path
+from typing import Dict, List
+from urllib.parse import urlparse
+
+import aiohttp
+
+# Local test client for chatbot/server.py: runs concurrent conversations over HTTP or WebSocket
+# and prints per-turn latency. Start the server first: PYTHONPATH=src python -m chatbot.server
+CURRENT_DIR = Path(__file__).resolve().parent
+PROMPTS_FILE = CURRENT_DIR / "prompts.txt"
+
+SERVER_URL = "http://127.0.0.1:8080"
+N_SESSIONS = 8
+TURNS_PER_SESSION = 4
+USE_WEBSOCKET = False
+
+# follow-up messages so the conversation gets past the slot-filling questions
+FOLLOW_UPS = ["everyday", "for men", "under 1000", "more"]
+
+
+def load_prompts(path: Path) -> List[str]:
+    return [
+        line.strip()
+        for line in path.read_text(encoding="utf-8").splitlines()
+        if line.strip() and not line.strip().startswith("#")
+    ]
+
+
+def check_local(url: str) -> None:
+    host = urlparse(url).hostname
+    if host not in {"127.0.0.1", "localhost", "::1"}:
+        raise SystemExit(f"Refusing to run against non-local server: {url}")
+
+
+def percentile(values: List[float], p: float) -> float:
+    s = sorted(values)
+    if not s:
+        return 0.0
+    return s[min(len(s) - 1, int(round(p / 100.0 * (len(s) - 1))))]
+
+
+async def http_conversation(http: aiohttp.ClientSession, messages: List[str]) -> List[float]:
+    latencies = []
+    sid = None
+    for m in messages:
+        t0 = time.perf_counter()
+        async with http.post(f"{SERVER_URL}/chat", json={"session_id": sid, "message": m}) as resp:
+            resp.raise_for_status()
+            data = await resp.json()
+        latencies.append((time.perf_counter() - t0) * 1000.0)
+        sid = data["session_id"]
+    async with http.delete(f"{SERVER_URL}/sessions/{sid}") as resp:
+        resp.raise_for_status()
+    return latencies
+
+
+async def ws_conversation(http: aiohttp.ClientSession, messages: List[str]) -> List[float]:
+    latencies = []
+    async with http.ws_connect(f"{SERVER_URL}/ws") as ws:
+        hello = await ws.receive_json()
+        for m in messages:
+            t0 = time.perf_counter()
+            await ws.send_str(m)
+            await ws.receive_json()
+            latencies.append((time.perf_counter() - t0) * 1000.0)
+    async with http.delete(f"{SERVER_URL}/sessions/{hello['session_id']}") as resp:
+        resp.raise_for_status()
+    return latencies
+
+
+async def run() -> Dict[str, float]:
+    check_local(SERVER_URL)
+    prompts = load_prompts(PROMPTS_FILE)
+    conversations = [
+        [prompts[i % len(prompts)]] + FOLLOW_UPS[:TURNS_PER_SESSION - 1]
+        for i in range(N_SESSIONS)
+    ]
+
+    run_one = ws_conversation if USE_WEBSOCKET else http_conversation
+    async with aiohttp.ClientSession() as http:
+        t0 = time.perf_counter()
+        per_session = await asyncio.gather(*(run_one(http, msgs) for msgs in conversations))
+        wall = time.perf_counter() - t0
+
+    latencies = [x for s in per_session for x in s]
+    return {
+        "sessions": N_SESSIONS,
+        "turns": len(latencies),
+        "wall_s": round(wall, 3),
+        "turns_per_s": round(len(latencies) / wall, 2) if wall else 0.0,
+        "p50_ms": round(percentile(latencies, 50), 2),
+        "p95_ms": round(percentile(latencies, 95), 2),
+        "max_ms": round(max(latencies), 2) if latencies else 0.0,
+        "mean_ms": round(statistics.fmean(latencies), 2) if latencies else 0.0,
+    }
+
+
+def main():
+    print(json.dumps(asyncio.run(run()), indent=2))
+
+
+if __name__ == "__main__":
+    main()
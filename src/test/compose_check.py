@@ -0,0 +1,116 @@
+import sys
+from pathlib import Path
+from typing import List
+import sqlite3
+
+# ----------------------------
+# Path setup
+# ----------------------------
+CURRENT_DIR = Path(__file__).resolve().parent
+PROJECT_ROOT = CURRENT_DIR.parents[1]
+SRC_DIR = PROJECT_ROOT / "src"
+
+if str(PROJECT_ROOT) not in sys.path:
+    sys.path.insert(0, str(PROJECT_ROOT))
+if str(SRC_DIR) not in sys.path:
+    sys.path.insert(0, str(SRC_DIR))
+
+from chatbot.chatbot_runner import (
+    DB_PATH,
+    KeywordEmbedder,
+    DOMAIN_KEYWORDS,
+    ProductDescriptionEmbedder,
+    ProductKeywordMatrix,
+    ComposedQueryEncoder,
+    production_query,
+    query_components,
+    retrieve_and_rank_hybrid,
+)
+from evaluator import PROMPTS_FILE, RETRIEVAL_PARAMS, load_prompts, fill_state
+
+# Offline check: how closely does ranking with composed query embeddings
+# (cached slot components + message) agree with encoding the full query string?
+TOP_K = 10
+MESSAGE_WEIGHTS = [0.4, 0.5, 0.6, 0.7, 0.8]
+
+
+def overlap_at_k(a: List[int], b: List[int], k: int) -> float:
+    if not a and not b:
+        return 1.0
+    return len(set(a[:k]) & set(b[:k])) / max(1, min(k, max(len(a), len(b))))
+
+
+def main():
+    prompts = load_prompts(PROMPTS_FILE)
+    print(f"\nLoaded {len(prompts)} prompts from {PROMPTS_FILE}\n")
+
+    conn = sqlite3.connect(DB_PATH)
+    conn.row_factory = sqlite3.Row
+
+    emb = KeywordEmbedder(
+        model_name="sentence-transformers/all-MiniLM-L6-v2",
+        cache_dir="data/embeddings",
+        keywords=DOMAIN_KEYWORDS,
+    )
+
+    desc_index = ProductDescriptionEmbedder(data_dir="data")
+    desc_index.ensure_loaded(conn)
+
+    kw_matrix = ProductKeywordMatrix.from_db(conn, emb.tokens)
+    params = {**RETRIEVAL_PARAMS, "return_k": TOP_K}
+
+    cases = []
+    for i, prompt in enumerate(prompts, 1):
+        print(f"Slot filling test case {i}/{len(prompts)}")
+        state, _, _ = fill_state(prompt, emb)
+        full_query, _ = production_query(state, prompt)
+        full, _ = retrieve_and_rank_hybrid(
+            conn=conn,
+            embedder=emb,
+            desc_index=desc_index,
+            user_query=full_query,
+            price_min=state.price_min,
+            price_max=state.price_max,
+            gender=state.gender,
+            kw_matrix=kw_matrix,
+            **params,
+        )
+        cases.append((prompt, state, full_query, [p.id for p in full]))
+
+    print("\nmessage_weight | top1 agree | overlap@5 | overlap@10 | component hit rate")
+    for w in MESSAGE_WEIGHTS:
+        composer = ComposedQueryEncoder(emb.encode_queries, slot_weight=1.0 - w, message_weight=w)
+        top1 = ov5 = ov10 = 0.0
+
+        for prompt, state, full_query, full_ids in cases:
+            vec = composer.encode(query_components(state, include_gender=False), prompt)
+            composed, _ = retrieve_and_rank_hybrid(
+                conn=conn,
+                embedder=emb,
+                desc_index=desc_index,
+                user_query=full_query,
+                price_min=state.price_min,
+                price_max=state.price_max,
+                gender=state.gender,
+                kw_matrix=kw_matrix,
+                query_vec=vec,
+                **params,
+            )
+            comp_ids = [p.id for p in composed]
+
+            top1 += float(full_ids[:1] == comp_ids[:1])
+            ov5 += overlap_at_k(full_ids, comp_ids, 5)
+            ov10 += overlap_at_k(full_ids, comp_ids, 10)
+
+        n = max(1, len(cases))
+        stats = composer.stats()
+        print(
+            f"{w:14.2f} | {top1 / n:10.3f} | {ov5 / n:9.3f} | {ov10 / n:10.3f} | "
+            f"{stats['component_hit_rate']:.3f} ({stats['cached_components']} cached)"
+        )
+
+    conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,6 @@
 import sys
 from pathlib import Path
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Tuple
 import sqlite3
 
 # ----------------------------
@@ -21,13 +21,17 @@ from chatbot.chatbot_runner import (
     KeywordEmbedder,
     DOMAIN_KEYWORDS,
     ProductDescriptionEmbedder,
+    ProductKeywordMatrix,
     local_slot_fill,
     merge_state,
     map_llm_keywords_to_domain,
     parse_filters,
     retrieve_and_rank_hybrid,
-    build_final_query,
+    retrieve_and_rank_hybrid_batch,
+    production_query,
     format_results,
+    COMPOSED_QUERY_EMBEDDINGS,
+    ComposedQueryEncoder,
 )
 
 PROMPTS_FILE = CURRENT_DIR / "prompts.txt"
@@ -67,10 +71,25 @@ def state_to_dict(state: ConversationState) -> Dict[str, Any]:
     }
 
 
+# ----------------------------
+# Retrieval settings (same as chatbot_runner.main)
+# ----------------------------
+RETRIEVAL_PARAMS: Dict[str, Any] = dict(
+    top_keywords=12,
+    kw_threshold=0.42,
+    top_per_product=4,
+    candidate_limit=300,
+    return_k=5,
+    alpha=0.35,
+    beta=0.65,
+    gamma=0.15,
+)
+
+
 # ----------------------------
 # Run one evaluation
 # ----------------------------
-def evaluate_one_prompt(prompt: str, conn, emb, desc_index) -> str:
+def fill_state(prompt: str, emb) -> Tuple[ConversationState, bool, List[Any]]:
     state = ConversationState()
     history = [{"role": "user", "content": prompt}]
 
@@ -99,32 +118,15 @@ def evaluate_one_prompt(prompt: str, conn, emb, desc_index) -> str:
 
         mapping_debug = [("fallback", "fallback", str(e))]
 
-    missing = state.missing_slots()
+    return state, fallback_used, mapping_debug
 
-    final_query = build_final_query(state, prompt)
-
-    results, matched = retrieve_and_rank_hybrid(
-        conn=conn,
-        embedder=emb,
-        desc_index=desc_index,
-        user_query=final_query,
-        price_min=state.price_min,
-        price_max=state.price_max,
-        gender=state.gender,
-        top_keywords=12,
-        kw_threshold=0.42,
-        top_per_product=4,
-        candidate_limit=300,
-        return_k=5,
-        alpha=0.35,
-        beta=0.65,
-    )
 
+def format_case(prompt: str, state: ConversationState, fallback_used: bool, mapping_debug: List[Any], results) -> str:
     lines = []
     lines.append("=" * 80)
     lines.append(f"PROMPT: {prompt}")
     lines.append(f"FALLBACK_USED: {fallback_used}")
-    lines.append(f"MISSING_SLOTS: {missing}")
+    lines.append(f"MISSING_SLOTS: {state.missing_slots()}")
     lines.append(f"STATE: {state_to_dict(state)}")
     lines.append(f"MAPPING: {mapping_debug}")
     lines.append("")
@@ -135,6 +137,27 @@ def evaluate_one_prompt(prompt: str, conn, emb, desc_index) -> str:
     return "\n".join(lines)
 
 
+def evaluate_one_prompt(prompt: str, conn, emb, desc_index, kw_matrix=None, composer=None) -> str:
+    state, fallback_used, mapping_debug = fill_state(prompt, emb)
+
+    final_query, query_vec = production_query(state, prompt, composer)
+
+    results, matched = retrieve_and_rank_hybrid(
+        conn=conn,
+        embedder=emb,
+        desc_index=desc_index,
+        user_query=final_query,
+        price_min=state.price_min,
+        price_max=state.price_max,
+        gender=state.gender,
+        kw_matrix=kw_matrix,
+        query_vec=query_vec,
+        **RETRIEVAL_PARAMS,
+    )
+
+    return format_case(prompt, state, fallback_used, mapping_debug, results)
+
+
 # ----------------------------
 # Main evaluator
 # ----------------------------
@@ -156,15 +179,38 @@ def main():
     desc_index = ProductDescriptionEmbedder(data_dir="data")
     desc_index.ensure_loaded(conn)
 
-    outputs = ["BATCH EVALUATION OUTPUT\n"]
+    kw_matrix = ProductKeywordMatrix.from_db(conn, emb.tokens)
+    composer = ComposedQueryEncoder(emb.encode_queries) if COMPOSED_QUERY_EMBEDDINGS else None
 
+    # slot filling (LLM) runs per prompt; retrieval then runs once for all prompts
+    filled = []
     for i, prompt in enumerate(prompts, 1):
+        print(f"Slot filling test case {i}/{len(prompts)}")
+        filled.append(fill_state(prompt, emb))
+
+    queries = [production_query(state, prompt, composer) for prompt, (state, _, _) in zip(prompts, filled)]
+    batch_results = retrieve_and_rank_hybrid_batch(
+        conn=conn,
+        embedder=emb,
+        desc_index=desc_index,
+        user_queries=[q for q, _ in queries],
+        filters=[(state.price_min, state.price_max, state.gender) for (state, _, _) in filled],
+        kw_matrix=kw_matrix,
+        query_vecs=[v for _, v in queries],
+        **RETRIEVAL_PARAMS,
+    )
+
+    outputs = ["BATCH EVALUATION OUTPUT\n"]
+
+    for i, (prompt, (state, fallback_used, mapping_debug), (results, matched)) in enumerate(
+        zip(prompts, filled, batch_results), 1
+    ):
 
         print(f"\n==============================")
-        print(f"Running test case {i}/{len(prompts)}")
+        print(f"Test case {i}/{len(prompts)}")
         print("==============================\n")
 
-        result_text = evaluate_one_prompt(prompt, conn, emb, desc_index)
+        result_text = format_case(prompt, state, fallback_used, mapping_debug, results)
 
         # print to terminal
         print(result_text)
@@ -182,4 +228,4 @@ def main():
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,488 @@
+import hashlib
+import itertools
+import json
+import sys
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+# Offline tuner for the fusion parameters of retrieve_and_rank_hybrid (alpha, beta, gamma, top_keywords,
+# kw_threshold, top_per_product, candidate_limit) against graded relevance labels.
+# The raw scores of every query are computed once with the real encoders, FTS index and keyword matrix and
+# cached in CACHE_FILE: keyword similarities, the product x keyword rows, description scores and BM25 scores,
+# over the products any grid configuration can reach ("universe"), with the hard-filter mask.
+# Every grid configuration is then replayed from the cache in NumPy: the keyword channel for all queries at
+# once per (top_keywords, kw_threshold, top_per_product), and every weight combination of WEIGHT_GRID in one
+# tensor product per candidate_limit. The replay mirrors _score_channels / _fuse_topk for catalogs up to
+# dense_full_scan_max products (full dense scan); the agreement with retrieve_and_rank_hybrid at
+# RETRIEVAL_PARAMS is checked and the run fails unless it covers every query. Reports the best configurations
+# and the Pareto front of nDCG@K versus candidate depth (candidate_limit) and saves them as JSON.
+# Labels: LABELS_FILE ({prompt: {product id: grade}}), required. The golden rankings of regression_gate.py
+# are only accepted with GOLDEN_LABELS_SMOKE_RUN, and then nothing is tuned: they were produced by
+# RETRIEVAL_PARAMS, so every search against them just finds its way back to the current configuration.
+# Run from the repo root: python src/test/fusion_tuner.py
+CURRENT_DIR = Path(__file__).resolve().parent
+PROJECT_ROOT = CURRENT_DIR.parents[1]
+SRC_DIR = PROJECT_ROOT / "src"
+
+if str(PROJECT_ROOT) not in sys.path:
+    sys.path.insert(0, str(PROJECT_ROOT))
+if str(SRC_DIR) not in sys.path:
+    sys.path.insert(0, str(SRC_DIR))
+
+import numpy as np
+
+from benchmark import stub_llm
+from chatbot import chatbot_runner
+from chatbot.chatbot_runner import (
+    DB_PATH,
+    ChatResources,
+    FilterColumns,
+    catalog_version,
+    lexical_scores,
+    production_query,
+    retrieve_and_rank_hybrid,
+)
+from chatbot.keyword_matrix import to_canonical_kw
+from evaluator import PROMPTS_FILE, RETRIEVAL_PARAMS, fill_state, load_prompts
+from regression_gate import GOLDEN_FILE
+
+LABELS_FILE = CURRENT_DIR / "relevance_labels.json"
+OUTPUT_DIR = "data/tuning"
+CACHE_FILE = "data/tuning/score_cache.npz"
+
+K = 10
+
+# check the cache + replay against golden-ranking labels when LABELS_FILE does not exist yet (no tuning)
+GOLDEN_LABELS_SMOKE_RUN = False
+MAX_MISMATCHES_SHOWN = 10
+
+# structural parameters: the keyword channel is rebuilt per (top_keywords, kw_threshold, top_per_product)
+GRID: Dict[str, List[Any]] = {
+    "top_keywords": [6, 8, 12, 16],
+    "kw_threshold": [0.35, 0.42, 0.5],
+    "top_per_product": [2, 3, 4, 6],
+    "candidate_limit": [25, 50, 100, 200, 300],
+}
+# fusion weights: all combinations are scored together (rankings only depend on the weights' direction,
+# so combinations that are multiples of each other are scored once)
+WEIGHT_GRID: Dict[str, List[float]] = {
+    "alpha": [round(x, 2) for x in np.linspace(0.0, 1.0, 11)],
+    "beta": [round(x, 2) for x in np.linspace(0.0, 1.0, 11)],
+    "gamma": [0.0, 0.05, 0.15, 0.3],
+}
+WEIGHT_CHUNK = 256  # weight combinations per tensor product (bounds memory at chunk x queries x universe)
+
+TOP_SHOWN = 10
+
+# (production query text, [price_min, price_max, gender], composed query vector or None)
+QueryInput = Tuple[str, List[Any], Optional[List[float]]]
+
+
+# ----------------------------
+# Labels and query inputs
+# ----------------------------
+def load_labels() -> Tuple[Dict[str, Dict[int, float]], Dict[str, Dict[str, Any]], str]:
+    """
+    (prompt -> {product id: grade}, prompt -> stored golden case, label source).
+    Golden rankings (GOLDEN_LABELS_SMOKE_RUN only) grade their top-k by rank (#1 = k ... #k = 1).
+    """
+    golden_cases: Dict[str, Dict[str, Any]] = {}
+    golden = None
+    if GOLDEN_FILE.exists():
+        golden = json.loads(GOLDEN_FILE.read_text(encoding="utf-8"))
+        golden_cases = {c["prompt"]: c for c in golden["cases"]}
+
+    if LABELS_FILE.exists():
+        raw = json.loads(LABELS_FILE.read_text(encoding="utf-8"))
+        labels = {p: {int(pid): float(g) for pid, g in grades.items() if float(g) > 0} for p, grades in raw.items()}
+        return labels, golden_cases, str(LABELS_FILE)
+    if golden is not None and GOLDEN_LABELS_SMOKE_RUN:
+        k = golden["k"]
+        labels = {c["prompt"]: {pid: float(k - r) for r, pid in enumerate(c["top"])} for c in golden["cases"]}
+        return labels, golden_cases, str(GOLDEN_FILE)
+    raise FileNotFoundError(
+        f"No relevance labels: write {LABELS_FILE} with judged grades. The golden rankings in {GOLDEN_FILE} "
+        f"come from RETRIEVAL_PARAMS itself and can only be used for a smoke run (GOLDEN_LABELS_SMOKE_RUN)."
+    )
+
+
+def query_inputs(res: ChatResources, prompts: List[str], golden_cases: Dict[str, Dict[str, Any]]) -> List[QueryInput]:
+    # production query per prompt: stored in the golden file, else from stub slot filling
+    chatbot_runner._run_llm = stub_llm
+    out = []
+    for prompt in prompts:
+        case = golden_cases.get(prompt)
+        if case is not None:
+            out.append((case["query"], list(case["filters"]), case.get("query_vec")))
+            continue
+        state, _, _ = fill_state(prompt, res.embedder)
+        query, query_vec = production_query(state, prompt, res.composer)
+        vec = None if query_vec is None else [float(x) for x in query_vec]
+        out.append((query, [state.price_min, state.price_max, state.gender], vec))
+    return out
+
+
+# ----------------------------
+# Raw score cache
+# ----------------------------
+def cache_key(res: ChatResources, inputs: List[QueryInput]) -> str:
+    key = {
+        "inputs": inputs,
+        "catalog_version": catalog_version(res.conn),
+        "db": DB_PATH,
+        "kw_model": res.embedder.model_name,
+        "desc_model": res.desc_index.model_name,
+        "max_top_keywords": max(GRID["top_keywords"]),
+        "min_kw_threshold": min(GRID["kw_threshold"]),
+        "max_candidate_limit": max(GRID["candidate_limit"]),
+    }
+    return hashlib.sha1(json.dumps(key, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def build_score_cache(res: ChatResources, inputs: List[QueryInput]) -> Dict[str, np.ndarray]:
+    """
+    Per query, over its universe (ids ascending, padded to a common width U):
+    ids / valid, allowed (hard filters), kw_rows (U x T keyword weights of each product),
+    desc / desc_rank and lex / lex_rank (rank >= max candidate_limit: outside the channel);
+    plus kw_sim / kw_rank (Q x T) in keyword-matrix column order.
+    """
+    emb, desc_index, m = res.embedder, res.desc_index, res.kw_matrix
+    emb.ensure_loaded()
+    desc_index.ensure_loaded(res.conn)
+    max_tk, min_thr, max_l = max(GRID["top_keywords"]), min(GRID["kw_threshold"]), max(GRID["candidate_limit"])
+    n_tokens = len(m.tokens)
+    col_of = {t: j for j, t in enumerate(m.tokens)}
+    # embedder token -> matrix column (tokens without a column never score)
+    emb_cols = np.array([col_of.get(to_canonical_kw(t), -1) for t in emb.tokens], dtype=np.int64)
+    row_of = {int(pid): r for r, pid in enumerate(m.product_ids.tolist())}
+    dense_rows = np.zeros((len(m.product_ids), n_tokens), dtype=np.float64)
+    for r in range(len(m.product_ids)):
+        lo, hi = m.indptr[r], m.indptr[r + 1]
+        dense_rows[r, m.indices[lo:hi]] = m.data[lo:hi]
+
+    per_query = []
+    for query, (pmin, pmax, gender), vec in inputs:
+        q = (query or "").strip().lower()
+        kw_sim = np.zeros(n_tokens, dtype=np.float64)
+        kw_rank = np.full(n_tokens, 1 << 30, dtype=np.int64)
+        if q:
+            # a composed query vector replaces encoding the text for both channels, as in _score_channels
+            q_kw = emb.encode_query(q) if vec is None else np.asarray(vec, dtype=np.float32)
+            q_desc = desc_index.encode_texts([q])[0] if vec is None else np.asarray(vec, dtype=np.float32)
+            sims = emb._kw_emb @ q_kw
+            order = np.argsort(-sims)  # same order as KeywordEmbedder._matches_from_scores
+            ranks = np.empty(len(sims), dtype=np.int64)
+            ranks[order] = np.arange(len(sims))
+            ok = emb_cols >= 0
+            kw_sim[emb_cols[ok]] = sims[ok]
+            kw_rank[emb_cols[ok]] = ranks[ok]
+            desc_ids, desc_scores = desc_index.score_vector(q_desc, top_k=max_l)
+            lex = lexical_scores(res.conn, q, limit=max_l)
+        else:
+            desc_ids, desc_scores, lex = np.zeros(0, dtype=np.int64), np.zeros(0), {}
+
+        reachable = np.flatnonzero((kw_rank < max_tk) & (kw_sim >= min_thr))
+        kw_ids = m.product_ids[np.flatnonzero(dense_rows[:, reachable].sum(axis=1) > 0)] if len(reachable) else np.zeros(0, dtype=np.int64)
+        universe = np.union1d(np.union1d(kw_ids, desc_ids), np.fromiter(lex.keys(), dtype=np.int64, count=len(lex)))
+        per_query.append((universe, kw_sim, kw_rank, desc_ids, desc_scores, lex, (pmin, pmax, gender)))
+
+    n_q = len(inputs)
+    width = max(1, max(len(u) for u, *_ in per_query))
+    out: Dict[str, np.ndarray] = {
+        "ids": np.full((n_q, width), -1, dtype=np.int64),
+        "valid": np.zeros((n_q, width), dtype=bool),
+        "allowed": np.zeros((n_q, width), dtype=bool),
+        "kw_rows": np.zeros((n_q, width, n_tokens), dtype=np.float64),
+        "kw_sim": np.zeros((n_q, n_tokens), dtype=np.float64),
+        "kw_rank": np.zeros((n_q, n_tokens), dtype=np.int64),
+        "desc": np.zeros((n_q, width), dtype=np.float64),
+        "desc_rank": np.full((n_q, width), 1 << 30, dtype=np.int64),
+        "lex": np.zeros((n_q, width), dtype=np.float64),
+        "lex_rank": np.full((n_q, width), 1 << 30, dtype=np.int64),
+    }
+    for i, (universe, kw_sim, kw_rank, desc_ids, desc_scores, lex, filters) in enumerate(per_query):
+        n = len(universe)
+        out["ids"][i, :n] = universe
+        out["valid"][i, :n] = True
+        out["kw_sim"][i] = kw_sim
+        out["kw_rank"][i] = kw_rank
+        if n == 0:
+            continue
+        out["allowed"][i, :n] = FilterColumns.fetch(res.conn, universe).mask(*filters)
+        rows = [row_of.get(int(pid)) for pid in universe]
+        for j, r in enumerate(rows):
+            if r is not None:
+                out["kw_rows"][i, j] = dense_rows[r]
+        pos = np.searchsorted(universe, desc_ids)
+        out["desc"][i, pos] = desc_scores
+        out["desc_rank"][i, pos] = np.arange(len(desc_ids))
+        if lex:
+            lex_ids = np.fromiter(lex.keys(), dtype=np.int64, count=len(lex))
+            pos = np.searchsorted(universe, lex_ids)
+            out["lex"][i, pos] = np.fromiter(lex.values(), dtype=np.float64, count=len(lex))
+            out["lex_rank"][i, pos] = np.arange(len(lex))  # lexical_scores returns best first
+    return out
+
+
+def load_or_build_cache(res: ChatResources, inputs: List[QueryInput]) -> Tuple[Dict[str, np.ndarray], bool]:
+    key = cache_key(res, inputs)
+    path = Path(CACHE_FILE)
+    if path.exists():
+        with np.load(path, allow_pickle=False) as z:
+            if str(z["key"]) == key:
+                return {name: z[name] for name in z.files if name != "key"}, True
+    cache = build_score_cache(res, inputs)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    np.savez_compressed(path, key=np.array(key), **cache)
+    return cache, False
+
+
+# ----------------------------
+# Vectorized replay
+# ----------------------------
+def weight_grid() -> np.ndarray:
+    # (G, 3) alpha/beta/gamma rows, one per ranking-distinct direction (first occurrence kept)
+    seen = set()
+    rows = []
+    for a, b, g in itertools.product(WEIGHT_GRID["alpha"], WEIGHT_GRID["beta"], WEIGHT_GRID["gamma"]):
+        total = a + b + g
+        if total <= 0:
+            continue
+        direction = (round(a / total, 6), round(b / total, 6), round(g / total, 6))
+        if direction not in seen:
+            seen.add(direction)
+            rows.append((a, b, g))
+    return np.array(rows, dtype=np.float64)
+
+
+def keyword_scores(cache: Dict[str, np.ndarray], top_keywords: int, kw_threshold: float) -> np.ndarray:
+    """
+    (Q, U, T) cumulative keyword scores: [..., n - 1] is the keyword channel with top_per_product = n
+    (sum of the n best matched keyword weights of each product, as ProductKeywordMatrix.scores).
+    """
+    matched = (cache["kw_rank"] < max(1, top_keywords)) & (cache["kw_sim"] >= kw_threshold)
+    qv = np.where(matched, cache["kw_sim"], 0.0)
+    vals = cache["kw_rows"] * qv[:, None, :]
+    vals = np.where(vals > 0, vals, 0.0)
+    return np.cumsum(-np.sort(-vals, axis=2), axis=2)
+
+
+def relevance_arrays(cache: Dict[str, np.ndarray], labels: List[Dict[int, float]], k: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    # (Q, U) gains over each universe, ideal DCG@k and min(#relevant, k) per query
+    gains = np.zeros(cache["ids"].shape, dtype=np.float64)
+    for i, grades in enumerate(labels):
+        gains[i] = [grades.get(int(pid), 0.0) for pid in cache["ids"][i]]
+    discounts = 1.0 / np.log2(np.arange(2, k + 2))
+    ideal = np.array([
+        sum(g * d for g, d in zip(sorted(grades.values(), reverse=True)[:k], discounts)) for grades in labels
+    ])
+    n_rel = np.array([min(len(grades), k) for grades in labels], dtype=np.float64)
+    return gains, ideal, n_rel
+
+
+def top_k_positions(fused: np.ndarray, k: int) -> np.ndarray:
+    # (..., k) universe positions of the k best scores, best first; ties keep ascending id (= position)
+    u = fused.shape[-1]
+    if k < u:
+        part = np.argpartition(-fused, k - 1, axis=-1)[..., :k]
+    else:
+        part = np.broadcast_to(np.arange(u), fused.shape).copy()
+    part_scores = np.take_along_axis(fused, part, axis=-1)
+    order = np.lexsort((part, -part_scores), axis=-1)
+    return np.take_along_axis(part, order, axis=-1)
+
+
+def score_grid(cache: Dict[str, np.ndarray], labels: List[Dict[int, float]], weights: np.ndarray, k: int) -> List[Dict[str, Any]]:
+    """
+    Mean nDCG@k / recall@k (and mean candidates per query) of every GRID x weights configuration.
+    """
+    gains, ideal, n_rel = relevance_arrays(cache, labels, k)
+    has_labels = ideal > 0
+    discounts = 1.0 / np.log2(np.arange(2, k + 2))
+    q_idx = np.arange(len(labels))[None, :, None]
+    results: List[Dict[str, Any]] = []
+
+    for top_keywords, kw_threshold in itertools.product(GRID["top_keywords"], GRID["kw_threshold"]):
+        cum = keyword_scores(cache, top_keywords, kw_threshold)
+        for top_per_product in GRID["top_per_product"]:
+            n = min(top_per_product, cum.shape[2])
+            kw = cum[:, :, n - 1] if n > 0 else np.zeros(cache["ids"].shape)
+            kw_max = kw.max(axis=1, keepdims=True)
+            kw_part = kw / np.where(kw_max > 0, kw_max, 1.0)
+
+            for limit in GRID["candidate_limit"]:
+                desc_in = cache["desc_rank"] < limit
+                lex_in = cache["lex_rank"] < limit
+                lex = np.where(lex_in, cache["lex"], 0.0)
+                lex_max = lex.max(axis=1, keepdims=True)
+                channels = np.stack([kw_part, np.where(desc_in, cache["desc"], 0.0), lex / np.where(lex_max > 0, lex_max, 1.0)])
+                candidate = ((kw > 0) | desc_in | lex_in) & cache["allowed"]
+                n_candidates = float(((kw > 0) | desc_in | lex_in).sum(axis=1).mean())
+
+                for start in range(0, len(weights), WEIGHT_CHUNK):
+                    w = weights[start:start + WEIGHT_CHUNK]
+                    fused = np.einsum("gc,cqu->gqu", w, channels)
+                    fused = np.where(candidate[None], fused, -np.inf)
+                    top = top_k_positions(fused, k)
+                    hit = np.isfinite(np.take_along_axis(fused, top, axis=-1))
+                    g = np.where(hit, gains[q_idx, top], 0.0)
+                    ndcg = np.where(has_labels, (g * discounts[:g.shape[-1]]).sum(axis=-1) / np.where(has_labels, ideal, 1.0), 0.0)
+                    recall = (g > 0).sum(axis=-1) / np.maximum(n_rel, 1.0)
+                    mean_ndcg = ndcg[:, has_labels].mean(axis=1) if has_labels.any() else np.zeros(len(w))
+                    mean_recall = recall[:, has_labels].mean(axis=1) if has_labels.any() else np.zeros(len(w))
+                    for (a, b, c), nd, rc in zip(w.tolist(), mean_ndcg.tolist(), mean_recall.tolist()):
+                        results.append({
+                            "alpha": a, "beta": b, "gamma": c,
+                            "top_keywords": top_keywords, "kw_threshold": kw_threshold,
+                            "top_per_product": top_per_product, "candidate_limit": limit,
+                            "ndcg": round(nd, 5), "recall": round(rc, 5), "candidates": round(n_candidates, 1),
+                        })
+    return results
+
+
+def replay_rankings(cache: Dict[str, np.ndarray], params: Dict[str, Any], k: int) -> Tuple[List[List[int]], float]:
+    # top-k ids of one configuration from the cache (for the agreement check) and its mean candidates per query
+    cum = keyword_scores(cache, params["top_keywords"], params["kw_threshold"])
+    n = min(params["top_per_product"], cum.shape[2])
+    kw = cum[:, :, n - 1] if n > 0 else np.zeros(cache["ids"].shape)
+    kw_max = kw.max(axis=1, keepdims=True)
+    desc_in = cache["desc_rank"] < params["candidate_limit"]
+    lex_in = cache["lex_rank"] < params["candidate_limit"]
+    lex = np.where(lex_in, cache["lex"], 0.0)
+    lex_max = lex.max(axis=1, keepdims=True)
+    fused = (params["alpha"] * kw / np.where(kw_max > 0, kw_max, 1.0)
+             + params["beta"] * np.where(desc_in, cache["desc"], 0.0)
+             + params["gamma"] * lex / np.where(lex_max > 0, lex_max, 1.0))
+    in_channels = (kw > 0) | desc_in | lex_in
+    fused = np.where(in_channels & cache["allowed"], fused, -np.inf)
+    top = top_k_positions(fused, k)
+    hit = np.isfinite(np.take_along_axis(fused, top, axis=-1))
+    ids = np.take_along_axis(cache["ids"], top, axis=-1)
+    return [row[mask].tolist() for row, mask in zip(ids, hit)], float(in_channels.sum(axis=1).mean())
+
+
+def ranking_metrics(rankings: List[List[int]], labels: List[Dict[int, float]], k: int) -> Tuple[float, float]:
+    # mean nDCG@k and recall@k over the labelled queries
+    discounts = 1.0 / np.log2(np.arange(2, k + 2))
+    ndcg, recall = [], []
+    for ids, grades in zip(rankings, labels):
+        if not grades:
+            continue
+        ideal = sum(g * d for g, d in zip(sorted(grades.values(), reverse=True)[:k], discounts))
+        gains = [grades.get(pid, 0.0) for pid in ids[:k]]
+        ndcg.append(sum(g * d for g, d in zip(gains, discounts)) / ideal)
+        recall.append(sum(1 for g in gains if g > 0) / min(len(grades), k))
+    return (float(np.mean(ndcg)), float(np.mean(recall))) if ndcg else (0.0, 0.0)
+
+
+def pareto_front(results: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    # best nDCG per candidate_limit, kept only where it beats every shallower depth
+    best: Dict[int, Dict[str, Any]] = {}
+    for r in results:
+        cur = best.get(r["candidate_limit"])
+        if cur is None or (r["ndcg"], r["recall"]) > (cur["ndcg"], cur["recall"]):
+            best[r["candidate_limit"]] = r
+    front = []
+    for limit in sorted(best):
+        if not front or best[limit]["ndcg"] > front[-1]["ndcg"]:
+            front.append(best[limit])
+    return front
+
+
+def main() -> None:
+    labels_by_prompt, golden_cases, label_source = load_labels()
+    circular = label_source == str(GOLDEN_FILE)
+    if circular:
+        print("!" * 100)
+        print(f"WARNING: labels come from the golden rankings ({GOLDEN_FILE}), which RETRIEVAL_PARAMS produced.")
+        print("Tuning against them is circular; this smoke run only checks the score cache and replay, no configuration is reported.")
+        print("!" * 100)
+    prompts = [p for p in load_prompts(PROMPTS_FILE) if p in labels_by_prompt]
+    if not prompts:
+        raise SystemExit(f"No prompts.txt prompt has labels in {label_source}.")
+    chatbot_runner.TRACE_PATH = None
+    res = ChatResources.load()
+
+    inputs = query_inputs(res, prompts, golden_cases)
+    t0 = time.perf_counter()
+    cache, cached = load_or_build_cache(res, inputs)
+    cache_s = time.perf_counter() - t0
+    print(f"{len(prompts)} labelled prompts from {label_source}; raw scores "
+          f"{'loaded from' if cached else 'computed and saved to'} {CACHE_FILE} in {cache_s:.2f}s "
+          f"(universe width {cache['ids'].shape[1]})")
+
+    labels = [labels_by_prompt[p] for p in prompts]
+    current = dict(RETRIEVAL_PARAMS)
+    replayed, current_candidates = replay_rankings(cache, current, K)
+    agree = []
+    for (query, (pmin, pmax, gender), vec), ids in zip(inputs, replayed):
+        results, _ = retrieve_and_rank_hybrid(
+            conn=res.conn, embedder=res.embedder, desc_index=res.desc_index, user_query=query,
+            price_min=pmin, price_max=pmax, gender=gender, kw_matrix=res.kw_matrix,
+            query_vec=None if vec is None else np.asarray(vec, dtype=np.float32),
+            **dict(current, return_k=K),
+        )
+        agree.append([p.id for p in results] == ids)
+    res.close()
+    print(f"Replay matches retrieve_and_rank_hybrid at RETRIEVAL_PARAMS for {sum(agree)}/{len(agree)} queries")
+    if not all(agree):
+        # scores of a replay that does not reproduce the current ranking say nothing about the real one
+        for prompt, ok in [(p, ok) for p, ok in zip(prompts, agree) if not ok][:MAX_MISMATCHES_SHOWN]:
+            print(f"  mismatch: {prompt}")
+        print(f"\nFAILED: the replay diverges from retrieve_and_rank_hybrid (stale {CACHE_FILE}, or a "
+              f"_score_channels / _fuse_topk change the replay does not mirror yet)")
+        raise SystemExit(1)
+    if circular:
+        print("\nSmoke run passed; write relevance labels to tune.")
+        return
+
+    weights = weight_grid()
+    n_configs = len(weights) * int(np.prod([len(v) for v in GRID.values()]))
+    t0 = time.perf_counter()
+    results = score_grid(cache, labels, weights, K)
+    grid_s = time.perf_counter() - t0
+    print(f"Scored {n_configs} configurations ({len(weights)} weight directions) in {grid_s:.2f}s")
+
+    results.sort(key=lambda r: (-r["ndcg"], -r["recall"], r["candidate_limit"]))
+    ndcg, recall = ranking_metrics(replayed, labels, K)
+    baseline = {name: current[name] for name in ("alpha", "beta", "gamma", *GRID)}
+    baseline.update({"ndcg": round(ndcg, 5), "recall": round(recall, 5), "candidates": round(current_candidates, 1)})
+    front = pareto_front(results)
+
+    header = f"{'nDCG':>7}{'recall':>8}{'cands':>7}{'alpha':>7}{'beta':>6}{'gamma':>7}{'top_kw':>7}{'kw_thr':>7}{'per_prod':>9}{'limit':>7}"
+
+    def row(r: Dict[str, Any]) -> str:
+        return (f"{r['ndcg']:>7.4f}{r['recall']:>8.4f}{r['candidates']:>7.1f}{r['alpha']:>7.2f}{r['beta']:>6.2f}{r['gamma']:>7.2f}"
+                f"{r['top_keywords']:>7}{r['kw_threshold']:>7.2f}{r['top_per_product']:>9}{r['candidate_limit']:>7}")
+
+    print(f"\nRETRIEVAL_PARAMS:\n{header}\n{row(baseline)}")
+    print(f"\nTop {TOP_SHOWN} by nDCG@{K}:\n{header}")
+    for r in results[:TOP_SHOWN]:
+        print(row(r))
+    print(f"\nPareto front (nDCG@{K} vs candidate_limit):\n{header}")
+    for r in front:
+        print(row(r))
+
+    Path(OUTPUT_DIR).mkdir(parents=True, exist_ok=True)
+    out_path = Path(OUTPUT_DIR) / f"tune-{time.strftime('%Y%m%dT%H%M%S')}.json"
+    out_path.write_text(json.dumps({
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "labels": label_source,
+        "prompts": len(prompts),
+        "k": K,
+        "grid": GRID,
+        "weight_grid": WEIGHT_GRID,
+        "configurations": n_configs,
+        "cache_s": round(cache_s, 3),
+        "grid_s": round(grid_s, 3),
+        "replay_agreement": round(sum(agree) / len(agree), 4),
+        "current": baseline,
+        "pareto_front": front,
+        "top": results[:100],
+    }, indent=2), encoding="utf-8")
+    print(f"\nSaved tuning report to: {out_path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,250 @@
+import json
+import sys
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Sequence, Tuple
+
+# Quality + latency gate for retrieval changes (fusion weights, thresholds, candidate depth, faster
+# approximate search...). GOLDEN_FILE stores, per prompts.txt prompt, the production query (production_query:
+# text, plus the composed vector when a composer is configured) and filters from slot filling and the
+# golden top-K product ids. A check re-ranks those stored inputs with the current
+# code and RETRIEVAL_PARAMS (+ PARAM_OVERRIDES), scores the rankings against the golden ones
+# (recall@K, graded nDCG@K) and times retrieve_and_rank_hybrid (p95 over REPEATS passes), and exits
+# with code 1 when quality drops or p95 grows past the tolerances below. Slot filling is not re-run,
+# so only retrieval is gated. The golden file is written when missing or with UPDATE_GOLDEN
+# (commit it; its latency reference is only meaningful on the machine that wrote it).
+# Run from the repo root: python src/test/regression_gate.py
+CURRENT_DIR = Path(__file__).resolve().parent
+PROJECT_ROOT = CURRENT_DIR.parents[1]
+SRC_DIR = PROJECT_ROOT / "src"
+
+if str(PROJECT_ROOT) not in sys.path:
+    sys.path.insert(0, str(PROJECT_ROOT))
+if str(SRC_DIR) not in sys.path:
+    sys.path.insert(0, str(SRC_DIR))
+
+import numpy as np
+
+from benchmark import bench_stage, git_commit, stub_llm
+from chatbot import chatbot_runner
+from chatbot.chatbot_runner import DB_PATH, ChatResources, catalog_version, production_query, retrieve_and_rank_hybrid
+from evaluator import PROMPTS_FILE, RETRIEVAL_PARAMS, fill_state, load_prompts
+
+GOLDEN_FILE = CURRENT_DIR / "golden_rankings.json"
+REPORT_DIR = "data/eval"
+
+UPDATE_GOLDEN = False
+STUB_LLM = True  # golden queries from the deterministic slot-filling stand-in (benchmark.py) instead of the model
+
+K = 10
+PARAM_OVERRIDES: Dict[str, Any] = {}  # e.g. {"alpha": 0.4, "candidate_limit": 200}
+
+WARMUP_PASSES = 1
+REPEATS = 5
+
+# the check fails when any of these is exceeded
+RECALL_TOLERANCE = 0.02   # mean recall@K may fall at most this far below 1.0 (the golden rankings themselves)
+NDCG_TOLERANCE = 0.02     # same for mean nDCG@K
+MIN_PROMPT_RECALL = 0.5   # no single prompt may keep less than this share of its golden top-K
+P95_TOLERANCE = 0.15      # p95 latency may grow by at most this fraction of the golden p95...
+MIN_DELTA_MS = 0.5        # ...and differences below this are noise
+
+MAX_SHOWN = 10
+
+
+# ----------------------------
+# Ranking metrics
+# ----------------------------
+def recall_at_k(golden: Sequence[int], ranked: Sequence[int], k: int) -> float:
+    golden = list(golden[:k])
+    if not golden:
+        return 1.0 if not ranked else 0.0
+    return len(set(golden) & set(ranked[:k])) / len(golden)
+
+
+def ndcg_at_k(golden: Sequence[int], ranked: Sequence[int], k: int) -> float:
+    # graded relevance from the golden rank: the golden #1 is worth k, the golden #k is worth 1
+    rel = {pid: k - r for r, pid in enumerate(golden[:k])}
+    if not rel:
+        return 1.0 if not ranked else 0.0
+    discounts = 1.0 / np.log2(np.arange(2, k + 2))
+    dcg = sum(rel.get(pid, 0) * discounts[i] for i, pid in enumerate(ranked[:k]))
+    ideal = sum(sorted(rel.values(), reverse=True)[i] * discounts[i] for i in range(len(rel)))
+    return float(dcg / ideal)
+
+
+# ----------------------------
+# Golden rankings
+# ----------------------------
+def retrieval_params(k: int) -> Dict[str, Any]:
+    params = dict(RETRIEVAL_PARAMS, **PARAM_OVERRIDES)
+    params["return_k"] = max(k, params["return_k"])
+    return params
+
+
+def rank_cases(
+    res: ChatResources, cases: List[Dict[str, Any]], params: Dict[str, Any], k: int,
+) -> Tuple[List[List[Tuple[int, float]]], Dict[str, Any]]:
+    """
+    Rank every case's stored query + filters; returns the top-k rankings [(id, score)] and the latency stats.
+    """
+    def retrieve(case: Dict[str, Any]) -> List[Tuple[int, float]]:
+        pmin, pmax, gender = case["filters"]
+        query_vec = np.asarray(case["query_vec"], dtype=np.float32) if case.get("query_vec") is not None else None
+        results, _ = retrieve_and_rank_hybrid(
+            conn=res.conn,
+            embedder=res.embedder,
+            desc_index=res.desc_index,
+            user_query=case["query"],
+            price_min=pmin,
+            price_max=pmax,
+            gender=gender,
+            kw_matrix=res.kw_matrix,
+            query_vec=query_vec,
+            **params,
+        )
+        return [(p.id, p.score) for p in results[:k]]
+
+    rankings = [retrieve(c) for c in cases]
+    latency = bench_stage(retrieve, cases, warmup=WARMUP_PASSES, repeats=REPEATS)
+    return rankings, latency
+
+
+def build_golden(res: ChatResources, prompts: List[str]) -> Dict[str, Any]:
+    if STUB_LLM:
+        chatbot_runner._run_llm = stub_llm
+    cases = []
+    for prompt in prompts:
+        state, fallback_used, _ = fill_state(prompt, res.embedder)
+        query, query_vec = production_query(state, prompt, res.composer)
+        cases.append({
+            "prompt": prompt,
+            "query": query,
+            "query_vec": None if query_vec is None else [float(x) for x in query_vec],
+            "filters": [state.price_min, state.price_max, state.gender],
+            "fallback_used": fallback_used,
+        })
+
+    params = retrieval_params(K)
+    rankings, latency = rank_cases(res, cases, params, K)
+    for case, ranked in zip(cases, rankings):
+        case["top"] = [pid for pid, _ in ranked]
+        case["scores"] = [round(s, 6) for _, s in ranked]
+    return {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "git_commit": git_commit(),
+        "k": K,
+        "llm": "stub" if STUB_LLM else chatbot_runner.LOCAL_MODEL,
+        "catalog": {"db_path": DB_PATH, "version": catalog_version(res.conn)},
+        "retrieval": params,
+        "latency": latency,
+        "cases": cases,
+    }
+
+
+# ----------------------------
+# Check
+# ----------------------------
+def check(res: ChatResources, golden: Dict[str, Any]) -> Dict[str, Any]:
+    k = golden["k"]
+    params = retrieval_params(k)
+    rankings, latency = rank_cases(res, golden["cases"], params, k)
+
+    per_prompt = []
+    for case, ranked in zip(golden["cases"], rankings):
+        ids = [pid for pid, _ in ranked]
+        per_prompt.append({
+            "prompt": case["prompt"],
+            "recall": round(recall_at_k(case["top"], ids, k), 4),
+            "ndcg": round(ndcg_at_k(case["top"], ids, k), 4),
+            "golden": case["top"],
+            "ranked": ids,
+        })
+
+    mean_recall = float(np.mean([p["recall"] for p in per_prompt])) if per_prompt else 1.0
+    mean_ndcg = float(np.mean([p["ndcg"] for p in per_prompt])) if per_prompt else 1.0
+    low = [p for p in per_prompt if p["recall"] < MIN_PROMPT_RECALL]
+    base_p95 = golden["latency"]["p95_ms"]
+
+    failures = []
+    if mean_recall < 1.0 - RECALL_TOLERANCE:
+        failures.append(f"mean recall@{k} {mean_recall:.4f} < {1.0 - RECALL_TOLERANCE:.4f}")
+    if mean_ndcg < 1.0 - NDCG_TOLERANCE:
+        failures.append(f"mean nDCG@{k} {mean_ndcg:.4f} < {1.0 - NDCG_TOLERANCE:.4f}")
+    if low:
+        failures.append(f"{len(low)} prompts with recall@{k} below {MIN_PROMPT_RECALL}")
+    if latency["p95_ms"] > base_p95 * (1.0 + P95_TOLERANCE) and latency["p95_ms"] - base_p95 >= MIN_DELTA_MS:
+        failures.append(f"p95 {latency['p95_ms']:.3f} ms vs golden {base_p95:.3f} ms (+{latency['p95_ms'] / base_p95 - 1.0:.0%})")
+
+    return {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "git_commit": git_commit(),
+        "golden_file": str(GOLDEN_FILE),
+        "golden_commit": golden.get("git_commit"),
+        "k": k,
+        "retrieval": params,
+        "changed_params": {name: [golden["retrieval"].get(name), v] for name, v in params.items() if golden["retrieval"].get(name) != v},
+        "mean_recall": round(mean_recall, 4),
+        "mean_ndcg": round(mean_ndcg, 4),
+        "latency": latency,
+        "golden_latency": golden["latency"],
+        "failures": failures,
+        "per_prompt": per_prompt,
+    }
+
+
+def main() -> None:
+    prompts = load_prompts(PROMPTS_FILE)
+    chatbot_runner.TRACE_PATH = None
+    res = ChatResources.load()
+
+    if UPDATE_GOLDEN or not GOLDEN_FILE.exists():
+        print(f"Writing golden top-{K} rankings for {len(prompts)} prompts from {PROMPTS_FILE}")
+        golden = build_golden(res, prompts)
+        res.close()
+        GOLDEN_FILE.write_text(json.dumps(golden, indent=2, ensure_ascii=False), encoding="utf-8")
+        print(f"Golden p95 {golden['latency']['p95_ms']:.3f} ms over {golden['latency']['calls']} calls")
+        print(f"Saved golden rankings to: {GOLDEN_FILE}")
+        return
+
+    golden = json.loads(GOLDEN_FILE.read_text(encoding="utf-8"))
+    if golden["catalog"]["version"] != catalog_version(res.conn):
+        print(f"Warning: {GOLDEN_FILE} was written for catalog version {golden['catalog']['version']}, "
+              f"the database is at {catalog_version(res.conn)}; rankings can differ for that reason alone")
+    known = {c["prompt"] for c in golden["cases"]}
+    missing = [p for p in prompts if p not in known]
+    if missing:
+        print(f"Note: {len(missing)} prompts have no golden ranking (set UPDATE_GOLDEN to add them)")
+
+    print(f"Checking {len(golden['cases'])} golden rankings (k={golden['k']}) from {GOLDEN_FILE}")
+    report = check(res, golden)
+    res.close()
+
+    for name, (old, new) in report["changed_params"].items():
+        print(f"  {name}: {old} -> {new}")
+    lat, base = report["latency"], report["golden_latency"]
+    print(f"\nrecall@{report['k']} {report['mean_recall']:.4f}   nDCG@{report['k']} {report['mean_ndcg']:.4f}")
+    print(f"p50 {lat['p50_ms']:.3f} ms (golden {base['p50_ms']:.3f})   p95 {lat['p95_ms']:.3f} ms (golden {base['p95_ms']:.3f})")
+
+    worst = sorted(report["per_prompt"], key=lambda p: (p["recall"], p["ndcg"]))[:MAX_SHOWN]
+    worst = [p for p in worst if p["recall"] < 1.0 or p["ndcg"] < 1.0]
+    if worst:
+        print(f"\n{'recall':>8}{'nDCG':>8}  prompt")
+        for p in worst:
+            print(f"{p['recall']:>8.3f}{p['ndcg']:>8.3f}  {p['prompt']}")
+
+    Path(REPORT_DIR).mkdir(parents=True, exist_ok=True)
+    out_path = Path(REPORT_DIR) / f"gate-{time.strftime('%Y%m%dT%H%M%S')}.json"
+    out_path.write_text(json.dumps(report, indent=2, ensure_ascii=False), encoding="utf-8")
+    print(f"\nSaved gate report to: {out_path}")
+
+    if report["failures"]:
+        print("\nFAILED:")
+        for f in report["failures"]:
+            print(f"  {f}")
+        raise SystemExit(1)
+    print("\nPASSED")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,216 @@
+import json
+import sys
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+# Replays recorded chat traffic (see chatbot/traffic.py; record with TRACE_PATH in chatbot_runner.py)
+# against the current code: every recorded session is re-run turn by turn in a fresh ChatSession.
+# With USE_RECORDED_LLM the LLM answers from the recording (no model is loaded), so any change in the
+# results comes from slot merging / retrieval code. Recorded fill_slots/total times include generation,
+# replayed ones then do not: both are also compared without it (*_ex_llm; generation alone is "llm").
+# Prints per-stage latency percentiles (recorded vs replayed) and the turns whose question, state or
+# ranking changed, and writes the full report as JSON. Run from the repo root: python src/test/replay_traces.py
+CURRENT_DIR = Path(__file__).resolve().parent
+PROJECT_ROOT = CURRENT_DIR.parents[1]
+SRC_DIR = PROJECT_ROOT / "src"
+
+if str(SRC_DIR) not in sys.path:
+    sys.path.insert(0, str(SRC_DIR))
+
+from chatbot import chatbot_runner
+from chatbot.chatbot_runner import ChatResources, ChatSession
+from chatbot.traffic import group_sessions, read_traces
+
+TRACE_FILE = "data/traces/turns.jsonl"
+REPORT_FILE = "data/traces/replay_report.json"
+
+USE_RECORDED_LLM = True
+TOP_K = 5             # ranks compared per turn
+SCORE_TOL = 1e-4      # score changes below this are not reported
+MAX_DIFFS_SHOWN = 20
+
+
+def percentile(values: List[float], p: float) -> float:
+    s = sorted(values)
+    k = min(len(s) - 1, max(0, round(p / 100.0 * (len(s) - 1))))
+    return s[k]
+
+
+def latency_summary(values: List[float]) -> Dict[str, float]:
+    if not values:
+        return {"count": 0}
+    return {
+        "count": len(values),
+        "mean_ms": round(sum(values) / len(values), 3),
+        "p50_ms": round(percentile(values, 50), 3),
+        "p95_ms": round(percentile(values, 95), 3),
+        "p99_ms": round(percentile(values, 99), 3),
+    }
+
+
+# ----------------------------
+# Turn comparison
+# ----------------------------
+def ranking_diff(old: List[List[float]], new: List[List[float]], k: int) -> Optional[Dict[str, Any]]:
+    old_ids = [int(i) for i, _ in old[:k]]
+    new_ids = [int(i) for i, _ in new[:k]]
+    old_scores = {int(i): s for i, s in old[:k]}
+    new_scores = {int(i): s for i, s in new[:k]}
+    score_delta = max((abs(old_scores[i] - new_scores[i]) for i in old_scores.keys() & new_scores.keys()), default=0.0)
+
+    if old_ids == new_ids and score_delta <= SCORE_TOL:
+        return None
+    first_rank = next((r for r, (a, b) in enumerate(zip(old_ids, new_ids), 1) if a != b), None)
+    if first_rank is None and len(old_ids) != len(new_ids):
+        first_rank = min(len(old_ids), len(new_ids)) + 1
+    return {
+        "same_order": old_ids == new_ids,
+        "first_changed_rank": first_rank,
+        "overlap": round(len(set(old_ids) & set(new_ids)) / max(1, len(old_ids), len(new_ids)), 3),
+        "max_score_delta": round(score_delta, 6),
+        "recorded": old_ids,
+        "replayed": new_ids,
+    }
+
+
+def compare_turn(old: Dict[str, Any], new: Dict[str, Any]) -> Dict[str, Any]:
+    diff: Dict[str, Any] = {}
+    if old["kind"] != new["kind"]:
+        diff["kind"] = [old["kind"], new["kind"]]
+    if old.get("question") != new.get("question"):
+        diff["question"] = [old.get("question"), new.get("question")]
+    if old.get("state_after") != new.get("state_after"):
+        diff["state_after"] = [old.get("state_after"), new.get("state_after")]
+    if [e["stage"] for e in old.get("llm", [])] != [e["stage"] for e in new.get("llm", [])]:
+        diff["llm_calls"] = [[e["stage"] for e in old.get("llm", [])], [e["stage"] for e in new.get("llm", [])]]
+    ranking = ranking_diff(old.get("results", []), new.get("results", []), TOP_K)
+    if ranking is not None:
+        diff["ranking"] = ranking
+    return diff
+
+
+# ----------------------------
+# Replay
+# ----------------------------
+def replay_session(res: ChatResources, sid: str, turns: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Re-run one recorded session; returns one entry per turn: {"turn", "input", "old", "new"|"error", "diff"}.
+    A turn that raises ends the session (the following turns would start from a different state),
+    unless it raised when it was recorded too: the live session went on after it, so the replay does as well.
+    """
+    session = ChatSession(res)
+    out: List[Dict[str, Any]] = []
+    for rec in turns:
+        entry: Dict[str, Any] = {"sid": sid, "turn": rec["turn"], "input": rec["input"], "old": rec}
+        replay_llm = rec.get("llm", []) if USE_RECORDED_LLM else None
+        try:
+            result = session.turn(rec["input"], tags={"session_id": sid}, trace=True, replay_llm=replay_llm)
+        except Exception as e:
+            entry["error"] = repr(e)
+            out.append(entry)
+            if rec.get("kind") == "error":
+                continue
+            break
+        entry["new"] = result.trace
+        entry["diff"] = compare_turn(rec, result.trace)
+        out.append(entry)
+    return out
+
+
+def stage_ms(rec: Dict[str, Any]) -> Dict[str, float]:
+    # stage timings of one trace record, plus fill_slots/total without LLM generation time
+    ms = dict(rec.get("ms", {}))
+    timed = [e["ms"] for e in rec.get("llm", []) if "ms" in e]
+    llm_ms = sum(timed)
+    if timed:
+        ms["llm"] = round(llm_ms, 3)
+    for stage in ("fill_slots", "total"):
+        if stage in ms:
+            ms[f"{stage}_ex_llm"] = round(max(0.0, ms[stage] - llm_ms), 3)
+    return ms
+
+
+def stage_latencies(entries: List[Dict[str, Any]], side: str) -> Dict[str, Dict[str, float]]:
+    per_stage: Dict[str, List[float]] = {}
+    for e in entries:
+        rec = e.get(side)
+        if rec is None:
+            continue
+        for stage, ms in stage_ms(rec).items():
+            per_stage.setdefault(stage, []).append(ms)
+    return {stage: latency_summary(v) for stage, v in sorted(per_stage.items())}
+
+
+def main() -> None:
+    records = list(read_traces(TRACE_FILE))
+    sessions = group_sessions(records)
+    print(f"Replaying {len(records)} turns from {len(sessions)} sessions in {TRACE_FILE}"
+          f" ({'recorded' if USE_RECORDED_LLM else 'live'} LLM outputs)")
+    if any(r.get("v", 1) < 2 for r in records):
+        print("Note: version 1 trace lines carry no LLM generation time; their *_ex_llm latencies still include it")
+
+    chatbot_runner.TRACE_PATH = None  # do not append the replay to the trace being read
+    res = ChatResources.load()
+
+    started = time.perf_counter()
+    entries: List[Dict[str, Any]] = []
+    for sid, turns in sessions.items():
+        entries.extend(replay_session(res, sid, turns))
+    replay_s = time.perf_counter() - started
+    res.close()
+
+    replayed = [e for e in entries if "new" in e]
+    changed = [e for e in replayed if e["diff"]]
+    errors = [e for e in entries if "error" in e and e["old"].get("kind") != "error"]
+    reproduced_errors = [e for e in entries if "error" in e and e["old"].get("kind") == "error"]
+    ranked = [e for e in replayed if e["old"].get("results") or e["new"].get("results")]
+    ranking_changed = [e for e in ranked if "ranking" in e["diff"]]
+
+    recorded_ms = stage_latencies(entries, "old")
+    replayed_ms = stage_latencies(entries, "new")
+    report = {
+        "trace_file": TRACE_FILE,
+        "recorded_llm": USE_RECORDED_LLM,
+        "sessions": len(sessions),
+        "turns": len(records),
+        "replayed_turns": len(replayed),
+        "skipped_turns": len(records) - len(entries),
+        "errors": len(errors),
+        "reproduced_errors": len(reproduced_errors),
+        "changed_turns": len(changed),
+        "ranked_turns": len(ranked),
+        "ranking_changed": len(ranking_changed),
+        "replay_s": round(replay_s, 3),
+        "latency": {"recorded": recorded_ms, "replayed": replayed_ms},
+        "diffs": [
+            {"sid": e["sid"], "turn": e["turn"], "input": e["input"], **({"error": e["error"]} if "error" in e else e["diff"])}
+            for e in entries if "error" in e or e["diff"]
+        ],
+    }
+
+    print(f"\nReplayed {len(replayed)}/{len(records)} turns in {replay_s:.2f}s: "
+          f"{len(changed)} changed, {len(ranking_changed)}/{len(ranked)} rankings changed, {len(errors)} errors"
+          f" ({len(reproduced_errors)} recorded turns failed again)")
+    print(f"\n{'stage':<20}{'n':>6}{'rec p50':>10}{'rec p95':>10}{'new p50':>10}{'new p95':>10}{'new p99':>10}")
+    for stage in sorted(recorded_ms.keys() | replayed_ms.keys()):
+        old, new = recorded_ms.get(stage, {}), replayed_ms.get(stage, {})
+        print(f"{stage:<20}{new.get('count', 0):>6}"
+              f"{old.get('p50_ms', float('nan')):>10.2f}{old.get('p95_ms', float('nan')):>10.2f}"
+              f"{new.get('p50_ms', float('nan')):>10.2f}{new.get('p95_ms', float('nan')):>10.2f}{new.get('p99_ms', float('nan')):>10.2f}")
+
+    for d in report["diffs"][:MAX_DIFFS_SHOWN]:
+        print(f"\n[{d['sid'][:12]} turn {d['turn']}] {d['input']!r}")
+        for key, value in d.items():
+            if key not in ("sid", "turn", "input"):
+                print(f"  {key}: {value}")
+    if len(report["diffs"]) > MAX_DIFFS_SHOWN:
+        print(f"\n... {len(report['diffs']) - MAX_DIFFS_SHOWN} more in the report")
+
+    Path(REPORT_FILE).parent.mkdir(parents=True, exist_ok=True)
+    Path(REPORT_FILE).write_text(json.dumps(report, indent=2, ensure_ascii=False), encoding="utf-8")
+    print(f"\nSaved replay report to: {REPORT_FILE}")
+
+
+if __name__ == "__main__":
+    main()